@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+artifact_server.py — Servidor HTTP de produção para as playlists/EPG publicadas pelo get_streams.py (HTTP_SERVER_MODE=workers).
+
+O get_streams.py renderiza cada artefato uma vez por versão do estado e publica em HTTP_PUBLISH_DIRECTORY:
+arquivos imutáveis (corpo e gzip, nome com o ETag) + manifest.json substituído atomicamente. Este app WSGI
+só lê esses arquivos (nada de renderização nem API), então roda em vários processos/threads fora do GIL do agendador.
+Mesmo contrato HTTP do servidor Flask embutido: ETag/If-None-Match, If-Modified-Since, gzip, Vary, HEAD.
+
+Execução (o get_streams.py faz isso sozinho no modo workers):
+    python artifact_server.py --publish-dir http_artifacts --bind 0.0.0.0:8888 --workers 4 --threads 8
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:8888 --chdir DOC 'artifact_server:create_app("http_artifacts")'
+Usa gunicorn (processos) se instalado, senão waitress (threads), senão o servidor com threads da biblioteca padrão.
+Nenhum dos dois vem na imagem Docker: sem 'pip install gunicorn' (ou 'apk add py3-gunicorn') o modo workers é um processo só.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+class PublishedArtifacts:
+    """Manifest + corpos em memória; recarrega quando o manifest.json muda (inode/mtime), checado a cada requisição."""
+    def __init__(self, publish_dir: Path):
+        self.publish_dir = Path(publish_dir); self._lock = threading.Lock()
+        self._identity: Optional[Tuple[int, int, int]] = None; self._routes: Dict[str, Dict[str, Any]] = {}; self._published_at: Optional[float] = None
+        self._blobs: Dict[str, bytes] = {} # Arquivo (imutável, nome com ETag) -> conteúdo
+    def _manifest_identity(self) -> Optional[Tuple[int, int, int]]:
+        try: st = os.stat(self.publish_dir / MANIFEST_FILENAME); return st.st_ino, st.st_mtime_ns, st.st_size
+        except OSError: return None
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        identity = self._manifest_identity()
+        if identity == self._identity: return self._routes
+        with self._lock:
+            if identity == self._identity: return self._routes
+            if identity is None: self._identity, self._routes, self._blobs = None, {}, {}; return self._routes
+            try: manifest = json.loads((self.publish_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"[artifact_server] manifest ilegível ({e}); mantendo o anterior.", file=sys.stderr); return self._routes
+            if manifest.get("format") != MANIFEST_FORMAT: print(f"[artifact_server] formato de manifest desconhecido: {manifest.get('format')}", file=sys.stderr); return self._routes
+            routes = {}; blobs = {}
+            for route, entry in manifest.get("artifacts", {}).items():
+                try:
+                    for key in ("body", "gzip"): blobs[entry[key]] = self._blobs.get(entry[key]) or (self.publish_dir / entry[key]).read_bytes()
+                except (OSError, KeyError) as e: print(f"[artifact_server] artefato '{route}' indisponível ({e}).", file=sys.stderr); continue
+                routes[route] = dict(entry, last_modified_ts=parsedate_to_datetime(entry["last_modified"]).timestamp())
+            self._identity, self._routes, self._blobs, self._published_at = identity, routes, blobs, manifest.get("published_at")
+            return routes
+    def blob(self, name: str) -> bytes: return self._blobs[name]
+    @property
+    def published_at(self) -> Optional[float]: return self._published_at
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*": return True
+    return any(candidate.strip().removeprefix("W/").strip('"') == etag for candidate in header.split(","))
+
+def _accepts_gzip(header: str) -> bool:
+    """Accept-Encoding com qualidade (RFC 7231): 'gzip;q=0' recusa; sem 'gzip' listado vale o '*'."""
+    qualities: Dict[str, float] = {}
+    for item in header.lower().split(","):
+        coding, _, params = item.partition(";"); coding = coding.strip(); q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try: q = float(value)
+                except ValueError: q = 0.0
+        if coding: qualities[coding] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+def _not_modified(environ: Dict[str, Any], entry: Dict[str, Any], etag: str) -> bool:
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match: return _etag_matches(if_none_match, etag)
+    if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if not if_modified_since: return False
+    try: return entry["last_modified_ts"] <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError): return False
+
+def create_app(publish_dir: Optional[str] = None):
+    """App WSGI; 'publish_dir' relativo à pasta deste script (padrão: HTTP_PUBLISH_DIRECTORY do ambiente ou 'http_artifacts')."""
+    directory = Path(publish_dir or os.getenv("HTTP_PUBLISH_DIRECTORY", "http_artifacts"))
+    artifacts = PublishedArtifacts(directory if directory.is_absolute() else SCRIPT_DIR / directory)
+
+    def app(environ, start_response):
+        path = environ.get("PATH_INFO") or "/"; method = environ.get("REQUEST_METHOD", "GET")
+        routes = artifacts.snapshot()
+        if path == "/healthz":
+            age = time.time() - artifacts.published_at if artifacts.published_at else None; ok = bool(routes)
+            body = json.dumps({"ok": ok, "artifacts": sorted(routes), "manifest_age_seconds": round(age, 1) if age is not None else None}).encode("utf-8")
+            start_response("200 OK" if ok else "503 Service Unavailable", [("Content-Type", "application/json"), ("Content-Length", str(len(body))), ("Cache-Control", "no-store")])
+            return [body]
+        entry = routes.get(path)
+        if entry is None:
+            start_response("404 Not Found", [("Content-Type", "text/plain"), ("Content-Length", "10")]); return [b"Not Found\n"]
+        if method not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [("Allow", "GET, HEAD"), ("Content-Length", "0")]); return [b""]
+        use_gzip = _accepts_gzip(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        etag = entry["etag_gzip"] if use_gzip else entry["etag"]
+        headers: List[Tuple[str, str]] = [("ETag", f'"{etag}"'), ("Last-Modified", entry["last_modified"]), ("Vary", "Accept-Encoding"), ("Cache-Control", "no-cache")]
+        if _not_modified(environ, entry, etag): start_response("304 Not Modified", headers); return [b""]
+        body = artifacts.blob(entry["gzip"] if use_gzip else entry["body"])
+        headers += [("Content-Type", entry["mimetype"]), ("Content-Length", str(len(body)))] + ([("Content-Encoding", "gzip")] if use_gzip else [])
+        start_response("200 OK", headers)
+        return [b""] if method == "HEAD" else [body]
+    return app
+
+app = create_app()
+
+def serve(app_factory_arg: str, host: str, port: int, workers: int, threads: int):
+    """gunicorn (workers processos x threads) > waitress (threads) > wsgiref com threads (biblioteca padrão)."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError: BaseApplication = None
+    if BaseApplication is not None:
+        class ArtifactApplication(BaseApplication):
+            def load_config(self):
+                for key, value in {"bind": f"{host}:{port}", "workers": max(workers, 1), "threads": max(threads, 1), "worker_class": "gthread" if threads > 1 else "sync",
+                                   "accesslog": None, "errorlog": "-", "loglevel": "warning", "keepalive": 5}.items(): self.cfg.set(key, value)
+            def load(self): return create_app(app_factory_arg)
+        print(f"[artifact_server] gunicorn em {host}:{port} ({workers} processo(s) x {threads} thread(s))", file=sys.stderr, flush=True)
+        ArtifactApplication().run(); return
+    try:
+        import waitress
+    except ImportError: waitress = None
+    if waitress is not None:
+        print(f"[artifact_server] waitress em {host}:{port} ({threads} thread(s); gunicorn não instalado)", file=sys.stderr, flush=True)
+        waitress.serve(create_app(app_factory_arg), host=host, port=port, threads=max(threads, 1), ident=None); return
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer): daemon_threads = True
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args): pass
+    print(f"[artifact_server] servidor da biblioteca padrão em {host}:{port} (instale gunicorn ou waitress para produção)", file=sys.stderr, flush=True)
+    make_server(host, port, create_app(app_factory_arg), server_class=ThreadingWSGIServer, handler_class=QuietHandler).serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor HTTP das playlists/EPG publicadas pelo get_streams.py")
+    parser.add_argument("--publish-dir", default=os.getenv("HTTP_PUBLISH_DIRECTORY", "http_artifacts"))
+    parser.add_argument("--bind", default="0.0.0.0:8888", help="host:porta"); parser.add_argument("--workers", type=int, default=4); parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    host, _, port = args.bind.rpartition(":")
+    serve(args.publish_dir, host or "0.0.0.0", int(port), args.workers, args.threads)
+
+if __name__ == "__main__":
+    main()
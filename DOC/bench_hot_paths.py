@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_hot_paths.py — Micro-benchmarks dos caminhos quentes de geração e estado do get_streams.py.
+
+Para cada tamanho (padrão 1k/10k/100k streams) mede tempo (mediana de --repeat execuções) e pico de memória
+(tracemalloc, execução separada) de: generate_playlist (live/upcoming/vod), generate_xml, _get_display_title,
+_clean_text_for_xml, update_streams, prune_ended_streams, save_to_disk e load_from_disk.
+A preparação de cada execução (estado novo, payloads) fica fora da medição.
+
+Baselines: --save-baseline arquivo.json grava os resultados; --compare arquivo.json mostra a variação e
+termina com código 1 se alguma operação ficou mais lenta que --threshold (%).
+
+Uso: python bench_hot_paths.py [--sizes 1000,10000,100000] [--channels 200] [--repeat 3] [--only xml,save]
+                               [--backend json|sqlite] [--unicode-ratio 0.3] [--save-baseline b.json] [--compare b.json]
+"""
+import argparse
+import gc
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from bench_synthetic import get_streams, make_state, make_streams
+
+CATEGORIES_DB = {"17": "Esportes", "20": "Jogos", "24": "Entretenimento"}
+
+def _backend_for(kind: str, directory: Path):
+    if kind == "sqlite": return get_streams.SQLiteStateBackend(directory / "state_cache.db")
+    return get_streams.JSONStateBackend(directory / "state_cache.json")
+
+def build_operations(args):
+    """Cada operação: nome -> (setup(streams, tmp_dir) -> contexto, run(contexto), teardown(contexto) ou None)."""
+    def fresh_state(streams, tmp_dir): return make_state(streams, tmp_dir / "state_cache.json", backend=_backend_for(args.backend, tmp_dir))
+    def close_state(state): state.backend.close()
+    def playlist(mode):
+        def setup(streams, tmp_dir): state = fresh_state(streams, tmp_dir); return state, get_streams.M3UGenerator(state)
+        return setup, lambda ctx: ctx[1].generate_playlist(ctx[0].get_all_streams(), CATEGORIES_DB, mode), lambda ctx: close_state(ctx[0])
+    def xml_setup(streams, tmp_dir): state = fresh_state(streams, tmp_dir); return state, get_streams.XMLTVGenerator(state)
+    def titles_setup(streams, tmp_dir): return get_streams.M3UGenerator(), [get_streams.StreamRecord(s) for s in streams]
+    def clean_setup(streams, tmp_dir):
+        return get_streams.XMLTVGenerator(), [text for s in streams for text in (s["title_original"], s["description"], s["channel_name"])]
+    def update_setup(streams, tmp_dir):
+        # ~10% dos streams mudam (título/status), como em um ciclo do agendador; inclui a poda chamada por update_streams
+        state = fresh_state(streams, tmp_dir)
+        payload = [dict(s, title_original=s["title_original"] + " (atualizado)", status="none" if s["status"] == "live" else s["status"],
+                        actual_end_time_utc=s["actual_end_time_utc"] or (datetime.now(timezone.utc) if s["status"] == "live" else None))
+                   for s in streams[::10]]
+        return state, payload
+    def save_setup(streams, tmp_dir): return fresh_state(streams, tmp_dir)
+    def load_setup(streams, tmp_dir):
+        saved = fresh_state(streams, tmp_dir); saved.save_to_disk(); close_state(saved)
+        return get_streams.StateManager(tmp_dir / "state_cache.json", backend=_backend_for(args.backend, tmp_dir))
+    return {
+        "generate_playlist[live]": playlist("live"), "generate_playlist[upcoming]": playlist("upcoming"), "generate_playlist[vod]": playlist("vod"),
+        "generate_xml": (xml_setup, lambda ctx: ctx[1].generate_xml(ctx[0].get_all_channels(), ctx[0].get_all_streams(), CATEGORIES_DB), lambda ctx: close_state(ctx[0])),
+        "_get_display_title": (titles_setup, lambda ctx: [ctx[0]._get_display_title(s) for s in ctx[1]], None),
+        "_clean_text_for_xml": (clean_setup, lambda ctx: [ctx[0]._clean_text_for_xml(t) for t in ctx[1]], None),
+        "update_streams": (update_setup, lambda ctx: ctx[0].update_streams(ctx[1]), lambda ctx: close_state(ctx[0])),
+        "prune_ended_streams": (save_setup, lambda state: state.prune_ended_streams(), close_state),
+        f"save_to_disk[{args.backend}]": (save_setup, lambda state: state.save_to_disk(), close_state),
+        f"load_from_disk[{args.backend}]": (load_setup, lambda state: state.load_from_disk(), close_state),
+    }
+
+def measure(setup, run, teardown, streams, repeat: int):
+    """Mediana de tempo (sem tracemalloc) e pico de memória da operação (execução extra com tracemalloc)."""
+    samples = []; peak = 0
+    for attempt in range(repeat + 1):
+        tmp_dir = Path(tempfile.mkdtemp(prefix="bench_hot_"))
+        try:
+            ctx = setup(streams, tmp_dir); gc.collect()
+            if attempt < repeat:
+                started = time.perf_counter(); run(ctx); samples.append(time.perf_counter() - started)
+            else:
+                tracemalloc.start(); tracemalloc.reset_peak(); base = tracemalloc.get_traced_memory()[0]
+                run(ctx); peak = tracemalloc.get_traced_memory()[1] - base; tracemalloc.stop()
+            if teardown: teardown(ctx)
+        finally: shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {"seconds": statistics.median(samples), "peak_bytes": peak, "samples": len(samples)}
+
+def _git_revision() -> str:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent, capture_output=True, text=True, timeout=5).stdout.strip() or "?"
+    except (OSError, subprocess.TimeoutExpired): return "?"
+
+def compare(results, baseline_path: Path, threshold: float) -> bool:
+    """Imprime a variação contra a baseline; True se houve regressão de tempo acima do limite."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")); base_results = baseline.get("results", {}); regressed = False
+    print(f"\nComparação com {baseline_path} (rev {baseline.get('meta', {}).get('revision', '?')}, {baseline.get('meta', {}).get('created_at', '?')}), limite {threshold:.0f}%:")
+    print(f"{'operação':<40}{'base (ms)':>12}{'atual (ms)':>12}{'tempo':>9}{'memória':>9}")
+    for key, current in results.items():
+        base = base_results.get(key)
+        if not base: print(f"{key:<40}{'-':>12}{current['seconds'] * 1000:>12.2f}{'novo':>9}"); continue
+        time_delta = 100 * (current["seconds"] / max(base["seconds"], 1e-9) - 1); memory_delta = 100 * (current["peak_bytes"] / max(base["peak_bytes"], 1) - 1)
+        flag = " <- REGRESSÃO" if time_delta > threshold else ""; regressed = regressed or bool(flag)
+        print(f"{key:<40}{base['seconds'] * 1000:>12.2f}{current['seconds'] * 1000:>12.2f}{time_delta:>+8.1f}%{memory_delta:>+8.1f}%{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de geração (M3U/XMLTV) e estado do get_streams.py")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Quantidades de streams, separadas por vírgula")
+    parser.add_argument("--channels", type=int, default=200); parser.add_argument("--repeat", type=int, default=3); parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--status-mix", default="1,1,1", help="Pesos live,upcoming,none"); parser.add_argument("--description-chars", type=int, default=600)
+    parser.add_argument("--tags", type=int, default=3); parser.add_argument("--unicode-ratio", type=float, default=0.3)
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json"); parser.add_argument("--only", default="", help="Filtra operações cujo nome contenha um dos termos (vírgula)")
+    parser.add_argument("--save-baseline", type=Path); parser.add_argument("--compare", type=Path); parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    operations = build_operations(args); filters = [term for term in args.only.split(",") if term]
+    if filters: operations = {name: op for name, op in operations.items() if any(term in name for term in filters)}
+    status_mix = [float(weight) for weight in args.status_mix.split(",")]; results = {}
+    print(f"{'operação':<40}{'mediana (ms)':>14}{'pico (MiB)':>12}{'µs/stream':>11}")
+    for size in [int(value) for value in args.sizes.split(",") if value]:
+        streams = make_streams(size, args.channels, args.seed, status_mix, args.description_chars, args.tags, args.unicode_ratio)
+        for name, (setup, run, teardown) in operations.items():
+            result = measure(setup, run, teardown, streams, max(args.repeat, 1)); key = f"{name}@{size}"; results[key] = result
+            print(f"{key:<40}{result['seconds'] * 1000:>14.2f}{result['peak_bytes'] / 1048576:>12.2f}{result['seconds'] * 1e6 / size:>11.2f}", flush=True)
+        del streams; gc.collect()
+
+    if args.save_baseline:
+        meta = {"created_at": datetime.now(timezone.utc).isoformat(), "revision": _git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()}}
+        args.save_baseline.write_text(json.dumps({"meta": meta, "results": results}, indent=2), encoding="utf-8")
+        print(f"\nBaseline salva em {args.save_baseline}")
+    if args.compare and compare(results, args.compare, args.threshold): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
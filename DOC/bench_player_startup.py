@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_player_startup.py — Latência de consulta do smart_player por video_id:
+caminho antigo (json.load de state_cache.json + textos_epg.json) vs índice SQLite (player_index.db).
+
+Gera um estado sintético em um diretório temporário, publica os arquivos com save_files()
+e mede, para cada lookup, o custo "a frio" (arquivos abertos a cada execução, como em um novo processo)
+e o custo no modo daemon (conexão ao índice mantida aberta entre requisições).
+
+Uso: python bench_player_startup.py [--streams 20000] [--channels 200] [--lookups 50]
+"""
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("LOG_LEVEL", "WARNING"); os.environ["SMART_PLAYER_LOG_TO_FILE"] = "false"; os.environ["SMART_PLAYER_LOG_LEVEL"] = "ERROR"
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR))
+import get_streams  # noqa: E402
+from bench_synthetic import make_state, make_streams  # noqa: E402
+
+def load_smart_player():
+    spec = importlib.util.spec_from_file_location("smart_player", SCRIPT_DIR / "smart_player.py")
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    return module
+
+def timed(func, video_ids):
+    samples = []
+    for vid in video_ids:
+        started = time.perf_counter(); func(vid); samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latência de inicialização do smart_player")
+    parser.add_argument("--streams", type=int, default=20000); parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=50); parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_player_") as tmp:
+        tmp_dir = Path(tmp)
+        get_streams.PLAYLIST_SAVE_DIRECTORY = get_streams.XMLTV_SAVE_DIRECTORY = tmp
+        state = make_state(make_streams(args.streams, args.channels, args.seed), tmp_dir / "state_cache.json")
+        get_streams.save_files(state, {})
+
+        player = load_smart_player()
+        player.STATE_CACHE_PATH = tmp_dir / "state_cache.json"; player.TEXTS_CACHE_PATH = tmp_dir / get_streams.TEXTS_CACHE_FILENAME
+        video_ids = random.Random(args.seed).sample(sorted(state.streams), min(args.lookups, len(state.streams)))
+
+        def legacy_lookup(vid):
+            player.PLAYER_INDEX_PATH = None; player._json_cache.clear(); player.get_stream_status_from_cache(vid); player.get_texts_from_cache(vid)
+        def index_lookup(vid):
+            player.PLAYER_INDEX_PATH = tmp_dir / get_streams.PLAYER_INDEX_FILENAME; player._player_index_lookups.clear(); player._player_index_db = player.ReadOnlyDB()
+            player.get_stream_status_from_cache(vid); player.get_texts_from_cache(vid)
+        def daemon_lookup(vid): # Processo persistente: conexão ao índice já aberta
+            player.PLAYER_INDEX_PATH = tmp_dir / get_streams.PLAYER_INDEX_FILENAME; player._player_index_lookups.clear()
+            player.get_stream_status_from_cache(vid); player.get_texts_from_cache(vid)
+
+        results = {"json (antigo)": timed(legacy_lookup, video_ids), "player_index": timed(index_lookup, video_ids), "daemon": timed(daemon_lookup, video_ids)}
+        sizes = {"json (antigo)": (tmp_dir / "state_cache.json").stat().st_size + (tmp_dir / get_streams.TEXTS_CACHE_FILENAME).stat().st_size,
+                 "player_index": (tmp_dir / get_streams.PLAYER_INDEX_FILENAME).stat().st_size}; sizes["daemon"] = sizes["player_index"]
+
+    print(f"Streams: {args.streams} | Canais: {args.channels} | Lookups: {len(video_ids)}")
+    print(f"{'caminho':<16}{'arquivos (KiB)':>16}{'mediana (ms)':>14}{'p95 (ms)':>10}{'máx (ms)':>10}")
+    for name, samples in results.items():
+        samples.sort(); p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{name:<16}{sizes[name] / 1024:>16.0f}{statistics.median(samples):>14.2f}{p95:>10.2f}{samples[-1]:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_state_memory.py — Compara memória residente e custo de update do estado de streams:
+layout antigo (dict por stream, com copy()+update()) vs StreamRecord (__slots__, update in-place).
+
+Uso: python bench_state_memory.py [--streams 20000] [--channels 200] [--updates 5000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import get_streams  # noqa: E402
+from bench_synthetic import DESCRIPTION_SAMPLE, make_streams  # noqa: E402
+
+def measure(build):
+    gc.collect(); tracemalloc.start(); started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started; gc.collect(); current, _ = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    return result, current, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de memória: dict por stream vs StreamRecord")
+    parser.add_argument("--streams", type=int, default=20000); parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000); parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    dict_state, dict_bytes, dict_build = measure(lambda: {s["video_id"]: s for s in make_streams(args.streams, args.channels, args.seed)})
+    record_state, record_bytes, record_build = measure(lambda: {s["video_id"]: get_streams.StreamRecord(s) for s in make_streams(args.streams, args.channels, args.seed)})
+
+    rnd = random.Random(args.seed); ids = rnd.sample(sorted(dict_state), min(args.updates, len(dict_state)))
+    now = datetime.now(timezone.utc)
+    updates = [{"video_id": vid, "status": "none", "actual_end_time_utc": now, "fetch_time": now, "last_seen": now, "description": DESCRIPTION_SAMPLE} for vid in ids]
+
+    started = time.perf_counter()
+    for upd in updates: merged = dict_state[upd["video_id"]].copy(); merged.update(upd); dict_state[upd["video_id"]] = merged # Layout antigo
+    dict_update = time.perf_counter() - started
+    started = time.perf_counter()
+    for upd in updates: record_state[upd["video_id"]].update(upd) # StreamRecord: in-place
+    record_update = time.perf_counter() - started
+
+    print(f"Streams: {args.streams} | Canais: {args.channels} | Updates: {len(updates)}")
+    print(f"{'layout':<14}{'memória (MiB)':>15}{'bytes/stream':>14}{'build (s)':>11}{'update (ms)':>13}")
+    for name, size, build, update in (("dict", dict_bytes, dict_build, dict_update), ("StreamRecord", record_bytes, record_build, record_update)):
+        print(f"{name:<14}{size / 1048576:>15.2f}{size / max(args.streams, 1):>14.0f}{build:>11.3f}{update * 1000:>13.2f}")
+    print(f"Redução de memória: {100 * (1 - record_bytes / max(dict_bytes, 1)):.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_synthetic.py — Gerador de estado sintético compartilhado pelos benchmarks (bench_*.py).
+
+Streams no formato do APIScraper (dicts com datetimes), com canais, proporção por status,
+tamanho de descrição/tags e títulos com muito unicode configuráveis. Determinístico por 'seed'.
+Cada stream recebe strings novas (como chegam do JSON da API), sem compartilhamento entre dicts.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import get_streams  # noqa: E402
+
+DESCRIPTION_SAMPLE = ("Transmissão ao vivo da partida válida pela rodada do campeonato. "
+                      "Acompanhe a narração, os melhores momentos e a análise pós-jogo. Inscreva-se no canal! ") * 6
+UNICODE_FRAGMENTS = ("São Paulo × Grêmio", "⚽🔥 AO VIVO 🔴", "Ação/Reação — ½ final", "東京 vs 大阪", "Ñandú Çelik Øresund",
+                     "é combinado", "Ωmega «especial»", "👨‍👩‍👧 família", "​zero-width​", "Ｆｕｌｌｗｉｄｔｈ")
+TAG_SAMPLE = ("futebol", "ao vivo", "campeonato", "rodada", "gols", "melhores momentos", "narração", "análise", "esporte", "transmissão")
+STATUSES = ("live", "upcoming", "none")
+
+def make_streams(count: int, channels: int, seed: int = 1, status_mix: Sequence[float] = (1, 1, 1), description_chars: int = 600,
+                 tag_count: int = 3, unicode_ratio: float = 0.0, category_id: str = "17", now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """'status_mix' = pesos de (live, upcoming, none); 'description_chars' é o tamanho médio (±66%); 'unicode_ratio' = fração de títulos com unicode pesado."""
+    rnd = random.Random(seed); now = (now or datetime.now(timezone.utc)).replace(microsecond=0); streams = []
+    description_base = DESCRIPTION_SAMPLE * (description_chars // len(DESCRIPTION_SAMPLE) + 2)
+    for i in range(count):
+        vid = f"vid{i:08d}"; cid = "".join(["UC", f"{i % channels:022d}"])
+        status = rnd.choices(STATUSES, weights=status_mix)[0]
+        title = f"Jogo {i} - Time A x Time B: rodada {i % 38}"
+        if rnd.random() < unicode_ratio: title = " | ".join([title] + rnd.sample(UNICODE_FRAGMENTS, 3))
+        description_len = max(0, int(description_chars * rnd.uniform(0.34, 1.66)))
+        stream = {"video_id": vid, "channel_id": cid, "channel_name": "".join(["Canal ", str(i % channels)]),
+                  "title_original": title, "description": description_base[:description_len] + str(i),
+                  "tags": ["".join([TAG_SAMPLE[(i + k) % len(TAG_SAMPLE)]]) for k in range(tag_count - 1)] + [f"rodada {i % 38}"] if tag_count else [],
+                  "category_original": "".join([category_id]), "watch_url": f"https://www.youtube.com/watch?v={vid}",
+                  "thumbnail_url": f"https://i.ytimg.com/vi/{vid}/maxresdefault.jpg", "status": "".join(status),
+                  "scheduled_start_time_utc": now + timedelta(minutes=rnd.randint(5, 3000)) if status == "upcoming" else now - timedelta(minutes=rnd.randint(1, 3000)),
+                  "actual_start_time_utc": now - timedelta(minutes=rnd.randint(1, 600)) if status != "upcoming" else None,
+                  "actual_end_time_utc": now - timedelta(minutes=rnd.randint(1, 60 * 24 * 10)) if status == "none" else None,
+                  "duration_iso": "".join(["PT", "2H"]), "content_rating": {}, "fetch_time": now, "last_seen": now}
+        streams.append(stream)
+    return streams
+
+def make_state(streams: List[Dict[str, Any]], cache_path: Path, backend=None) -> "get_streams.StateManager":
+    """StateManager com os streams inseridos direto (sem filtros de categoria/VOD inicial/retenção)."""
+    state = get_streams.StateManager(cache_path, backend=backend)
+    state.update_channels({s["channel_id"]: s["channel_name"] for s in streams})
+    for s in streams: state._set_stream(s["video_id"], dict(s))
+    state.bump_version()
+    return state
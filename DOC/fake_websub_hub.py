@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fake_websub_hub.py — Hub WebSub (PubSubHubbub) local para testar as notificações push do get_streams.py.
+
+Protocolo do hub real do YouTube: POST /subscribe (formulário hub.callback/hub.mode/hub.topic/hub.lease_seconds/hub.secret)
+responde 202 e verifica a intenção em segundo plano (GET no callback com hub.challenge, que precisa ser ecoado).
+Inscrições confirmadas recebem as notificações Atom no formato do YouTube, assinadas com X-Hub-Signature (sha1) se houver secret.
+
+Controle de teste:
+    POST /_publish   JSON {"channel_id": "UC...", "video_ids": ["..."], "deleted": false} -> entrega aos inscritos do tópico
+    GET  /_stats     inscrições (com lease restante), verificações e entregas (?reset=1 zera os contadores)
+
+Uso: python fake_websub_hub.py [--port 8091] [--lease-cap 864000] [--verify-delay-ms 100] [--deny-rate 0]
+     No get_streams.py: WEBSUB_ENABLED=true, WEBSUB_HUB_URL=http://127.0.0.1:8091/subscribe, WEBSUB_CALLBACK_URL=http://<host>:<porta>/websub (o canal é acrescentado: /websub/<channel_id>)
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+TOPIC_TEMPLATE = "https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+
+def _iso(dt: datetime) -> str: return dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+def build_feed(channel_id: str, topic: str, video_ids: List[str], deleted: bool = False) -> bytes:
+    """Notificação Atom como a do YouTube: <entry> com yt:videoId/yt:channelId, ou <at:deleted-entry> para remoções."""
+    now = _iso(datetime.now(timezone.utc)); channel_uri = f"https://www.youtube.com/channel/{escape(channel_id)}"
+    if deleted:
+        entries = "".join(f'<at:deleted-entry ref="yt:video:{escape(vid)}" when="{now}"><link href="https://www.youtube.com/watch?v={escape(vid)}"/>'
+                          f"<at:by><name>Canal</name><uri>{channel_uri}</uri></at:by></at:deleted-entry>" for vid in video_ids)
+    else:
+        entries = "".join(f"<entry><id>yt:video:{escape(vid)}</id><yt:videoId>{escape(vid)}</yt:videoId><yt:channelId>{escape(channel_id)}</yt:channelId>"
+                          f'<title>Vídeo {escape(vid)}</title><link rel="alternate" href="https://www.youtube.com/watch?v={escape(vid)}"/>'
+                          f"<author><name>Canal</name><uri>{channel_uri}</uri></author><published>{now}</published><updated>{now}</updated></entry>" for vid in video_ids)
+    return ('<?xml version="1.0" encoding="UTF-8"?><feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom"'
+            ' xmlns:at="http://purl.org/atompub/tombstones/1.0"><link rel="hub" href="https://pubsubhubbub.appspot.com"/>'
+            f'<link rel="self" href="{escape(topic)}"/><title>YouTube video feed</title><updated>{now}</updated>{entries}</feed>').encode("utf-8")
+
+class FakeHub:
+    """Inscrições por (callback, tópico) e estatísticas; verificação e entrega rodam em threads próprias."""
+    def __init__(self, lease_cap: int = 864000, verify_delay_ms: float = 100, deny_rate: float = 0.0, seed: int = 1):
+        self.lease_cap = lease_cap; self.verify_delay_ms = verify_delay_ms; self.deny_rate = deny_rate; self.rnd = random.Random(seed)
+        self.lock = threading.Lock(); self.subscriptions: Dict[Tuple[str, str], Dict[str, Any]] = {}; self.reset()
+    def reset(self):
+        self.counters: Dict[str, int] = defaultdict(int); self.deliveries: List[Dict[str, Any]] = []
+    def request(self, form: Dict[str, str]) -> Tuple[int, str]:
+        callback = form.get("hub.callback", ""); mode = form.get("hub.mode", ""); topic = form.get("hub.topic", "")
+        if mode not in ("subscribe", "unsubscribe") or not callback.startswith(("http://", "https://")) or not topic: return 400, "hub.callback/hub.mode/hub.topic inválidos"
+        try: lease = min(int(form.get("hub.lease_seconds") or self.lease_cap), self.lease_cap)
+        except ValueError: return 400, "hub.lease_seconds inválido"
+        with self.lock: self.counters[f"{mode}_requests"] += 1
+        threading.Thread(target=self._verify, args=(callback, mode, topic, lease, form.get("hub.secret", "")), daemon=True).start()
+        return 202, ""
+    def _verify(self, callback: str, mode: str, topic: str, lease: int, secret: str):
+        time.sleep(self.verify_delay_ms / 1000)
+        with self.lock: deny = mode == "subscribe" and self.rnd.random() < self.deny_rate
+        if deny:
+            self._get(callback, {"hub.mode": "denied", "hub.topic": topic, "hub.reason": "negado pelo fake_websub_hub"})
+            with self.lock: self.counters["denied"] += 1
+            return
+        challenge = secrets.token_hex(16); params = {"hub.mode": mode, "hub.topic": topic, "hub.challenge": challenge}
+        if mode == "subscribe": params["hub.lease_seconds"] = str(lease)
+        status, body = self._get(callback, params); confirmed = status is not None and 200 <= status < 300 and body == challenge
+        with self.lock:
+            self.counters[f"{mode}_{'verified' if confirmed else 'rejected'}"] += 1
+            if not confirmed: return
+            if mode == "subscribe": self.subscriptions[(callback, topic)] = {"callback": callback, "topic": topic, "secret": secret, "expires": time.time() + lease, "lease": lease}
+            else: self.subscriptions.pop((callback, topic), None)
+    @staticmethod
+    def _get(callback: str, params: Dict[str, str]) -> Tuple[Optional[int], str]:
+        url = callback + ("&" if "?" in callback else "?") + urllib.parse.urlencode(params)
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response: return response.status, response.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e: return e.code, ""
+        except OSError: return None, ""
+    def publish(self, channel_id: str, video_ids: List[str], deleted: bool = False) -> int:
+        """Entrega a notificação a cada inscrição vigente do tópico do canal; devolve quantas entregas tiveram 2xx."""
+        topic = TOPIC_TEMPLATE.format(channel_id=channel_id); now = time.time()
+        with self.lock: targets = [dict(sub) for sub in self.subscriptions.values() if sub["topic"] == topic and sub["expires"] > now]
+        body = build_feed(channel_id, topic, video_ids, deleted); delivered = 0
+        for sub in targets:
+            headers = {"Content-Type": "application/atom+xml", "Link": f'<https://pubsubhubbub.appspot.com>; rel=hub, <{topic}>; rel=self'}
+            if sub["secret"]: headers["X-Hub-Signature"] = "sha1=" + hmac.new(sub["secret"].encode("utf-8"), body, hashlib.sha1).hexdigest()
+            request = urllib.request.Request(sub["callback"], data=body, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response: status = response.status
+            except urllib.error.HTTPError as e: status = e.code
+            except OSError: status = None
+            ok = status is not None and 200 <= status < 300; delivered += ok
+            with self.lock:
+                self.counters["deliveries_ok" if ok else "deliveries_failed"] += 1
+                self.deliveries.append({"callback": sub["callback"], "channel_id": channel_id, "video_ids": video_ids, "deleted": deleted, "status": status})
+        return delivered
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self.lock:
+            subs = [{"callback": s["callback"], "topic": s["topic"], "lease": s["lease"], "remaining_seconds": round(s["expires"] - now, 1), "signed": bool(s["secret"])} for s in self.subscriptions.values()]
+            return {"subscriptions": subs, "active": sum(1 for s in subs if s["remaining_seconds"] > 0), "counters": dict(self.counters), "deliveries": self.deliveries[-50:]}
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+    hub: FakeHub; verbose = False
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.verbose: super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain; charset=utf-8"):
+        self.send_response(status); self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+
+    def _body(self) -> bytes: return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path != "/_stats": self._send(404, b"Not Found\n"); return
+        snapshot = self.hub.snapshot()
+        if urllib.parse.parse_qs(parsed.query).get("reset") == ["1"]:
+            with self.hub.lock: self.hub.reset()
+        self._send(200, json.dumps(snapshot).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path in ("/", "/subscribe"):
+            form = {k: v[-1] for k, v in urllib.parse.parse_qs(self._body().decode("utf-8")).items()}
+            status, message = self.hub.request(form); self._send(status, message.encode("utf-8")); return
+        if path == "/_publish":
+            try: payload = json.loads(self._body() or b"{}"); channel_id = payload["channel_id"]; video_ids = [str(v) for v in payload["video_ids"]]
+            except (ValueError, KeyError, TypeError) as e: self._send(400, f"JSON inválido: {e}\n".encode("utf-8")); return
+            delivered = self.hub.publish(channel_id, video_ids, bool(payload.get("deleted")))
+            self._send(200, json.dumps({"delivered": delivered}).encode("utf-8"), "application/json"); return
+        self._send(404, b"Not Found\n")
+
+def create_server(host: str, port: int, hub: FakeHub, verbose: bool = False) -> ThreadingHTTPServer:
+    handler = type("BoundFakeHubHandler", (FakeHubHandler,), {"hub": hub, "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler); server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Hub WebSub local (testes das notificações push do get_streams.py)")
+    parser.add_argument("--host", default="127.0.0.1"); parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--lease-cap", type=int, default=864000, help="Lease máximo concedido (s); o YouTube concede até ~10 dias")
+    parser.add_argument("--verify-delay-ms", type=float, default=100); parser.add_argument("--deny-rate", type=float, default=0, help="Fração de inscrições negadas")
+    parser.add_argument("--seed", type=int, default=1); parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    hub = FakeHub(args.lease_cap, args.verify_delay_ms, args.deny_rate, args.seed); server = create_server(args.host, args.port, hub, args.verbose)
+    print(f"Fake WebSub hub em http://{args.host}:{server.server_address[1]}/subscribe", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close(); print(json.dumps(hub.snapshot()["counters"]), flush=True)
+
+if __name__ == "__main__":
+    main()
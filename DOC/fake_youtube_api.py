@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fake_youtube_api.py — Imitação local da YouTube Data API v3 para testes de carga do get_streams.py (sem gastar quota real).
+
+Endpoints: channels, playlistItems, videos, search e videoCategories (GET /youtube/v3/<endpoint>), no formato que o
+APIScraper consome, com ETag/If-None-Match (304). Mundo sintético determinístico (--seed): N canais com M vídeos cada,
+dos quais uma fração é live/agendada/encerrada; o status muda com o relógio (agendado -> ao vivo -> encerrado).
+
+Simula latência (--latency-ms/--jitter-ms), erros 5xx (--error-rate), profundidade de paginação (--page-size)
+e quota (custos oficiais por endpoint; --quota-limit devolve 403 quotaExceeded ao estourar).
+Estatísticas: GET /_stats (chamadas, unidades, erros, 304s; ?reset=1 zera após ler).
+
+Uso: python fake_youtube_api.py [--port 8090] [--channels 1000] [--videos-per-channel 50] [--latency-ms 80]
+     No get_streams.py: YOUTUBE_API_BASE_URL=http://127.0.0.1:8090 (qualquer YOUTUBE_API_KEY).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+QUOTA_COSTS = {"search": 100, "videos": 1, "playlistItems": 1, "channels": 1, "videoCategories": 1}
+CATEGORIES = {"17": "Esportes", "20": "Jogos", "22": "Pessoas e blogs", "24": "Entretenimento", "25": "Notícias e política"}
+
+def _iso(dt: datetime) -> str: return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _iso_duration(seconds: int) -> str:
+    hours, rest = divmod(seconds, 3600); minutes, secs = divmod(rest, 60)
+    return "PT" + (f"{hours}H" if hours else "") + (f"{minutes}M" if minutes else "") + (f"{secs}S" if secs or not (hours or minutes) else "")
+
+class FakeYouTubeWorld:
+    """Canais e vídeos sintéticos; o status de cada live é calculado a partir do relógio atual."""
+    def __init__(self, channels: int, videos_per_channel: int, seed: int = 1, live_ratio: float = 0.02, upcoming_ratio: float = 0.05,
+                 ended_ratio: float = 0.2, category_ids: Tuple[str, ...] = ("17",), now: Optional[datetime] = None):
+        rnd = random.Random(seed); now = now or datetime.now(timezone.utc)
+        self.channels: Dict[str, Dict[str, Any]] = {}; self.videos: Dict[str, Dict[str, Any]] = {}; self.handles: Dict[str, str] = {}
+        for c in range(channels):
+            cid = f"UC{c:022d}"; title = f"Canal Fake {c}"; uploads = "UU" + cid[2:]; video_ids = []
+            for k in range(videos_per_channel):
+                vid = f"{c:06d}x{k:04d}"; roll = rnd.random(); duration = rnd.randint(3600, 4 * 3600)
+                if roll < live_ratio: kind = "live"; start = now - timedelta(seconds=rnd.randint(60, duration - 60))
+                elif roll < live_ratio + upcoming_ratio: kind = "live"; start = now + timedelta(minutes=rnd.randint(5, 48 * 60))
+                elif roll < live_ratio + upcoming_ratio + ended_ratio: kind = "live"; start = now - timedelta(seconds=duration + rnd.randint(60, 5 * 86400))
+                else: kind = "upload"; start = now - timedelta(minutes=rnd.randint(10, 30 * 86400 // 60))
+                published = min(start, now) - timedelta(hours=rnd.randint(1, 72)) if kind == "live" else start
+                self.videos[vid] = {"id": vid, "channel_id": cid, "kind": kind, "start": start, "duration": duration, "published": published,
+                                    "title": f"Transmissão {k} do {title}: Time {rnd.randint(1, 40)} x Time {rnd.randint(1, 40)}",
+                                    "category": category_ids[rnd.randrange(len(category_ids))], "description": f"Descrição sintética do vídeo {vid}. " * rnd.randint(1, 20)}
+                video_ids.append(vid)
+            video_ids.sort(key=lambda v: self.videos[v]["published"], reverse=True) # Playlist 'uploads': mais recentes primeiro
+            self.channels[cid] = {"id": cid, "title": title, "uploads": uploads, "videos": video_ids}
+            self.handles[f"@canalfake{c}"] = cid
+        self.playlists = {ch["uploads"]: cid for cid, ch in self.channels.items()}
+
+    def video_status(self, video: Dict[str, Any], now: datetime) -> str:
+        if video["kind"] != "live": return "none"
+        if now < video["start"]: return "upcoming"
+        return "live" if now < video["start"] + timedelta(seconds=video["duration"]) else "none"
+
+    def video_resource(self, video: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        status = self.video_status(video, now); channel = self.channels[video["channel_id"]]; vid = video["id"]
+        resource = {"kind": "youtube#video", "id": vid,
+                    "snippet": {"publishedAt": _iso(video["published"]), "channelId": video["channel_id"], "title": video["title"], "description": video["description"],
+                                "thumbnails": {"high": {"url": f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg"}, "maxres": {"url": f"https://i.ytimg.com/vi/{vid}/maxresdefault.jpg"}},
+                                "channelTitle": channel["title"], "tags": ["fake", "teste de carga"], "categoryId": video["category"], "liveBroadcastContent": status},
+                    "contentDetails": {"duration": "P0D" if status in ("live", "upcoming") else _iso_duration(video["duration"]), "contentRating": {}}}
+        if video["kind"] == "live":
+            details = {"scheduledStartTime": _iso(video["start"])}
+            if status != "upcoming": details["actualStartTime"] = _iso(video["start"])
+            if status == "none": details["actualEndTime"] = _iso(video["start"] + timedelta(seconds=video["duration"]))
+            resource["liveStreamingDetails"] = details
+        return resource
+
+class FakeAPIConfig:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, page_size: int = 50, quota_limit: int = 0, seed: int = 1):
+        self.latency_ms = latency_ms; self.jitter_ms = jitter_ms; self.error_rate = error_rate; self.page_size = max(1, min(page_size, 50)); self.quota_limit = quota_limit
+        self.rnd = random.Random(seed); self.lock = threading.Lock(); self.started = time.monotonic(); self.reset()
+    def reset(self):
+        self.calls: Dict[str, int] = defaultdict(int); self.units_by_endpoint: Dict[str, int] = defaultdict(int)
+        self.units = 0; self.errors = 0; self.not_modified = 0; self.quota_exceeded = 0; self.reset_at = time.monotonic()
+    def snapshot(self) -> Dict[str, Any]:
+        return {"calls": dict(self.calls), "total_calls": sum(self.calls.values()), "units": self.units, "units_by_endpoint": dict(self.units_by_endpoint),
+                "errors": self.errors, "not_modified": self.not_modified, "quota_exceeded": self.quota_exceeded,
+                "seconds": round(time.monotonic() - self.reset_at, 3), "uptime_seconds": round(time.monotonic() - self.started, 3)}
+
+class FakeYouTubeAPIHandler(BaseHTTPRequestHandler):
+    world: FakeYouTubeWorld; config: FakeAPIConfig; verbose = False
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.verbose: super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Optional[Dict[str, Any]] = None, etag: str = ""):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status); self.send_header("Content-Type", "application/json; charset=UTF-8"); self.send_header("Content-Length", str(len(body)))
+        if etag: self.send_header("ETag", etag)
+        self.end_headers(); self.wfile.write(body)
+
+    def _error(self, status: int, reason: str, message: str):
+        self._send_json(status, {"error": {"code": status, "message": message, "errors": [{"domain": "youtube", "reason": reason, "message": message}]}})
+
+    def do_GET(self):
+        parsed = urlparse(self.path); params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}; config = self.config
+        if parsed.path == "/_stats":
+            with config.lock:
+                snapshot = config.snapshot()
+                if params.get("reset") == "1": config.reset()
+            return self._send_json(200, snapshot)
+        prefix = "/youtube/v3/"; endpoint = parsed.path[len(prefix):] if parsed.path.startswith(prefix) else ""
+        handler = getattr(self, f"_list_{endpoint}", None)
+        if handler is None: return self._error(404, "notFound", f"Endpoint desconhecido: {parsed.path}")
+        if not params.get("key"): return self._error(403, "forbidden", "API key ausente.")
+        delay = max(0.0, config.rnd.gauss(config.latency_ms, config.jitter_ms)) / 1000 if config.latency_ms or config.jitter_ms else 0
+        with config.lock:
+            cost = QUOTA_COSTS.get(endpoint, 1); config.calls[f"{endpoint}.list"] += 1
+            if config.quota_limit and config.units + cost > config.quota_limit: config.quota_exceeded += 1; quota_exceeded = True
+            else: config.units += cost; config.units_by_endpoint[f"{endpoint}.list"] += cost; quota_exceeded = False
+            failed = not quota_exceeded and config.rnd.random() < config.error_rate
+            if failed: config.errors += 1
+        if delay: time.sleep(delay)
+        if quota_exceeded: return self._error(403, "quotaExceeded", "The request cannot be completed because you have exceeded your quota.")
+        if failed: return self._error(500, "backendError", "Backend Error")
+        payload = handler(params, datetime.now(timezone.utc))
+        etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:27] + '"'; payload["etag"] = etag
+        if self.headers.get("If-None-Match") == etag:
+            with config.lock: config.not_modified += 1
+            return self._send_json(304, None, etag)
+        self._send_json(200, payload, etag)
+
+    def _page(self, items: List[Any], params: Dict[str, str]) -> Tuple[List[Any], Dict[str, Any]]:
+        page_size = min(int(params.get("maxResults", "5") or 5), self.config.page_size); offset = int(params.get("pageToken", "P0")[1:] or 0)
+        extra = {"pageInfo": {"totalResults": len(items), "resultsPerPage": page_size}}
+        if offset + page_size < len(items): extra["nextPageToken"] = f"P{offset + page_size}"
+        return items[offset:offset + page_size], extra
+
+    def _list_channels(self, params, now):
+        items = []
+        for cid in params.get("id", "").split(","):
+            channel = self.world.channels.get(cid)
+            if channel: items.append({"kind": "youtube#channel", "id": cid, "snippet": {"title": channel["title"]}, "contentDetails": {"relatedPlaylists": {"uploads": channel["uploads"]}}})
+        return {"kind": "youtube#channelListResponse", "items": items}
+
+    def _list_playlistItems(self, params, now):
+        cid = self.world.playlists.get(params.get("playlistId", ""))
+        if cid is None: return {"kind": "youtube#playlistItemListResponse", "items": []}
+        page, extra = self._page(self.world.channels[cid]["videos"], params)
+        items = [{"kind": "youtube#playlistItem", "snippet": {"publishedAt": _iso(self.world.videos[vid]["published"]), "channelId": cid, "resourceId": {"kind": "youtube#video", "videoId": vid}}} for vid in page]
+        return {"kind": "youtube#playlistItemListResponse", "items": items, **extra}
+
+    def _list_videos(self, params, now):
+        items = [self.world.video_resource(self.world.videos[vid], now) for vid in params.get("id", "").split(",")[:50] if vid in self.world.videos]
+        return {"kind": "youtube#videoListResponse", "items": items}
+
+    def _list_search(self, params, now):
+        if params.get("type") == "channel":
+            cid = self.world.handles.get(params.get("q", "")) or next((c for c, ch in self.world.channels.items() if ch["title"] == params.get("q")), None)
+            items = [{"kind": "youtube#searchResult", "id": {"kind": "youtube#channel", "channelId": cid}, "snippet": {"channelId": cid, "channelTitle": self.world.channels[cid]["title"], "title": self.world.channels[cid]["title"]}}] if cid else []
+            return {"kind": "youtube#searchListResponse", "items": items}
+        channel = self.world.channels.get(params.get("channelId", "")); video_ids = channel["videos"] if channel else []
+        if params.get("publishedAfter"):
+            after = datetime.fromisoformat(params["publishedAfter"].replace("Z", "+00:00")); video_ids = [vid for vid in video_ids if self.world.videos[vid]["published"] > after]
+        page, extra = self._page(video_ids, params)
+        return {"kind": "youtube#searchListResponse", "items": [{"kind": "youtube#searchResult", "id": {"kind": "youtube#video", "videoId": vid}} for vid in page], **extra}
+
+    def _list_videoCategories(self, params, now):
+        return {"kind": "youtube#videoCategoryListResponse", "items": [{"kind": "youtube#videoCategory", "id": cid, "snippet": {"title": title, "assignable": True}} for cid, title in CATEGORIES.items()]}
+
+def create_server(host: str, port: int, world: FakeYouTubeWorld, config: FakeAPIConfig, verbose: bool = False) -> ThreadingHTTPServer:
+    handler = type("BoundFakeYouTubeAPIHandler", (FakeYouTubeAPIHandler,), {"world": world, "config": config, "verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler); server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Imitação local da YouTube Data API v3 (testes de carga)")
+    parser.add_argument("--host", default="127.0.0.1"); parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--channels", type=int, default=1000); parser.add_argument("--videos-per-channel", type=int, default=50)
+    parser.add_argument("--live-ratio", type=float, default=0.02); parser.add_argument("--upcoming-ratio", type=float, default=0.05); parser.add_argument("--ended-ratio", type=float, default=0.2)
+    parser.add_argument("--categories", default="17", help="IDs de categoria sorteados para os vídeos (vírgula)")
+    parser.add_argument("--latency-ms", type=float, default=0); parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="Fração de respostas 500 backendError"); parser.add_argument("--page-size", type=int, default=50, help="Itens máximos por página (<= 50)")
+    parser.add_argument("--quota-limit", type=int, default=0, help="Unidades até responder 403 quotaExceeded (0 = ilimitado)")
+    parser.add_argument("--seed", type=int, default=1); parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    world = FakeYouTubeWorld(args.channels, args.videos_per_channel, args.seed, args.live_ratio, args.upcoming_ratio, args.ended_ratio, tuple(c.strip() for c in args.categories.split(",") if c.strip()))
+    config = FakeAPIConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.page_size, args.quota_limit, args.seed)
+    server = create_server(args.host, args.port, world, config, args.verbose)
+    print(f"Fake YouTube API em http://{args.host}:{server.server_address[1]} ({len(world.channels)} canais, {len(world.videos)} vídeos, gerado em {time.perf_counter() - started:.1f}s)", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close(); print(json.dumps(config.snapshot()), flush=True)
+
+if __name__ == "__main__":
+    main()
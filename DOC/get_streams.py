@@ -10,21 +10,44 @@ pip install python-dotenv google-api-python-client pytz Flask
 """
 
 import asyncio
+import bisect
+import cProfile
+import hmac
+import hashlib
+import heapq
+import importlib.util
 import json
 import logging
 import os
+import pstats
 import re
+import signal
+import sqlite3
+import tempfile
 import threading
+import time
 import unicodedata
+import urllib.error
+import urllib.parse
+import urllib.request
+import shutil
+import subprocess
 import sys
+import zlib
 import pytz
+from xml.etree import ElementTree
 from xml.sax.saxutils import escape
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from dotenv import load_dotenv
-from flask import Flask, Response, request
+from flask import Flask, Response, request, stream_with_context
+from werkzeug.utils import get_content_type
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
@@ -88,9 +111,19 @@ except pytz.exceptions.UnknownTimeZoneError:
 
 
 API_KEY = os.getenv("YOUTUBE_API_KEY")
+# *** NOVO: Endpoint alternativo da YouTube Data API (ex.: fake_youtube_api.py para testes de carga); vazio = API do Google ***
+YOUTUBE_API_BASE_URL = os.getenv("YOUTUBE_API_BASE_URL", "").strip().rstrip("/")
 TARGET_CHANNEL_HANDLES = [h.strip() for h in os.getenv("TARGET_CHANNEL_HANDLES", "").split(",") if h.strip()]
 TARGET_CHANNEL_IDS = [i.strip() for i in os.getenv("TARGET_CHANNEL_IDS", "").split(",") if i.strip()]
 HTTP_PORT = int(os.getenv("HTTP_PORT", "8888"))
+# *** NOVO: Modo de serviço HTTP: 'flask' (thread no processo do agendador) ou 'workers' (artifact_server.py em processos próprios) ***
+HTTP_SERVER_MODE = os.getenv("HTTP_SERVER_MODE", "flask").lower()
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "4"))
+HTTP_THREADS = int(os.getenv("HTTP_THREADS", "8"))
+HTTP_PUBLISH_DIRECTORY = os.getenv("HTTP_PUBLISH_DIRECTORY", "http_artifacts")
+HTTP_PUBLISH_INTERVAL_SECONDS = float(os.getenv("HTTP_PUBLISH_INTERVAL_SECONDS", "2"))
+HTTP_ADMIN_HOST = os.getenv("HTTP_ADMIN_HOST", "127.0.0.1") # No modo workers o Flask (/metrics, /admin) fica nesta interface/porta
+HTTP_ADMIN_PORT = int(os.getenv("HTTP_ADMIN_PORT", "8889"))
 PLAYLIST_SAVE_DIRECTORY = os.getenv("PLAYLIST_SAVE_DIRECTORY", ".")
 XMLTV_SAVE_DIRECTORY = os.getenv("XMLTV_SAVE_DIRECTORY", ".")
 XMLTV_FILENAME = os.getenv("XMLTV_FILENAME", "youtube_epg.xml")
@@ -98,6 +131,9 @@ PLAYLIST_LIVE_FILENAME = os.getenv("PLAYLIST_LIVE_FILENAME", "playlist_live.m3u8
 PLAYLIST_UPCOMING_FILENAME = os.getenv("PLAYLIST_UPCOMING_FILENAME", "playlist_upcoming.m3u8")
 PLAYLIST_VOD_FILENAME = os.getenv("PLAYLIST_VOD_FILENAME", "playlist_vod.m3u8")
 STATE_CACHE_FILENAME = os.getenv("STATE_CACHE_FILENAME", "state_cache.json")
+# *** NOVO: Backend de persistência do estado: 'json' (arquivo único) ou 'sqlite' (WAL, gravação incremental) ***
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json").strip().lower()
+STATE_SQLITE_FILENAME = os.getenv("STATE_SQLITE_FILENAME", "state_cache.db")
 EPG_DESCRIPTION_CLEANUP = os.getenv("EPG_DESCRIPTION_CLEANUP", "false").lower() == "true"
 ENABLE_SCHEDULER_ACTIVE_HOURS = os.getenv("ENABLE_SCHEDULER_ACTIVE_HOURS", "false").lower() == "true"
 SCHEDULER_ACTIVE_START_HOUR = int(os.getenv("SCHEDULER_ACTIVE_START_HOUR", "7"))
@@ -119,6 +155,22 @@ CHANNEL_NAME_MAPPINGS_STR = os.getenv("CHANNEL_NAME_MAPPINGS", "")
 CHANNEL_NAME_MAPPINGS = dict(item.rsplit('|', 1) for item in CHANNEL_NAME_MAPPINGS_STR.split(',') if '|' in item)
 
 TEXTS_CACHE_FILENAME = "textos_epg.json"
+# *** NOVO: Índice por video_id (SQLite somente leitura) publicado para o smart_player; vazio desativa ***
+PLAYER_INDEX_FILENAME = os.getenv("PLAYER_INDEX_FILENAME", "player_index.db").strip()
+# *** NOVO: Pré-download das thumbnails de eventos na janela de pré-evento (entrada local para o ffmpeg do smart_player) ***
+THUMBNAIL_CACHE_ENABLED = os.getenv("THUMBNAIL_CACHE_ENABLED", "true").lower() == "true"
+THUMBNAIL_CACHE_DIRNAME = os.getenv("THUMBNAIL_CACHE_DIRNAME", "thumbnail_cache")
+THUMBNAIL_CACHE_MAX_MB = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "200"))
+THUMBNAIL_CACHE_REFRESH_HOURS = float(os.getenv("THUMBNAIL_CACHE_REFRESH_HOURS", "6")) # Rebaixa a mesma URL (a imagem pode mudar sem mudar a URL)
+THUMBNAIL_PRESCALE = os.getenv("THUMBNAIL_PRESCALE", "false").lower() == "true" # Pré-escala para 1280x720 com ffmpeg (se disponível)
+THUMBNAIL_PREFETCH_INTERVAL_MINUTES = int(os.getenv("THUMBNAIL_PREFETCH_INTERVAL_MINUTES", "5"))
+# *** NOVO: URLs de mídia/manifest pré-resolvidas (lives e eventos na janela de pré-evento) para o smart_player ***
+STREAM_URL_CACHE_ENABLED = os.getenv("STREAM_URL_CACHE_ENABLED", "true").lower() == "true"
+STREAM_URL_CACHE_FILENAME = os.getenv("STREAM_URL_CACHE_FILENAME", "stream_urls.db")
+STREAM_URL_RESOLVE_INTERVAL_SECONDS = int(os.getenv("STREAM_URL_RESOLVE_INTERVAL_SECONDS", "60"))
+STREAM_URL_REFRESH_MARGIN_MINUTES = int(os.getenv("STREAM_URL_REFRESH_MARGIN_MINUTES", "30")) # Renova antes de expirar
+STREAM_URL_DEFAULT_TTL_MINUTES = int(os.getenv("STREAM_URL_DEFAULT_TTL_MINUTES", "120")) # Quando a URL não informa 'expire'
+STREAM_URL_RETRY_MINUTES = int(os.getenv("STREAM_URL_RETRY_MINUTES", "5")) # Espera após falha (ex.: evento ainda não começou)
 STALE_HOURS = int(os.getenv("STALE_HOURS", "6"))
 FULL_SYNC_INTERVAL_HOURS = int(os.getenv("FULL_SYNC_INTERVAL_HOURS", "48"))
 RESOLVE_HANDLES_TTL_HOURS = int(os.getenv("RESOLVE_HANDLES_TTL_HOURS", "24"))
@@ -135,6 +187,70 @@ ALLOWED_CATEGORY_IDS_SET = {cid.strip() for cid in ALLOWED_CATEGORY_IDS_STR.spli
 PLACEHOLDER_IMAGE_URL = os.getenv("PLACEHOLDER_IMAGE_URL", "")
 USE_INVISIBLE_PLACEHOLDER = os.getenv("USE_INVISIBLE_PLACEHOLDER", "true").lower() == "true"
 
+# *** NOVO: Cache de artefatos renderizados (playlists/EPG) do servidor HTTP ***
+# Idade máxima (segundos) de um artefato renderizado (cache HTTP e save_files) mesmo sem mudança de estado,
+# pois as janelas de horário (upcoming/placeholder) mudam com o tempo.
+ARTIFACT_CACHE_MAX_AGE_SECONDS = int(os.getenv("ARTIFACT_CACHE_MAX_AGE_SECONDS", "300"))
+
+# *** NOVO: Geração em pedaços (streaming) de playlists/EPG ***
+# Tamanho (bytes) dos blocos gravados em disco / enviados em respostas HTTP chunked.
+OUTPUT_CHUNK_SIZE = int(os.getenv("OUTPUT_CHUNK_SIZE", "65536"))
+# Acima deste tamanho (bytes), o conteúdo renderizado em save_files vai para arquivo temporário em vez de memória.
+SAVE_SPOOL_MAX_BYTES = int(os.getenv("SAVE_SPOOL_MAX_BYTES", "1048576"))
+# true = playlists/EPG servidos do cache renderizado (ETag/304); false = gerados sob demanda em resposta chunked.
+HTTP_ARTIFACT_CACHE = os.getenv("HTTP_ARTIFACT_CACHE", "true").lower() == "true"
+
+# *** NOVO: Número máximo de requisições simultâneas à API do YouTube (pool de threads) ***
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "8"))
+# *** NOVO: TTL (horas) do cache persistente de playlists 'uploads' por canal ***
+UPLOADS_PLAYLIST_TTL_HOURS = int(os.getenv("UPLOADS_PLAYLIST_TTL_HOURS", "168"))
+
+# *** NOVO: Orçamento diário de quota da API do YouTube ***
+YOUTUBE_DAILY_QUOTA_BUDGET = int(os.getenv("YOUTUBE_DAILY_QUOTA_BUDGET", "10000"))
+# Percentual do orçamento reservado para verificações prioritárias (lives e eventos iminentes).
+QUOTA_PRIORITY_RESERVE_PERCENT = int(os.getenv("QUOTA_PRIORITY_RESERVE_PERCENT", "20"))
+# Fator máximo de alongamento dos intervalos quando o consumo está acima do ritmo do orçamento.
+QUOTA_MAX_STRETCH_FACTOR = float(os.getenv("QUOTA_MAX_STRETCH_FACTOR", "6"))
+# Custo (unidades) por endpoint, conforme a documentação da YouTube Data API v3.
+QUOTA_COSTS = {"search.list": 100, "videos.list": 1, "playlistItems.list": 1, "channels.list": 1, "videoCategories.list": 1}
+QUOTA_RESET_TZ = pytz.timezone("America/Los_Angeles") # A quota diária zera à meia-noite do horário do Pacífico
+
+# *** NOVO: Cache de respostas da API com requisições condicionais (ETag/If-None-Match); 0 desativa ***
+API_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("API_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+# *** NOVO: Agendador por fila de prioridade ***
+# Janela (segundos) para agrupar no mesmo lote verificações que vencem logo após a atual.
+SCHEDULER_COALESCE_SECONDS = int(os.getenv("SCHEDULER_COALESCE_SECONDS", "30"))
+# Tempo máximo (segundos) que o agendador dorme sem reavaliar horário ativo/quota.
+SCHEDULER_MAX_SLEEP_SECONDS = int(os.getenv("SCHEDULER_MAX_SLEEP_SECONDS", "300"))
+
+# *** NOVO: Registro compacto de streams em memória ***
+# Descrições maiores que isto (caracteres) ficam comprimidas (zlib) em memória; 0 desativa a compressão.
+STREAM_DESCRIPTION_COMPRESS_MIN = int(os.getenv("STREAM_DESCRIPTION_COMPRESS_MIN", "256"))
+STREAM_DESCRIPTION_CACHE_SIZE = int(os.getenv("STREAM_DESCRIPTION_CACHE_SIZE", "2048")) # Descrições descomprimidas mantidas em memória (LRU)
+
+# *** NOVO: Métricas em memória no formato Prometheus (rota /metrics do servidor HTTP) ***
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# *** NOVO: Tempos por fase dos ciclos e perfil sob demanda (SIGUSR1 ou POST /admin/profile) ***
+PHASE_LOG_SLOW_SECONDS = float(os.getenv("PHASE_LOG_SLOW_SECONDS", "30")) # Ciclos mais lentos que isto logam as fases em INFO (senão DEBUG)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").lower() # 'cprofile' (determinístico) ou 'sample' (amostragem de pilhas)
+PROFILE_SIGNAL_CYCLES = int(os.getenv("PROFILE_SIGNAL_CYCLES", "3"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "profiles")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "") # Vazio = rotas /admin/* desativadas
+# *** NOVO: Notificações push (WebSub/PubSubHubbub) de novos vídeos; a busca principal vira reconciliação lenta ***
+WEBSUB_ENABLED = os.getenv("WEBSUB_ENABLED", "false").lower() == "true"
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL", "").strip().rstrip("/") # URL pública que chega na rota /websub do servidor Flask
+WEBSUB_HUB_URL = os.getenv("WEBSUB_HUB_URL", "https://pubsubhubbub.appspot.com/subscribe")
+WEBSUB_TOPIC_URL = os.getenv("WEBSUB_TOPIC_URL", "https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}")
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET", "")
+WEBSUB_LEASE_SECONDS = int(os.getenv("WEBSUB_LEASE_SECONDS", "432000"))
+WEBSUB_RENEW_MARGIN_HOURS = float(os.getenv("WEBSUB_RENEW_MARGIN_HOURS", "12"))
+WEBSUB_RETRY_MINUTES = int(os.getenv("WEBSUB_RETRY_MINUTES", "30")) # Espera antes de repetir uma inscrição não confirmada/negada
+WEBSUB_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("WEBSUB_MAINTENANCE_INTERVAL_SECONDS", "600"))
+WEBSUB_BATCH_SECONDS = float(os.getenv("WEBSUB_BATCH_SECONDS", "5")) # Agrupa notificações próximas num único videos.list
+WEBSUB_RECONCILE_INTERVAL_HOURS = float(os.getenv("WEBSUB_RECONCILE_INTERVAL_HOURS", "24")) # Intervalo da busca principal com todas as inscrições ativas
+
 PLACEHOLDER_LIVE_ID = "PLACEHOLDER_LIVE"
 PLACEHOLDER_LIVE_TITLE = "NO MOMENTO SEM TRANSMISSÃO AO VIVO"
 PLACEHOLDER_UPCOMING_ID = "PLACEHOLDER_UPCOMING"
@@ -149,13 +265,483 @@ if not PLACEHOLDER_IMAGE_URL: logger.warning("PLACEHOLDER_IMAGE_URL não definid
 logger.debug(f"Valor lido para INITIAL_SYNC_DAYS: {INITIAL_SYNC_DAYS}")
 
 
+def atomic_write_chunks(path: Path, chunks: Iterable[bytes]) -> int:
+    """Grava os pedaços em arquivo temporário no mesmo diretório e substitui o destino com os.replace (atômico)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent); written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks: f.write(chunk); written += len(chunk)
+            f.flush(); os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644); os.replace(tmp_path, path)
+        return written
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+def atomic_write_bytes(path: Path, data: bytes) -> int:
+    return atomic_write_chunks(path, [data])
+
+PLAYER_INDEX_COLUMNS = ('video_id', 'status', 'actual_start_time_utc', 'actual_end_time_utc', 'thumbnail_url', 'line1', 'line2')
+
+def write_player_index(path: Path, rows: List[Tuple], thumbnail_rows: Iterable[Tuple[str, str]] = ()) -> int:
+    """Gera o índice do player em um SQLite temporário e publica com os.replace (leitores nunca veem arquivo parcial)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent); os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(f"CREATE TABLE player_index ({', '.join(c + (' TEXT PRIMARY KEY' if c == 'video_id' else ' TEXT') for c in PLAYER_INDEX_COLUMNS)}) WITHOUT ROWID")
+            conn.executemany(f"INSERT OR REPLACE INTO player_index VALUES ({', '.join('?' * len(PLAYER_INDEX_COLUMNS))})", rows)
+            conn.execute("CREATE TABLE thumbnails (url TEXT PRIMARY KEY, path TEXT NOT NULL) WITHOUT ROWID") # URL remota -> arquivo local (ThumbnailCache)
+            conn.executemany("INSERT OR REPLACE INTO thumbnails VALUES (?, ?)", thumbnail_rows); conn.commit()
+        finally: conn.close()
+        os.chmod(tmp_path, 0o644); size = os.path.getsize(tmp_path); os.replace(tmp_path, path)
+        return size
+    except BaseException:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        raise
+
+def encode_chunks(chunks: Iterable[str], chunk_size: int = OUTPUT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Agrupa pedaços de texto em blocos UTF-8 de ~chunk_size bytes (escrita em disco/resposta HTTP chunked)."""
+    buffer: List[str] = []; size = 0
+    for chunk in chunks:
+        buffer.append(chunk); size += len(chunk)
+        if size >= chunk_size: yield "".join(buffer).encode("utf-8"); buffer = []; size = 0
+    if buffer: yield "".join(buffer).encode("utf-8")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+class Metrics:
+    # *** NOVO: Contadores/gauges/histogramas em processo (um lock, buckets fixos); exposição em texto Prometheus ***
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled; self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {} # nome -> (tipo, ajuda, buckets)
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], Any]] = defaultdict(dict)
+        self._collectors: List[Any] = []
+    def describe(self, name: str, kind: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self._meta[name] = (kind, help_text, buckets)
+    def add_collector(self, collector):
+        """collector() -> iterável de (nome, {labels}, valor); chamado só na exposição (gauges calculados sob demanda)."""
+        self._collectors.append(collector)
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled: return
+        key = tuple(sorted(labels.items()))
+        with self._lock: series = self._values[name]; series[key] = series.get(key, 0) + value
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled: return
+        with self._lock: self._values[name][tuple(sorted(labels.items()))] = value
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled: return
+        key = tuple(sorted(labels.items())); buckets = self._meta[name][2]; index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._values[name].get(key)
+            if series is None: series = self._values[name][key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            series[0][index] += 1; series[1] += value; series[2] += 1
+    @staticmethod
+    def _labels(key, extra: str = "") -> str:
+        parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in key] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector(): self.set(name, value, **labels)
+            except Exception as e: logger.warning(f"[Metrics] Coletor {getattr(collector, '__qualname__', collector)} falhou: {e}")
+        lines: List[str] = []
+        with self._lock: snapshot = {name: {k: (list(v[0]), v[1], v[2]) if isinstance(v, list) else v for k, v in series.items()} for name, series in self._values.items()}
+        for name in sorted(snapshot):
+            kind, help_text, buckets = self._meta.get(name, ("untyped", "", ()))
+            lines.append(f"# HELP {name} {help_text}"); lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(snapshot[name].items()):
+                if kind != "histogram": lines.append(f"{name}{self._labels(key)} {value}"); continue
+                counts, total, count = value; cumulative = 0
+                for bound, bucket_count in zip([str(b) for b in buckets] + ["+Inf"], counts):
+                    cumulative += bucket_count; lines.append("%s_bucket%s %d" % (name, self._labels(key, 'le="%s"' % bound), cumulative))
+                lines.append(f"{name}_sum{self._labels(key)} {total}"); lines.append(f"{name}_count{self._labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics(METRICS_ENABLED)
+for _name, _kind, _help, *_buckets in (
+        ("youtube_api_requests_total", "counter", "Chamadas à YouTube Data API por endpoint."),
+        ("youtube_api_errors_total", "counter", "Chamadas à API que falharam, por endpoint e status HTTP."),
+        ("youtube_api_not_modified_total", "counter", "Respostas 304 (cache condicional) por endpoint."),
+        ("youtube_api_request_seconds", "histogram", "Latência das chamadas à API por endpoint."),
+        ("youtube_quota_used_today", "gauge", "Unidades de quota consumidas hoje (horário do Pacífico)."),
+        ("scheduler_cycle_seconds", "histogram", "Duração dos ciclos do agendador (main = busca principal, due = alta frequência)."),
+        ("scheduler_check_lag_seconds", "histogram", "Atraso entre o vencimento de uma verificação e sua execução.", LAG_BUCKETS),
+        ("scheduler_queue_size", "gauge", "Vídeos com verificação agendada."),
+        ("render_seconds", "histogram", "Tempo de renderização de playlists/EPG (somente geração), por artefato."),
+        ("render_output_bytes", "gauge", "Tamanho da última renderização por artefato."),
+        ("save_files_seconds", "histogram", "Duração de save_files."),
+        ("save_files_written_bytes_total", "counter", "Bytes gravados por save_files."),
+        ("save_files_last_written_bytes", "gauge", "Bytes gravados no último save_files."),
+        ("state_streams", "gauge", "Streams no estado por status."),
+        ("state_channels", "gauge", "Canais no estado."),
+        ("state_version", "gauge", "Versão do estado (incrementada a cada mudança)."),
+        ("http_requests_total", "counter", "Requisições HTTP por rota e status."),
+        ("http_request_seconds", "histogram", "Latência das requisições HTTP por rota (até o início da resposta)."),
+        ("phase_seconds", "histogram", "Duração de cada fase dos ciclos do agendador e do save_files."),
+        ("scheduler_due_checks_total", "counter", "Vídeos verificados em ciclos de alta frequência, por motivo (pre_event, post_event, stale, push)."),
+        ("websub_notifications_total", "counter", "Notificações WebSub recebidas, por resultado."),
+        ("websub_pushed_videos_total", "counter", "IDs de vídeo recebidos por WebSub e enviados ao agendador."),
+        ("websub_subscriptions", "gauge", "Inscrições WebSub por status."),
+        ("websub_active_leases", "gauge", "Inscrições WebSub com lease vigente.")):
+    METRICS.describe(_name, _kind, _help, *_buckets)
+
+def instrument_render(artifact: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Repassa os pedaços medindo só o tempo gasto gerando-os (não o do consumidor) e o tamanho total."""
+    iterator = iter(chunks); elapsed = 0.0; size = 0
+    while True:
+        started = time.perf_counter()
+        try: chunk = next(iterator)
+        except StopIteration: break
+        finally: elapsed += time.perf_counter() - started
+        size += len(chunk); yield chunk
+    METRICS.observe("render_seconds", elapsed, artifact=artifact); METRICS.set("render_output_bytes", size, artifact=artifact)
+
+class PhaseTimer:
+    # *** NOVO: Spans por fase de um ciclo (agendador/save_files): histograma phase_seconds + resumo no log ***
+    def __init__(self, cycle: str):
+        self.cycle = cycle; self.spans: Dict[str, float] = {}; self.notes: List[str] = []; self._started = time.perf_counter()
+    @contextmanager
+    def span(self, phase: str):
+        started = time.perf_counter()
+        try: yield
+        finally:
+            elapsed = time.perf_counter() - started; self.spans[phase] = self.spans.get(phase, 0.0) + elapsed
+            METRICS.observe("phase_seconds", elapsed, cycle=self.cycle, phase=phase)
+    def log(self):
+        total = time.perf_counter() - self._started; parts = " | ".join(f"{phase} {elapsed:.3f}s" for phase, elapsed in self.spans.items())
+        message = f"[Fases] {self.cycle}: {total:.3f}s total | {parts or '-'}" + (f" ({', '.join(self.notes)})" if self.notes else "")
+        logger.log(logging.INFO if total >= PHASE_LOG_SLOW_SECONDS else logging.DEBUG, message)
+
+def phase_span(phases: Optional[PhaseTimer], phase: str):
+    return phases.span(phase) if phases is not None else nullcontext()
+
+class CycleProfiler:
+    # *** NOVO: Perfil dos próximos N ciclos, armado sob demanda; desarmado, cada ciclo custa só uma verificação de inteiro ***
+    def __init__(self):
+        self._lock = threading.Lock(); self.remaining = 0; self.mode = PROFILE_MODE; self._session: Optional[Dict[str, Any]] = None
+        self.last_dumps: List[str] = []
+    def arm(self, cycles: int, mode: Optional[str] = None) -> Dict[str, Any]:
+        mode = (mode or PROFILE_MODE).lower()
+        if mode not in ('cprofile', 'sample'): raise ValueError(f"modo de perfil inválido: {mode}")
+        with self._lock: self.remaining = max(int(cycles), 0); self.mode = mode
+        logger.warning(f"[Profiler] Armado para os próximos {self.remaining} ciclo(s) (modo {mode}). Saída em {self.output_dir()}")
+        return self.status()
+    def status(self) -> Dict[str, Any]:
+        return {'remaining': self.remaining, 'mode': self.mode, 'active': self._session['kind'] if self._session else None, 'output_dir': str(self.output_dir()), 'last_dumps': list(self.last_dumps)}
+    @staticmethod
+    def output_dir() -> Path:
+        path = Path(PROFILE_OUTPUT_DIR)
+        return path if path.is_absolute() else SCRIPT_DIR_GET_STREAMS / path
+    @contextmanager
+    def cycle(self, kind: str):
+        """Perfila o ciclo se armado (um ciclo por vez; ciclos concorrentes não entram na sessão ativa)."""
+        if not self.remaining: yield; return
+        with self._lock:
+            if not self.remaining or self._session is not None: session = None
+            else: self.remaining -= 1; session = self._session = {'kind': kind, 'mode': self.mode, 'profiles': [], 'samples': Counter(), 'started': time.perf_counter()}
+        if session is None: yield; return
+        profile = sampler = None; stop = threading.Event()
+        if session['mode'] == 'cprofile':
+            profile = cProfile.Profile()
+            try: profile.enable()
+            except ValueError as e: logger.warning(f"[Profiler] cProfile indisponível neste ciclo ({e}); seguindo sem perfil."); profile = None
+        else: sampler = threading.Thread(target=self._sample_loop, args=(session, stop), name="profiler-sampler", daemon=True); sampler.start()
+        try: yield
+        finally:
+            if profile is not None: profile.disable(); session['profiles'].append(profile)
+            if sampler is not None: stop.set(); sampler.join()
+            with self._lock: self._session = None
+            try: self._dump(session)
+            except Exception as e: logger.error(f"[Profiler] Falha ao gravar perfil do ciclo '{kind}': {e}", exc_info=True)
+    def wrap(self, func):
+        """Para asyncio.to_thread: em modo cprofile o trabalho na thread do pool também entra no perfil do ciclo ativo.
+        No Python 3.12+ o cProfile usa sys.monitoring (global ao processo): o perfil do ciclo já vê todas as threads e um
+        segundo enable() falharia, então a função vai sem embrulho."""
+        session = self._session
+        if session is None or session['mode'] != 'cprofile' or sys.version_info >= (3, 12): return func
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            try: profile.enable()
+            except ValueError: return func(*args, **kwargs) # Outro profiler ativo: executa sem perfil
+            try: return func(*args, **kwargs)
+            finally: profile.disable(); session['profiles'].append(profile)
+        return profiled
+    @staticmethod
+    def _sample_loop(session: Dict[str, Any], stop: threading.Event):
+        # Pilhas de todas as threads (exceto esta) no formato "collapsed" (flamegraph.pl / speedscope)
+        own_id = threading.get_ident(); interval = max(PROFILE_SAMPLE_INTERVAL_MS, 1.0) / 1000; names = {}
+        while not stop.wait(interval):
+            for thread in threading.enumerate(): names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id: continue
+                stack = []
+                while frame is not None: stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_code.co_firstlineno})"); frame = frame.f_back
+                session['samples'][";".join([names.get(thread_id, str(thread_id))] + stack[::-1])] += 1
+    def _dump(self, session: Dict[str, Any]):
+        directory = self.output_dir(); directory.mkdir(parents=True, exist_ok=True)
+        elapsed = time.perf_counter() - session['started']; base = directory / f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{session['kind']}"
+        if session['mode'] == 'cprofile':
+            if not session['profiles']: return
+            stats = pstats.Stats(session['profiles'][0])
+            for profile in session['profiles'][1:]: stats.add(profile)
+            path = base.with_suffix(".prof"); stats.dump_stats(str(path))
+            with open(base.with_suffix(".txt"), "w", encoding="utf-8") as f:
+                # O perfil cobre o event loop durante o ciclo inteiro: o que outras corrotinas (e, no 3.12+, outras threads) rodam nos awaits também entra
+                f.write(f"# Ciclo '{session['kind']}' ({elapsed:.2f}s). Inclui outras corrotinas executadas durante os awaits do ciclo"
+                        f"{' e todas as threads do processo (Python 3.12+)' if sys.version_info >= (3, 12) else ''}; compare com as fases (phase_seconds).\n")
+                pstats.Stats(str(path), stream=f).sort_stats("cumulative").print_stats(60)
+        else:
+            path = base.with_suffix(".collapsed")
+            with open(path, "w", encoding="utf-8") as f: f.writelines(f"{stack} {count}\n" for stack, count in session['samples'].most_common())
+        self.last_dumps = (self.last_dumps + [str(path)])[-10:]
+        logger.warning(f"[Profiler] Perfil do ciclo '{session['kind']}' ({elapsed:.2f}s) gravado em {path}. Restam {self.remaining} ciclo(s).")
+
+PROFILER = CycleProfiler()
+
+
+MISSING = object() # Sentinela: campo ausente no StreamRecord (equivale a chave ausente no dict)
+
+@lru_cache(maxsize=STREAM_DESCRIPTION_CACHE_SIZE)
+def _inflate_text(blob: bytes) -> str:
+    # O EPG lê as mesmas descrições a cada render: descomprime uma vez por blob (o registro novo do merge reaproveita o mesmo bytes)
+    return zlib.decompress(blob).decode('utf-8')
+
+class StreamRecord(MutableMapping):
+    # *** NOVO: Registro de stream com __slots__ (substitui o dict por stream no StateManager) ***
+    # Mantém a semântica de dict (get/[]/in/update/copy); os valores são convertidos só na leitura:
+    # tempos como epoch int, ids/nomes internados, descrição comprimida, tags/content_rating como tuplas.
+    FIELDS = ('video_id', 'channel_id', 'channel_name', 'title_original', 'description', 'tags', 'category_original', 'watch_url', 'thumbnail_url',
+              'status', 'scheduled_start_time_utc', 'actual_start_time_utc', 'actual_end_time_utc', 'duration_iso', 'content_rating', 'fetch_time', 'last_seen')
+    TIME_FIELDS = frozenset(('scheduled_start_time_utc', 'actual_start_time_utc', 'actual_end_time_utc', 'fetch_time', 'last_seen'))
+    INTERNED_FIELDS = frozenset(('video_id', 'channel_id', 'channel_name', 'category_original', 'status', 'duration_iso'))
+    _FIELD_SET = frozenset(FIELDS)
+    _DERIVED_WATCH_URL = b'' # watch_url == https://www.youtube.com/watch?v=<video_id> não é armazenada
+    __slots__ = FIELDS + ('_extra',)
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        self._extra: Optional[Dict[str, Any]] = None
+        if data: self.update(data)
+    def _encode(self, key: str, value: Any) -> Any:
+        if value is None: return None
+        if key in self.TIME_FIELDS:
+            if isinstance(value, str):
+                try: value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                except (ValueError, TypeError): return None
+            return int(value.timestamp()) if isinstance(value, datetime) else None
+        if key in self.INTERNED_FIELDS: return sys.intern(value) if isinstance(value, str) else value
+        if key == 'description':
+            if isinstance(value, str) and 0 < STREAM_DESCRIPTION_COMPRESS_MIN < len(value): return zlib.compress(value.encode('utf-8'))
+            return value
+        if key == 'tags': return tuple(sys.intern(t) if isinstance(t, str) else t for t in value) if isinstance(value, list) else value
+        if key == 'content_rating': return tuple((sys.intern(k), v) for k, v in value.items()) if isinstance(value, dict) else value
+        if key == 'watch_url' and value == f"https://www.youtube.com/watch?v={getattr(self, 'video_id', None)}": return self._DERIVED_WATCH_URL
+        return value
+    def _decode(self, key: str, value: Any) -> Any:
+        if value is None: return None
+        if key in self.TIME_FIELDS: return datetime.fromtimestamp(value, timezone.utc)
+        if key == 'description': return _inflate_text(value) if isinstance(value, bytes) else value
+        if key == 'tags': return list(value) if isinstance(value, tuple) else value
+        if key == 'content_rating': return dict(value) if isinstance(value, tuple) else value
+        if key == 'watch_url' and value is self._DERIVED_WATCH_URL: return f"https://www.youtube.com/watch?v={getattr(self, 'video_id', '')}"
+        return value
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._FIELD_SET:
+            value = getattr(self, key, MISSING)
+            return default if value is MISSING else self._decode(key, value)
+        return self._extra.get(key, default) if self._extra else default
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, MISSING)
+        if value is MISSING: raise KeyError(key)
+        return value
+    def __setitem__(self, key: str, value: Any):
+        if key in self._FIELD_SET: setattr(self, key, self._encode(key, value))
+        else:
+            if self._extra is None: self._extra = {}
+            self._extra[key] = value
+    def __delitem__(self, key: str):
+        if key in self._FIELD_SET:
+            if getattr(self, key, MISSING) is MISSING: raise KeyError(key)
+            delattr(self, key)
+        elif self._extra and key in self._extra: del self._extra[key]
+        else: raise KeyError(key)
+    def __contains__(self, key: object) -> bool:
+        if key in self._FIELD_SET: return getattr(self, key, MISSING) is not MISSING
+        return bool(self._extra) and key in self._extra
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if getattr(self, key, MISSING) is not MISSING: yield key
+        if self._extra: yield from list(self._extra)
+    def __len__(self) -> int: return sum(1 for _ in self)
+    def __repr__(self) -> str: return f"StreamRecord({self.to_dict()!r})"
+    def update(self, other: Any = (), **kwargs: Any):
+        if isinstance(other, StreamRecord):
+            for key in other.FIELDS: # Copia os valores já codificados (sem decodificar/recomprimir)
+                value = getattr(other, key, MISSING)
+                if value is not MISSING: setattr(self, key, value)
+            if other._extra: self._extra = {**(self._extra or {}), **other._extra}
+        else:
+            items = list(other.items() if hasattr(other, 'items') else other) + list(kwargs.items()); kwargs = {}
+            # video_id primeiro: a codificação de watch_url (derivada do video_id) não depende da ordem das chaves
+            for key, value in items:
+                if key == 'video_id': self[key] = value
+            for key, value in items:
+                if key != 'video_id': self[key] = value
+        for key, value in kwargs.items(): self[key] = value
+    def copy(self) -> 'StreamRecord':
+        clone = StreamRecord(); clone.update(self); return clone
+    def matches(self, data: Dict[str, Any], ignore: frozenset = frozenset()) -> bool:
+        """True se aplicar 'data' não mudaria nenhum campo (comparação nos valores codificados; descrição pelo texto)."""
+        for key, value in data.items():
+            if key in ignore: continue
+            if key == 'description': current = self.get(key, MISSING)
+            elif key in self._FIELD_SET: current, value = getattr(self, key, MISSING), self._encode(key, value)
+            else: current = self._extra.get(key, MISSING) if self._extra else MISSING
+            if current != value: return False
+        return True
+    def to_dict(self) -> Dict[str, Any]: return {key: self.get(key) for key in self}
+
+class JSONStateBackend:
+    # *** NOVO: Backend original: estado inteiro serializado em um arquivo JSON (reescrito a cada salvamento) ***
+    incremental = False
+    def __init__(self, path: Path): self.path = path
+    def describe(self) -> str: return f"json ({self.path.name})"
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not self.path.exists(): return None
+        with open(self.path, "r", encoding="utf-8") as f: return json.load(f)
+    def save(self, state: 'StateManager') -> int: return atomic_write_chunks(self.path, state.iter_serialized())
+    def close(self): pass
+
+class SQLiteStateBackend:
+    # *** NOVO: Estado em SQLite (WAL): upsert só dos streams alterados, meta/canais por diferença, tudo em uma transação ***
+    incremental = True
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS streams (video_id TEXT PRIMARY KEY, channel_id TEXT, status TEXT, data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_streams_status ON streams(status)",
+        "CREATE INDEX IF NOT EXISTS idx_streams_channel ON streams(channel_id)",
+        "CREATE TABLE IF NOT EXISTS channels (channel_id TEXT PRIMARY KEY, title TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    )
+    def __init__(self, path: Path, legacy_json_path: Optional[Path] = None):
+        self.path = path; self.legacy_json_path = legacy_json_path; self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA: self._conn.execute(statement)
+        self._channels_written: Dict[str, str] = {}; self._meta_written: Dict[str, str] = {}
+    def describe(self) -> str: return f"sqlite ({self.path.name}, WAL)"
+    def close(self):
+        with self._lock: self._conn.close()
+    def _is_empty(self) -> bool:
+        return self._conn.execute("SELECT NOT EXISTS (SELECT 1 FROM meta) AND NOT EXISTS (SELECT 1 FROM streams)").fetchone()[0] == 1
+    def migrate_from_json(self, json_path: Path) -> int:
+        """Importação única do state_cache.json legado (os valores já estão no formato serializado)."""
+        with open(json_path, "r", encoding="utf-8") as f: cache_data = json.load(f)
+        streams = cache_data.get('streams', {}) or {}; channels = cache_data.get('channels', {}) or {}; meta = cache_data.get('meta', {}) or {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO streams (video_id, channel_id, status, data) VALUES (?, ?, ?, ?)",
+                                       [(vid, st.get('channel_id'), st.get('status'), json.dumps(st, ensure_ascii=False)) for vid, st in streams.items() if isinstance(st, dict)])
+                self._conn.executemany("INSERT OR REPLACE INTO channels (channel_id, title) VALUES (?, ?)", list(channels.items()))
+                self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (json.dumps(str(json_path)),))
+                self._conn.execute("COMMIT")
+            except Exception: self._conn.execute("ROLLBACK"); raise
+        logger.info(f"[StateBackend] Migração única de '{json_path}' para SQLite concluída: {len(streams)} streams, {len(channels)} canais.")
+        return len(streams)
+    def load(self) -> Optional[Dict[str, Any]]:
+        if self._is_empty():
+            if not (self.legacy_json_path and self.legacy_json_path.exists()): return None
+            self.migrate_from_json(self.legacy_json_path)
+        with self._lock:
+            streams = {vid: json.loads(data) for vid, data in self._conn.execute("SELECT video_id, data FROM streams")}
+            self._channels_written = dict(self._conn.execute("SELECT channel_id, title FROM channels"))
+            meta_rows = list(self._conn.execute("SELECT key, value FROM meta"))
+        self._meta_written = dict(meta_rows)
+        return {'channels': dict(self._channels_written), 'streams': streams, 'meta': {k: json.loads(v) for k, v in meta_rows if k != 'migrated_from'}}
+    def save(self, state: 'StateManager') -> int:
+        changed_ids, deleted_ids = state.take_pending_changes(); written = 0
+        upserts = []
+        for vid in changed_ids:
+            stream = state.streams.get(vid)
+            if stream is None: continue
+            data = json.dumps(stream.to_dict(), default=state._json_converter, ensure_ascii=False); written += len(data)
+            upserts.append((vid, stream.get('channel_id'), stream.get('status'), data))
+        channels = dict(state.channels)
+        channel_upserts = [(cid, title) for cid, title in channels.items() if self._channels_written.get(cid) != title]
+        channel_deletes = [(cid,) for cid in self._channels_written if cid not in channels]
+        meta_values = {k: json.dumps(v, default=state._json_converter, ensure_ascii=False) for k, v in state._meta_serializable().items()}
+        meta_upserts = [(k, v) for k, v in meta_values.items() if self._meta_written.get(k) != v]; written += sum(len(v) for _, v in meta_upserts)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if upserts: self._conn.executemany("INSERT OR REPLACE INTO streams (video_id, channel_id, status, data) VALUES (?, ?, ?, ?)", upserts)
+                if deleted_ids: self._conn.executemany("DELETE FROM streams WHERE video_id = ?", [(vid,) for vid in deleted_ids])
+                if channel_upserts: self._conn.executemany("INSERT OR REPLACE INTO channels (channel_id, title) VALUES (?, ?)", channel_upserts)
+                if channel_deletes: self._conn.executemany("DELETE FROM channels WHERE channel_id = ?", channel_deletes)
+                if meta_upserts: self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta_upserts)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK"); state.restore_pending_changes(changed_ids, deleted_ids); raise
+        self._channels_written = channels; self._meta_written.update(meta_upserts)
+        logger.debug(f"[StateBackend] SQLite: {len(upserts)} upsert(s), {len(deleted_ids)} remoção(ões), {len(channel_upserts) + len(channel_deletes)} canal(is), {len(meta_upserts)} chave(s) de meta.")
+        return written
+    # Consultas indexadas (video_id / status / canal) direto no banco
+    def get_stream(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock: row = self._conn.execute("SELECT data FROM streams WHERE video_id = ?", (video_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    def get_streams_by_status(self, status: str) -> List[Dict[str, Any]]:
+        with self._lock: rows = self._conn.execute("SELECT data FROM streams WHERE status = ?", (status,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    def get_streams_by_channel(self, channel_id: str) -> List[Dict[str, Any]]:
+        with self._lock: rows = self._conn.execute("SELECT data FROM streams WHERE channel_id = ?", (channel_id,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+def create_state_backend(script_dir: Path) -> Any:
+    if STATE_BACKEND == 'sqlite': return SQLiteStateBackend(script_dir / STATE_SQLITE_FILENAME, legacy_json_path=script_dir / STATE_CACHE_FILENAME)
+    if STATE_BACKEND != 'json': logger.warning(f"STATE_BACKEND '{STATE_BACKEND}' desconhecido. Usando 'json'.")
+    return JSONStateBackend(script_dir / STATE_CACHE_FILENAME)
+
 class StateManager:
     # *** MODIFICADO: Adiciona filtro de categoria ***
-    def __init__(self, cache_path: Path):
-        self.streams: Dict[str, Dict[str, Any]] = {}
+    # *** NOVO: Artefatos gerados a partir do estado (controle de "sujo" para save_files) ***
+    ARTIFACTS = ('live', 'upcoming', 'vod', 'epg', 'texts', 'player_index', 'state')
+    SEEN_FIELDS = frozenset(('fetch_time', 'last_seen')) # Carimbos de "visto agora": não contam como mudança do stream
+    def __init__(self, cache_path: Path, backend: Optional[Any] = None):
+        self.streams: Dict[str, StreamRecord] = {}
         self.channels: Dict[str, str] = {}
         self.cache_path = cache_path
-        self.meta: Dict[str, Any] = {"last_main_run": None, "last_full_sync": None, "resolved_handles": {}}
+        self.backend = backend or JSONStateBackend(cache_path) # *** NOVO: Persistência plugável (json/sqlite) ***
+        self._changed_ids: Set[str] = set(); self._deleted_ids: Set[str] = set() # Streams alterados/removidos desde o último salvamento
+        self._track_changes = bool(getattr(self.backend, 'incremental', False)) # Só o backend incremental consome (e esvazia) esses conjuntos
+        self.meta: Dict[str, Any] = {"last_main_run": None, "last_full_sync": None, "resolved_handles": {}, "uploads_playlists": {}, "websub": {}}
+        # *** NOVO: Versão do estado (incrementa a cada mudança em streams/canais) ***
+        self.version = 0
+        self.version_changed_at = datetime.now(timezone.utc)
+        self._dirty: Set[str] = set(self.ARTIFACTS)
+        self.artifact_info: Dict[str, Dict[str, Any]] = {} # name -> {'sha1', 'size', 'rendered_at'} do último salvamento
+        # *** NOVO: Índices incrementais (listas ordenadas de (chave, seq, video_id)) para seleção live/upcoming/vod ***
+        self._seq = 0; self._stream_seq: Dict[str, int] = {} # Ordem de inserção: desempate igual ao sort estável sobre self.streams
+        self._idx_live: List[Tuple[float, int, str]] = []; self._idx_upcoming: List[Tuple[float, int, str]] = []; self._idx_vod: List[Tuple[float, int, str]] = []
+        self._idx_entries: Dict[str, Tuple[str, Tuple[float, int, str]]] = {}
+        self._status_counts: Counter = Counter()
+        # Índices/streams mudam no event loop e são lidos nas threads do Flask/publicação: mutação e leitura (snapshot) sob o mesmo lock
+        self._lock = threading.RLock()
+        self._reset_retention()
+
+    def bump_version(self):
+        self.version += 1; self.version_changed_at = datetime.now(timezone.utc); self._dirty.update(self.ARTIFACTS)
+    def mark_dirty(self, *artifacts: str): self._dirty.update(artifacts or self.ARTIFACTS)
+    def clear_dirty(self, artifact: str): self._dirty.discard(artifact)
+    def needs_render(self, artifact: str) -> bool:
+        if artifact in self._dirty: return True
+        info = self.artifact_info.get(artifact)
+        if not info or not isinstance(info.get('rendered_at'), datetime): return True
+        return (datetime.now(timezone.utc) - info['rendered_at']) >= timedelta(seconds=ARTIFACT_CACHE_MAX_AGE_SECONDS)
 
     def update_channels(self, channels_data: Dict[str, str]):
         updated_count = 0; new_count = 0
@@ -164,11 +750,151 @@ class StateManager:
                 if cid not in self.channels: new_count +=1
                 elif self.channels[cid] != title: updated_count += 1
                 self.channels[cid] = title
-        if new_count > 0 or updated_count > 0: logger.debug(f"Update Channels: Adicionados: {new_count}, Atualizados: {updated_count}")
+        if new_count > 0 or updated_count > 0:
+            logger.debug(f"Update Channels: Adicionados: {new_count}, Atualizados: {updated_count}")
+            self.bump_version()
 
-    def update_streams(self, streams_data: List[Dict[str, Any]]):
+    @staticmethod
+    def _timestamp(value: Any, default: datetime) -> float:
+        return (value if isinstance(value, datetime) else default).timestamp()
+    def _reset_retention(self):
+        # *** NOVO: Retenção incremental: heap de vencimentos + gravados por canal em ordem (poda só toca o que venceu/excedeu) ***
+        self._retention: Dict[str, Tuple[int, float, Any, Optional[Tuple[float, int, str]]]] = {} # vid -> (token, vencimento, canal, entrada em _recorded_by_channel)
+        self._retention_heap: List[Tuple[float, int, str]] = []; self._retention_token = 0
+        self._recorded_by_channel: Dict[Any, List[Tuple[float, int, str]]] = {}; self._recorded_over: Set[Any] = set()
+    @staticmethod
+    def _retention_time(value: Any) -> Optional[float]:
+        if isinstance(value, str):
+            try: value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except Exception: return None
+        if not isinstance(value, datetime): return None
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    def _retention_add(self, vid: str, stream: Dict[str, Any]):
+        """Mesmas regras da poda completa, resolvidas uma vez por atualização: vencimento absoluto + posição entre os gravados do canal."""
+        inf = float('inf'); retention = RECORDED_RETENTION_DAYS * 86400; stale = max(STALE_HOURS * 2, SCHEDULER_MAIN_INTERVAL_HOURS * 2) * 3600
+        last_seen = self._retention_time(stream.get('last_seen') or stream.get('fetch_time')) # Ilegível/ausente = "visto agora" (nunca vence)
+        end = self._retention_time(stream.get('actual_end_time_utc'))
+        expiry = end + retention if end is not None else inf; channel_id = stream.get('channel_id'); recorded_entry = None
+        if stream.get('status') == 'none':
+            if not KEEP_RECORDED_STREAMS: expiry = -inf
+            else:
+                sort_ts = end if end is not None else (last_seen if last_seen is not None else inf)
+                expiry = min(expiry, sort_ts + retention)
+                # Mais recentes primeiro; desempate pela ordem de inserção (como o sort estável da poda completa)
+                recorded_entry = (-sort_ts, self._stream_seq[vid], vid); items = self._recorded_by_channel.setdefault(channel_id, [])
+                bisect.insort(items, recorded_entry)
+                if len(items) > MAX_RECORDED_PER_CHANNEL: self._recorded_over.add(channel_id)
+        elif last_seen is not None: expiry = min(expiry, last_seen + stale)
+        self._retention_token += 1; self._retention[vid] = (self._retention_token, expiry, channel_id, recorded_entry)
+        if expiry != inf: heapq.heappush(self._retention_heap, (expiry, self._retention_token, vid))
+    def _retention_remove(self, vid: str):
+        entry = self._retention.pop(vid, None) # A entrada no heap fica obsoleta (token não confere) e é descartada ao vencer
+        if entry is None or entry[3] is None: return
+        items = self._recorded_by_channel.get(entry[2], []); pos = bisect.bisect_left(items, entry[3])
+        if pos < len(items) and items[pos] == entry[3]: del items[pos]
+        if not items: self._recorded_by_channel.pop(entry[2], None)
+    def _index_unlink(self, vid: str):
+        entry = self._idx_entries.pop(vid, None)
+        if entry is None: return
+        index = {'live': self._idx_live, 'upcoming': self._idx_upcoming, 'vod': self._idx_vod}[entry[0]]
+        pos = bisect.bisect_left(index, entry[1])
+        if pos < len(index) and index[pos] == entry[1]: del index[pos]
+    def _index_link(self, vid: str, entry: Optional[Tuple[str, Tuple[float, int, str]]]):
+        if entry is None: return
+        self._idx_entries[vid] = entry; bisect.insort({'live': self._idx_live, 'upcoming': self._idx_upcoming, 'vod': self._idx_vod}[entry[0]], entry[1])
+    def _index_remove(self, vid: str):
+        self._retention_remove(vid)
+        stream = self.streams.get(vid)
+        if stream is not None: self._status_counts[stream.get('status')] -= 1
+        self._index_unlink(vid)
+    def _index_add(self, vid: str, stream: Dict[str, Any]):
+        self._retention_add(vid, stream); self._status_counts[stream.get('status')] += 1
+        self._index_link(vid, self._index_entry(vid, stream))
+    def _index_position(self, entry: Optional[Tuple[str, Tuple[float, int, str]]]) -> Optional[int]:
+        return bisect.bisect_left({'live': self._idx_live, 'upcoming': self._idx_upcoming, 'vod': self._idx_vod}[entry[0]], entry[1]) if entry else None
+    def _reindex(self, vid: str, stream: Dict[str, Any], old_status: Optional[str]) -> bool:
+        """Após alterar o registro no lugar: retenção sempre; índice ordenado só se a entrada (lista/chave) mudou. True = posição mudou."""
+        self._retention_remove(vid); self._retention_add(vid, stream)
+        status = stream.get('status')
+        if status != old_status: self._status_counts[old_status] -= 1; self._status_counts[status] += 1
+        entry = self._index_entry(vid, stream); old_entry = self._idx_entries.get(vid)
+        if entry == old_entry: return False
+        old_pos = self._index_position(old_entry); self._index_unlink(vid); self._index_link(vid, entry)
+        return old_entry is None or entry is None or old_entry[0] != entry[0] or self._index_position(entry) != old_pos
+    def _index_entry(self, vid: str, stream: Dict[str, Any]) -> Optional[Tuple[str, Tuple[float, int, str]]]:
+        status = stream.get('status'); seq = self._stream_seq[vid]
+        datetime_max_utc = datetime.max.replace(tzinfo=timezone.utc); datetime_min_utc = datetime.min.replace(tzinfo=timezone.utc)
+        if ContentGenerator._is_live(None, stream): name, key = 'live', self._timestamp(ContentGenerator._get_sortable_time(stream), datetime_max_utc)
+        elif status == 'upcoming' and stream.get('scheduled_start_time_utc'): name, key = 'upcoming', self._timestamp(ContentGenerator._get_sortable_time(stream), datetime_max_utc)
+        elif status == 'none' and not vid.startswith('PLACEHOLDER_'):
+            # Mais recentes primeiro: chave negativa mantém o desempate por ordem de inserção (como sorted(..., reverse=True))
+            name, key = 'vod', -self._timestamp(stream.get('last_seen') or stream.get('actual_end_time_utc'), datetime_min_utc)
+        else: return None
+        return name, (key, seq, vid)
+    def _set_stream(self, vid: str, stream: Dict[str, Any]):
+        if not isinstance(stream, StreamRecord): stream = StreamRecord(stream)
+        with self._lock:
+            if vid in self.streams: self._index_remove(vid)
+            else: self._seq += 1; self._stream_seq[vid] = self._seq
+            self.streams[vid] = stream; self._index_add(vid, stream)
+            if self._track_changes: self._changed_ids.add(vid); self._deleted_ids.discard(vid)
+    def _merge_stream(self, vid: str, existing: StreamRecord, stream: Dict[str, Any]):
+        # *** MODIFICADO: Mescla no lugar sob o lock (sem cópia por atualização); reindexa só se a chave de ordenação mudou ***
+        with self._lock:
+            old_status = existing.get('status'); existing.update(stream)
+            self._reindex(vid, existing, old_status)
+            if self._track_changes: self._changed_ids.add(vid)
+    def _touch_stream(self, vid: str, existing: StreamRecord, now: datetime) -> bool:
+        """Stream revisto sem mudanças (ex.: 304): só fetch_time/last_seen, sem marcar para o upsert. True = ordem dos VODs mudou."""
+        with self._lock:
+            existing['fetch_time'] = now; existing['last_seen'] = now
+            return self._reindex(vid, existing, existing.get('status'))
+    def _remove_stream(self, vid: str):
+        with self._lock:
+            if vid not in self.streams: return
+            self._index_remove(vid); self.streams.pop(vid, None); self._stream_seq.pop(vid, None)
+            if self._track_changes: self._changed_ids.discard(vid); self._deleted_ids.add(vid)
+    def take_pending_changes(self) -> Tuple[Set[str], Set[str]]:
+        changed, deleted = self._changed_ids, self._deleted_ids; self._changed_ids, self._deleted_ids = set(), set()
+        return changed, deleted
+    def restore_pending_changes(self, changed: Set[str], deleted: Set[str]):
+        self._changed_ids |= {vid for vid in changed if vid not in self._deleted_ids}; self._deleted_ids |= {vid for vid in deleted if vid not in self._changed_ids}
+    def rebuild_indexes(self):
+        with self._lock:
+            self._seq = 0; self._stream_seq = {}; self._idx_entries = {}; self._status_counts = Counter()
+            self._idx_live, self._idx_upcoming, self._idx_vod = [], [], []; self._reset_retention()
+            streams, self.streams = self.streams, {}
+            for vid, stream in streams.items(): self._set_stream(vid, stream)
+    def count_by_status(self) -> Dict[str, int]:
+        total = len(self.streams); live = len(self._idx_live); upcoming = self._status_counts.get('upcoming', 0)
+        return {'total': total, 'live': live, 'upcoming': upcoming, 'none': total - live - upcoming}
+    def upcoming_until(self, until_utc: datetime) -> List[Dict[str, Any]]:
+        """Upcoming com início agendado até 'until_utc' (inclui atrasados), em ordem de início."""
+        with self._lock:
+            end = bisect.bisect_right(self._idx_upcoming, (until_utc.timestamp(), float('inf'), ''))
+            return [self.streams[vid] for _, _, vid in self._idx_upcoming[:end]]
+    def select_streams(self, mode: str, now_utc: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Seleção live/upcoming/vod (com limites por canal) percorrendo os índices já ordenados; seguro fora do event loop (snapshot sob o lock)."""
+        with self._lock: return self._select_streams_locked(mode, now_utc)
+    def _select_streams_locked(self, mode: str, now_utc: Optional[datetime]) -> List[Dict[str, Any]]:
+        if mode == 'live': return [self.streams[vid] for _, _, vid in self._idx_live]
+        selected = []; per_channel: Dict[str, int] = defaultdict(int)
+        if mode == 'upcoming':
+            now_utc = now_utc or datetime.now(timezone.utc); limit_ts = (now_utc + timedelta(hours=MAX_SCHEDULE_HOURS)).timestamp()
+            start = bisect.bisect_right(self._idx_upcoming, (now_utc.timestamp(), float('inf'), ''))
+            for pos in range(start, len(self._idx_upcoming)):
+                ts, _, vid = self._idx_upcoming[pos]
+                if ts > limit_ts: break
+                stream = self.streams[vid]; channel_id = stream.get('channel_id', 'unknown')
+                if per_channel[channel_id] < MAX_UPCOMING_PER_CHANNEL: per_channel[channel_id] += 1; selected.append(stream)
+        elif mode == 'vod' and KEEP_RECORDED_STREAMS:
+            for _, _, vid in self._idx_vod:
+                stream = self.streams[vid]; channel_id = stream.get('channel_id', 'unknown')
+                if per_channel[channel_id] < MAX_RECORDED_PER_CHANNEL: per_channel[channel_id] += 1; selected.append(stream)
+        return selected
+    def update_streams(self, streams_data: List[Dict[str, Any]], phases: Optional['PhaseTimer'] = None):
         now = datetime.now(timezone.utc)
-        added_count = 0; updated_count = 0; ignored_initial_vod_count = 0
+        added_count = 0; updated_count = 0; unchanged_count = 0; reordered = False; ignored_initial_vod_count = 0
         ignored_category_count = 0 # *** NOVO: Contador de filtro de categoria ***
 
         for stream in streams_data:
@@ -185,7 +911,7 @@ class StateManager:
                 if category_id not in ALLOWED_CATEGORY_IDS_SET:
                     if existing:
                         logger.debug(f"Ignorando atualização e removendo stream {vid} (categoria {category_id} não permitida).")
-                        self.streams.pop(vid, None)
+                        self._remove_stream(vid)
                     else:
                         logger.debug(f"Ignorando stream novo {vid} (categoria {category_id} não permitida).")
                     ignored_category_count += 1
@@ -197,88 +923,86 @@ class StateManager:
                 logger.debug(f"Ignorando VOD inicial (não estava no cache): {vid}")
                 continue
 
+            # *** NOVO: Resposta igual à já aplicada (304 do cache condicional ou 200 idêntico): não conta como atualização nem muda a versão ***
+            if existing is not None and existing.matches(stream, ignore=self.SEEN_FIELDS):
+                reordered |= self._touch_stream(vid, existing, now); unchanged_count += 1; continue
             stream['fetch_time'] = now; stream['last_seen'] = now
-            merged = existing.copy() if existing else {}; merged.update(stream); self.streams[vid] = merged
+            if existing is not None: self._merge_stream(vid, existing, stream)
+            else: self._set_stream(vid, stream)
             if existing: updated_count += 1
             else: added_count += 1
 
         if added_count > 0 or updated_count > 0 or ignored_initial_vod_count > 0 or ignored_category_count > 0:
-            logger.info(f"Update Streams: Adicionados: {added_count}, Atualizados: {updated_count}, VODs Iniciais Ign: {ignored_initial_vod_count}, Categorias Ign: {ignored_category_count}")
+            logger.info(f"Update Streams: Adicionados: {added_count}, Atualizados: {updated_count}, Inalterados: {unchanged_count}, VODs Iniciais Ign: {ignored_initial_vod_count}, Categorias Ign: {ignored_category_count}")
+        elif unchanged_count > 0: logger.debug(f"Update Streams: {unchanged_count} stream(s) inalterado(s).")
+        if added_count > 0 or updated_count > 0 or ignored_category_count > 0 or reordered: self.bump_version()
 
-        self.prune_ended_streams()
+        with phase_span(phases, 'prune'): self.prune_ended_streams()
 
     def prune_ended_streams(self):
-        # (Lógica sem alterações)
-        now = datetime.now(timezone.utc); to_delete = set(); recorded_by_channel = defaultdict(list)
-        recorded_cutoff = now - timedelta(days=RECORDED_RETENTION_DAYS)
-        stale_cutoff = now - timedelta(hours=max(STALE_HOURS * 2, SCHEDULER_MAIN_INTERVAL_HOURS * 2))
-        for vid, s in list(self.streams.items()):
-            status = s.get('status'); last_seen = s.get('last_seen') or s.get('fetch_time')
-            if isinstance(last_seen, str):
-                try: last_seen = datetime.fromisoformat(last_seen.replace('Z', '+00:00'))
-                except Exception: last_seen = now
-            elif not isinstance(last_seen, datetime): last_seen = now
-            channel_id = s.get('channel_id'); aet = s.get('actual_end_time_utc'); aet_dt = None
-            if isinstance(aet, str):
-                try: aet_dt = datetime.fromisoformat(aet.replace('Z', '+00:00'))
-                except Exception: pass
-            elif isinstance(aet, datetime): aet_dt = aet
-            if aet_dt and aet_dt < recorded_cutoff: to_delete.add(vid); continue
-            if status == 'none':
-                if not KEEP_RECORDED_STREAMS: to_delete.add(vid); continue
-                sort_time = aet_dt or last_seen
-                if sort_time < recorded_cutoff: to_delete.add(vid); continue
-                recorded_by_channel[channel_id].append((vid, sort_time))
-                continue
-            if last_seen < stale_cutoff: to_delete.add(vid)
-        if KEEP_RECORDED_STREAMS:
-            for cid, items in recorded_by_channel.items():
-                if len(items) > MAX_RECORDED_PER_CHANNEL:
-                    items_sorted = sorted(items, key=lambda x: x[1], reverse=True)
-                    for vid_to_del, _ in items_sorted[MAX_RECORDED_PER_CHANNEL:]: to_delete.add(vid_to_del)
+        # *** MODIFICADO: Incremental: remove só os vencidos (heap) e o excedente dos canais acima de MAX_RECORDED_PER_CHANNEL ***
+        now_ts = datetime.now(timezone.utc).timestamp(); to_delete = set(); heap = self._retention_heap
+        while heap and heap[0][0] < now_ts:
+            _, token, vid = heapq.heappop(heap); entry = self._retention.get(vid)
+            if entry is not None and entry[0] == token: to_delete.add(vid)
+        for channel_id in self._recorded_over:
+            kept = 0
+            for _, _, vid in self._recorded_by_channel.get(channel_id, []):
+                if vid in to_delete: continue
+                kept += 1
+                if kept > MAX_RECORDED_PER_CHANNEL: to_delete.add(vid)
+        self._recorded_over = set()
         if to_delete:
             logger.info(f"Removendo {len(to_delete)} streams antigas/excedentes/stale do estado.")
-            for vid in to_delete: self.streams.pop(vid, None)
-    def get_all_streams(self) -> List[Dict[str, Any]]: return list(self.streams.values())
+            for vid in to_delete: self._remove_stream(vid)
+            self.bump_version()
+        if len(heap) > 2 * len(self._retention) + 1024:
+            # Compacta entradas obsoletas (cada atualização de um stream deixa a anterior para trás)
+            self._retention_heap = [(expiry, token, vid) for vid, (token, expiry, _, _) in self._retention.items() if expiry != float('inf')]; heapq.heapify(self._retention_heap)
+    def get_all_streams(self) -> List[Dict[str, Any]]:
+        with self._lock: return list(self.streams.values())
     def get_all_channels(self) -> Dict[str, str]: return self.channels
-    def save_to_disk(self):
+    def iter_serialized(self) -> Iterator[bytes]:
+        cache_data = {'channels': self.channels, 'streams': self.streams, 'meta': self._meta_serializable()}
+        return encode_chunks(json.JSONEncoder(indent=2, default=self._json_converter).iterencode(cache_data))
+    def serialize(self) -> bytes: return b"".join(self.iter_serialized())
+    def save_to_disk(self) -> int:
         try:
-            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
-            cache_data = {'channels': self.channels, 'streams': self.streams, 'meta': self._meta_serializable()}
-            with open(self.cache_path, "w", encoding="utf-8") as f: json.dump(cache_data, f, indent=2, default=self._json_converter)
-            logger.info(f"Estado principal salvo com sucesso em '{self.cache_path}'.")
-        except Exception as e: logger.error(f"Não foi possível salvar o estado no cache: {e}")
+            written = self.backend.save(self)
+            logger.info(f"Estado principal salvo com sucesso ({self.backend.describe()}, {written} bytes).")
+            return written
+        except Exception as e: logger.error(f"Não foi possível salvar o estado no cache: {e}"); return 0
     def load_from_disk(self) -> bool:
-        if not self.cache_path.exists(): return False
         try:
-            with open(self.cache_path, "r", encoding="utf-8") as f: cache_data = json.load(f)
+            cache_data = self.backend.load()
+            if cache_data is None: return False
             self.channels = cache_data.get('channels', {})
-            self.streams = cache_data.get('streams', {})
+            # *** MODIFICADO: Converte cada stream do JSON para StreamRecord (tempos ISO inválidos viram None) ***
+            self.streams = {vid: StreamRecord(stream) for vid, stream in cache_data.get('streams', {}).items() if isinstance(stream, dict)}
             meta = cache_data.get('meta', {})
             self._load_meta(meta)
-            for stream in self.streams.values():
-                for key, value in list(stream.items()):
-                    if key in ('scheduled_start_time_utc', 'actual_start_time_utc', 'actual_end_time_utc', 'fetch_time', 'last_seen'):
-                        if isinstance(value, str):
-                            try: stream[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                            except (ValueError, TypeError): stream[key] = None
-                        elif not isinstance(value, datetime): stream[key] = None
+            self.rebuild_indexes(); self.take_pending_changes(); self.bump_version()
             return True
-        except (IOError, json.JSONDecodeError) as e: logger.error(f"Não foi possível carregar o estado do cache: {e}."); return False
+        except (IOError, json.JSONDecodeError, sqlite3.Error) as e: logger.error(f"Não foi possível carregar o estado do cache: {e}."); return False
     def _json_converter(self, o):
         if isinstance(o, datetime): return o.isoformat()
+        if isinstance(o, StreamRecord): return o.to_dict()
         return None
     def _meta_serializable(self):
         meta_copy = dict(self.meta)
         for k in ('last_main_run', 'last_full_sync'):
             if meta_copy.get(k) and isinstance(meta_copy[k], datetime): meta_copy[k] = meta_copy[k].isoformat()
             else: meta_copy.pop(k, None)
-        rh = {}
-        for h, v in self.meta.get('resolved_handles', {}).items():
-            if isinstance(v, dict):
-                rh[h] = dict(v)
-                if 'resolved_at' in rh[h] and isinstance(rh[h]['resolved_at'], datetime): rh[h]['resolved_at'] = rh[h]['resolved_at'].isoformat()
-        meta_copy['resolved_handles'] = rh
+        # *** MODIFICADO: resolved_handles e uploads_playlists compartilham o formato {chave: {..., 'resolved_at'}} ***
+        for meta_key in ('resolved_handles', 'uploads_playlists'):
+            rh = {}
+            for h, v in list(self.meta.get(meta_key, {}).items()):
+                if isinstance(v, dict):
+                    rh[h] = dict(v)
+                    if 'resolved_at' in rh[h] and isinstance(rh[h]['resolved_at'], datetime): rh[h]['resolved_at'] = rh[h]['resolved_at'].isoformat()
+            meta_copy[meta_key] = rh
+        # *** NOVO: Inscrições WebSub por canal (datas em ISO) ***
+        meta_copy['websub'] = {cid: {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in sub.items()} for cid, sub in list(self.meta.get('websub', {}).items()) if isinstance(sub, dict)}
         return meta_copy
     def _load_meta(self, meta):
         if not isinstance(meta, dict): meta = {}
@@ -289,23 +1013,148 @@ class StateManager:
                 try: self.meta[k] = datetime.fromisoformat(value_str.replace('Z', '+00:00'))
                 except Exception: self.meta[k] = None
             else: self.meta[k] = None
-        rh = {}
-        for h, v in meta.get('resolved_handles', {}).items():
-             if isinstance(v, dict):
-                 rh[h] = dict(v)
-                 resolved_at_str = rh[h].get('resolved_at')
-                 if isinstance(resolved_at_str, str):
-                     try: rh[h]['resolved_at'] = datetime.fromisoformat(resolved_at_str.replace('Z', '+00:00'))
-                     except Exception: rh[h]['resolved_at'] = None
-                 else: rh[h]['resolved_at'] = None
-        self.meta['resolved_handles'] = rh
+        if isinstance(meta.get('quota'), dict): self.meta['quota'] = dict(meta['quota'])
+        for meta_key in ('resolved_handles', 'uploads_playlists'):
+            rh = {}
+            for h, v in meta.get(meta_key, {}).items():
+                 if isinstance(v, dict):
+                     rh[h] = dict(v)
+                     resolved_at_str = rh[h].get('resolved_at')
+                     if isinstance(resolved_at_str, str):
+                         try: rh[h]['resolved_at'] = datetime.fromisoformat(resolved_at_str.replace('Z', '+00:00'))
+                         except Exception: rh[h]['resolved_at'] = None
+                     else: rh[h]['resolved_at'] = None
+            self.meta[meta_key] = rh
+        self.meta['websub'] = {}
+        for cid, sub in (meta.get('websub') or {}).items():
+            if not isinstance(sub, dict): continue
+            sub = dict(sub)
+            for k in ('requested_at', 'verified_at', 'lease_expires'):
+                try: sub[k] = datetime.fromisoformat(sub[k].replace('Z', '+00:00')) if isinstance(sub.get(k), str) else None
+                except ValueError: sub[k] = None
+            self.meta['websub'][cid] = sub
+
+
+class QuotaTracker:
+    # *** NOVO: Contabiliza unidades gastas por endpoint/ciclo e persiste o total diário em meta['quota'] ***
+    def __init__(self, state: Optional[StateManager] = None, daily_budget: int = YOUTUBE_DAILY_QUOTA_BUDGET):
+        self.state = state; self.daily_budget = max(daily_budget, 1)
+        self._lock = threading.Lock(); self._local_quota: Dict[str, Any] = {}; self._unsaved = False # Contadores alterados desde o último mark_dirty
+        self.cycle_units: Dict[str, int] = defaultdict(int)
+    @staticmethod
+    def _day_key(now: Optional[datetime] = None) -> str:
+        return (now or datetime.now(timezone.utc)).astimezone(QUOTA_RESET_TZ).strftime('%Y-%m-%d')
+    def _today(self) -> Dict[str, Any]:
+        quota = self.state.meta.get('quota') if self.state is not None else self._local_quota
+        if not isinstance(quota, dict) or quota.get('day') != self._day_key(): quota = {'day': self._day_key(), 'used': 0, 'by_endpoint': {}}
+        return quota
+    def record(self, endpoint: str, units: Optional[int] = None):
+        units = QUOTA_COSTS.get(endpoint, 1) if units is None else units
+        with self._lock:
+            quota = self._today(); rollover = self.state is not None and (self.state.meta.get('quota') or {}).get('day') != quota['day']; by_endpoint = dict(quota.get('by_endpoint', {})); by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + units
+            # Substitui o dict inteiro (cópia) para não mutar algo que save_files pode estar serializando
+            new_quota = {'day': quota['day'], 'used': quota.get('used', 0) + units, 'by_endpoint': by_endpoint}
+            if self.state is not None:
+                # Estado sujo só na virada do dia; no resto, uma vez por ciclo (end_cycle) em vez de a cada chamada
+                self.state.meta['quota'] = new_quota; self._unsaved = True
+                if rollover: self.state.mark_dirty('state'); self._unsaved = False
+            else: self._local_quota = new_quota
+            self.cycle_units[endpoint] += units
+    @property
+    def used_today(self) -> int: return self._today().get('used', 0)
+    @staticmethod
+    def next_reset(now: Optional[datetime] = None) -> datetime:
+        """Próxima meia-noite em QUOTA_RESET_TZ (em UTC): quando a quota diária volta a zero."""
+        now_pt = (now or datetime.now(timezone.utc)).astimezone(QUOTA_RESET_TZ)
+        midnight = QUOTA_RESET_TZ.localize(datetime(now_pt.year, now_pt.month, now_pt.day) + timedelta(days=1))
+        return midnight.astimezone(timezone.utc)
+    def begin_cycle(self):
+        with self._lock: self.cycle_units = defaultdict(int)
+    def end_cycle(self, label: str) -> Dict[str, int]:
+        with self._lock:
+            spent = dict(self.cycle_units); self.cycle_units = defaultdict(int)
+            if self._unsaved and self.state is not None: self.state.mark_dirty('state'); self._unsaved = False
+        if spent: logger.info(f"[Quota] {label}: {sum(spent.values())} unidades ({', '.join(f'{k}={v}' for k, v in sorted(spent.items()))}) | Hoje: {self.used_today}/{self.daily_budget}")
+        return spent
+    def stretch_factor(self, priority: bool = False) -> float:
+        """Fator (>= 1) para alongar intervalos; inf = sem orçamento para esta prioridade hoje."""
+        used = self.used_today
+        # Prioridade (pré/pós-evento) mede o ritmo contra o orçamento inteiro; fundo, contra o orçamento menos a reserva
+        budget = self.daily_budget if priority else self.daily_budget * (100 - QUOTA_PRIORITY_RESERVE_PERCENT) / 100
+        if used >= budget: return float('inf')
+        now_pt = datetime.now(timezone.utc).astimezone(QUOTA_RESET_TZ)
+        day_elapsed = (now_pt.hour * 3600 + now_pt.minute * 60 + now_pt.second) / 86400
+        pace = (used / budget) / max(day_elapsed, 1 / 24)
+        return min(max(pace, 1.0), QUOTA_MAX_STRETCH_FACTOR)
+
+
+class APIResponseCache:
+    # *** NOVO: LRU limitado de respostas já processadas, indexado pela URL da requisição e validado por ETag ***
+    def __init__(self, max_entries: int = API_RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries; self._entries: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict(); self._lock = threading.Lock()
+        self.hits = 0; self.misses = 0; self.evictions = 0
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None: self._entries.move_to_end(key)
+            return entry
+    def put(self, key: str, etag: str, parsed: Any):
+        if self.max_entries <= 0 or not etag: return
+        with self._lock:
+            self._entries[key] = (etag, parsed); self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: self._entries.popitem(last=False); self.evictions += 1
+    def record(self, hit: bool):
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+    def summary(self) -> str:
+        total = self.hits + self.misses; ratio = (self.hits / total * 100) if total else 0.0
+        return f"{len(self._entries)}/{self.max_entries} entradas | {self.hits} hits (304) | {self.misses} misses | {ratio:.1f}% acerto | {self.evictions} despejos"
 
 
 class APIScraper:
     # (Com logs de depuração para playlist)
-    def __init__(self, api_key: str):
-        self.youtube = build("youtube", "v3", developerKey=api_key)
-        self.uploads_cache: Dict[str, str] = {}
+    # *** MODIFICADO: Chamadas à API em pool de threads limitado (API_CONCURRENCY), um cliente por thread ***
+    def __init__(self, api_key: str, quota: Optional[QuotaTracker] = None):
+        self.api_key = api_key
+        self.quota = quota or QuotaTracker()
+        self.response_cache = APIResponseCache()
+        self.youtube = self._build_client()
+        self.uploads_cache: Dict[str, Dict[str, Any]] = {} # Usado apenas quando não há StateManager (sem persistência)
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max(API_CONCURRENCY, 1), thread_name_prefix="yt-api")
+    def _build_client(self):
+        client_options = {"api_endpoint": YOUTUBE_API_BASE_URL} if YOUTUBE_API_BASE_URL else None
+        return build("youtube", "v3", developerKey=self.api_key, cache_discovery=False, client_options=client_options)
+    def _client(self):
+        # httplib2 não é thread-safe: cada thread do pool usa seu próprio cliente
+        client = getattr(self._local, 'youtube', None)
+        if client is None: client = self._local.youtube = self._build_client()
+        return client
+    def _execute(self, request) -> Dict[str, Any]:
+        endpoint = (getattr(request, 'methodId', None) or 'unknown').replace('youtube.', '', 1)
+        self.quota.record(endpoint) # A API cobra a unidade mesmo quando a chamada falha
+        METRICS.inc("youtube_api_requests_total", endpoint=endpoint); started = time.perf_counter()
+        try: return request.execute()
+        except HttpError as e:
+            status = getattr(e.resp, 'status', None)
+            if status == 304: METRICS.inc("youtube_api_not_modified_total", endpoint=endpoint)
+            else: METRICS.inc("youtube_api_errors_total", endpoint=endpoint, status=status or 'unknown')
+            raise
+        except Exception: METRICS.inc("youtube_api_errors_total", endpoint=endpoint, status='exception'); raise
+        finally: METRICS.observe("youtube_api_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+    def _execute_cached(self, request, parse):
+        """Executa com If-None-Match; em 304 devolve o resultado já processado (parse) da resposta anterior."""
+        if self.response_cache.max_entries <= 0: return parse(self._execute(request))
+        key = request.uri; cached = self.response_cache.get(key)
+        if cached: request.headers['If-None-Match'] = cached[0]
+        try: body = self._execute(request)
+        except HttpError as e:
+            if cached and getattr(e.resp, 'status', None) == 304: self.response_cache.record(hit=True); return cached[1]
+            raise
+        self.response_cache.record(hit=False); parsed = parse(body)
+        self.response_cache.put(key, body.get('etag', ''), parsed)
+        return parsed
     def resolve_channel_handles_to_ids(self, handles: List[str], state: StateManager) -> Dict[str, str]:
         resolved_this_run = {}; logger.info(f"Resolvendo {len(handles)} handles de canais para IDs... (usando cache quando possível)")
         now = datetime.now(timezone.utc)
@@ -320,12 +1169,12 @@ class APIScraper:
                          resolved_this_run[cid] = title; need_resolve = False
             if not need_resolve: continue
             try:
-                req = self.youtube.search().list(part="id,snippet", q=handle, type="channel", maxResults=1); res = req.execute()
+                req = self._client().search().list(part="id,snippet", q=handle, type="channel", maxResults=1); res = self._execute(req)
                 if items := res.get("items", []):
                     channel_id = items[0]["id"]["channelId"]; channel_title = items[0]["snippet"].get("channelTitle")
                     if channel_id and channel_title is not None:
                         resolved_this_run[channel_id] = channel_title
-                        state.meta.setdefault('resolved_handles', {})[handle] = {"channelId": channel_id, "channelTitle": channel_title, "resolved_at": now}
+                        state.meta.setdefault('resolved_handles', {})[handle] = {"channelId": channel_id, "channelTitle": channel_title, "resolved_at": now}; state.mark_dirty('state')
                         state.channels[channel_id] = channel_title
                         logger.info(f"Handle '{handle}' -> {channel_id} ({channel_title})")
                     else: logger.warning(f"API retornou dados incompletos para handle '{handle}'")
@@ -343,7 +1192,7 @@ class APIScraper:
         for i in range(0, len(ids_list), 50):
             batch_ids = ids_list[i:i+50]
             try:
-                req = self.youtube.channels().list(part="snippet", id=",".join(batch_ids)); res = req.execute()
+                req = self._client().channels().list(part="snippet", id=",".join(batch_ids)); res = self._execute(req)
                 for item in res.get("items", []):
                     cid = item.get("id"); title = item.get("snippet", {}).get("title")
                     if cid and title: fetched_titles[cid] = title; state.channels[cid] = title; logger.info(f"Título encontrado para ID {cid}: {title}")
@@ -356,77 +1205,109 @@ class APIScraper:
              if title: final_channels_dict[cid] = title
              else: logger.warning(f"ID de canal alvo {cid} sem título associado após busca.")
         return final_channels_dict
+    def _fetch_videos_batch(self, batch_number: int, batch: List[str], channels_dict: Dict[str, str]) -> List[Dict[str, Any]]:
+        try:
+            req = self._client().videos().list(part="snippet,liveStreamingDetails,contentDetails", id=",".join(batch))
+            records = self._execute_cached(req, lambda res: [self._format_stream_data(item, channels_dict) for item in res.get("items", [])])
+            # Cópias: update_streams altera os dicts recebidos e o cache precisa continuar intacto
+            return [dict(r, channel_name=channels_dict.get(r.get('channel_id'), r.get('channel_name'))) for r in records]
+        except HttpError as e: logger.error(f"Falha ao buscar detalhes do lote {batch_number}: {e}"); return []
     def fetch_streams_by_ids(self, video_ids: List[str], channels_dict: Dict[str, str]) -> List[Dict[str, Any]]:
         if not video_ids: return []
-        data = []; logger.info(f"Buscando detalhes para {len(video_ids)} video(s) específicos... (em batches)")
-        for i in range(0, len(video_ids), 50):
-            try:
-                batch = video_ids[i:i+50]
-                req = self.youtube.videos().list(part="snippet,liveStreamingDetails,contentDetails", id=",".join(batch)); res = req.execute()
-                for item in res.get("items", []): data.append(self._format_stream_data(item, channels_dict))
-            except HttpError as e: logger.error(f"Falha ao buscar detalhes do lote {i//50 + 1}: {e}")
+        logger.info(f"Buscando detalhes para {len(video_ids)} video(s) específicos... (em batches)")
+        video_ids = sorted(set(video_ids)) # Lotes estáveis entre ciclos aumentam os acertos do cache condicional
+        batches = [video_ids[i:i+50] for i in range(0, len(video_ids), 50)]
+        results = self._executor.map(lambda nb: self._fetch_videos_batch(nb[0], nb[1], channels_dict), enumerate(batches, start=1))
+        data = [stream for batch_data in results for stream in batch_data]
         logger.info(f"Recebidos detalhes de {len(data)} video(s).")
         return data
-    def fetch_all_streams_for_channels(self, channels_dict: Dict[str, str], published_after: Optional[str] = None) -> List[Dict[str, Any]]:
+    def _collect_search_video_ids(self, cid: str, published_after: Optional[str]) -> Set[str]:
+        ids: Set[str] = set(); page_token = None; page_count = 0
+        while True:
+            page_count += 1
+            try:
+                kwargs = {"part": "id", "channelId": cid, "type": "video", "maxResults": 50}
+                if page_token: kwargs['pageToken'] = page_token
+                if published_after: kwargs['publishedAfter'] = published_after
+                req = self._client().search().list(**kwargs); res = self._execute(req)
+                items = res.get('items', [])
+                if items: ids.update(item['id']['videoId'] for item in items if item.get('id', {}).get('videoId'))
+                page_token = res.get('nextPageToken')
+                if not page_token: break
+                if page_count > 20: logger.warning(f"Atingido limite páginas search.list canal {cid}."); break
+            except HttpError as e: logger.error(f"Erro API [search.list] canal {cid} (pág {page_count}): {e}"); break
+        return ids
+    def fetch_all_streams_for_channels(self, channels_dict: Dict[str, str], published_after: Optional[str] = None, state: Optional[StateManager] = None) -> List[Dict[str, Any]]:
         ids: Set[str] = set(); logger.info(f"Buscando streams [search.list] para {len(channels_dict)} canais (publishedAfter={published_after})...")
-        for cid in channels_dict.keys():
-            page_token = None; page_count = 0
-            while True:
-                page_count += 1
-                try:
-                    kwargs = {"part": "id", "channelId": cid, "type": "video", "maxResults": 50}
-                    if page_token: kwargs['pageToken'] = page_token
-                    if published_after: kwargs['publishedAfter'] = published_after
-                    req = self.youtube.search().list(**kwargs); res = req.execute()
-                    items = res.get('items', [])
-                    if items: ids.update(item['id']['videoId'] for item in items if item.get('id', {}).get('videoId'))
-                    page_token = res.get('nextPageToken')
-                    if not page_token: break
-                    if page_count > 20: logger.warning(f"Atingido limite páginas search.list canal {cid}."); break
-                except HttpError as e: logger.error(f"Erro API [search.list] canal {cid} (pág {page_count}): {e}"); break
+        for channel_ids in self._executor.map(lambda cid: self._collect_search_video_ids(cid, published_after), list(channels_dict.keys())): ids.update(channel_ids)
         logger.info(f"Busca [search.list] encontrou {len(ids)} IDs únicos. Buscando detalhes...")
         return self.fetch_streams_by_ids(list(ids), channels_dict)
-    def fetch_all_streams_for_channels_using_playlists(self, channels_dict: Dict[str, str], published_after: Optional[str] = None) -> List[Dict[str, Any]]:
-        ids: Set[str] = set(); logger.info(f"Buscando streams [playlistItems] para {len(channels_dict)} canais (publishedAfter={published_after})...")
+    def _fetch_uploads_batch(self, batch: List[str]) -> Dict[str, str]:
+        found = {}
+        try:
+            res = self._execute(self._client().channels().list(part='contentDetails', id=",".join(batch), maxResults=50))
+            for item in res.get('items', []):
+                playlist_id = item.get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads')
+                if item.get('id') and playlist_id: found[item['id']] = playlist_id
+        except HttpError as e: logger.error(f"Erro obter uploads playlists (lote de {len(batch)} canais): {e}")
+        return found
+    def resolve_uploads_playlists(self, channel_ids: List[str], state: Optional[StateManager] = None) -> Dict[str, str]:
+        # *** NOVO: Cache persistente (meta 'uploads_playlists', TTL) + channels.list em lotes de 50 IDs ***
+        now = datetime.now(timezone.utc); cache = state.meta.setdefault('uploads_playlists', {}) if state is not None else self.uploads_cache
+        resolved: Dict[str, str] = {}; misses: List[str] = []
+        for cid in channel_ids:
+            entry = cache.get(cid); resolved_at = entry.get('resolved_at') if isinstance(entry, dict) else None
+            if entry and entry.get('playlistId') and isinstance(resolved_at, datetime) and (now - resolved_at) < timedelta(hours=UPLOADS_PLAYLIST_TTL_HOURS): resolved[cid] = entry['playlistId']
+            else: misses.append(cid)
+        if misses:
+            logger.info(f"Resolvendo playlists 'uploads' de {len(misses)} canais ({len(resolved)} em cache)...")
+            batches = [misses[i:i+50] for i in range(0, len(misses), 50)]
+            for found in self._executor.map(self._fetch_uploads_batch, batches):
+                for cid, playlist_id in found.items(): cache[cid] = {"playlistId": playlist_id, "resolved_at": now}; resolved[cid] = playlist_id
+            for cid in set(misses) - set(resolved): logger.warning(f"Canal {cid} sem playlist 'uploads'.")
+            if state is not None: state.mark_dirty('state')
+        return resolved
+    @staticmethod
+    def _parse_playlist_page(res: Dict[str, Any]) -> Dict[str, Any]:
+        items = []
+        for it in res.get('items', []):
+            snip = it.get('snippet', {}); items.append((snip.get('resourceId', {}).get('videoId'), snip.get('publishedAt')))
+        return {'items': items, 'nextPageToken': res.get('nextPageToken')}
+    def _collect_playlist_video_ids(self, cid: str, playlist_id: str, published_after_dt: Optional[datetime]) -> Set[str]:
+        ids: Set[str] = set()
+        page_token = None; page_count = 0; stopped_early = False
+        while True:
+            page_count += 1
+            try:
+                kwargs = {'part': 'snippet', 'playlistId': playlist_id, 'maxResults': 50}
+                if page_token: kwargs['pageToken'] = page_token
+                page = self._execute_cached(self._client().playlistItems().list(**kwargs), self._parse_playlist_page)
+                stop_pagination = False
+                for vid, publishedAt in page['items']:
+                    if published_after_dt and publishedAt:
+                        try:
+                            pa_dt = datetime.fromisoformat(publishedAt.replace('Z', '+00:00'))
+                            if pa_dt <= published_after_dt:
+                                stop_pagination = True; stopped_early = True
+                                logger.debug(f"Playlist {playlist_id} (Canal {cid}): Stop pagination at video {vid} (published: {pa_dt})")
+                                break
+                        except Exception as e: logger.warning(f"Erro ao parsear publishedAt '{publishedAt}' para video {vid}: {e}"); pass
+                    if vid: ids.add(vid)
+                if stop_pagination: break
+                page_token = page.get('nextPageToken')
+                if not page_token: break
+                if page_count > 40: logger.warning(f"Atingido limite páginas playlistItems {playlist_id}."); break
+            except HttpError as e: logger.error(f"Erro [playlistItems] playlist {playlist_id} (pág {page_count}): {e}"); break
+        logger.debug(f"Playlist {playlist_id} (Canal {cid}): Paginação {'interrompida' if stopped_early else 'completa'} ({page_count} pág).")
+        return ids
+    def fetch_all_streams_for_channels_using_playlists(self, channels_dict: Dict[str, str], published_after: Optional[str] = None, state: Optional[StateManager] = None) -> List[Dict[str, Any]]:
+        ids: Set[str] = set(); logger.info(f"Buscando streams [playlistItems] para {len(channels_dict)} canais (publishedAfter={published_after}, concorrência={API_CONCURRENCY})...")
         published_after_dt = None
         if published_after:
             try: published_after_dt = datetime.fromisoformat(published_after.replace('Z', '+00:00')); logger.debug(f"Fetch using playlists: Filtro published_after_dt={published_after_dt}")
             except Exception as e: logger.error(f"Erro ao parsear published_after '{published_after}': {e}"); published_after_dt = None
-        for cid in channels_dict.keys():
-            playlist_id = self.uploads_cache.get(cid)
-            if not playlist_id:
-                try:
-                    ch_req = self.youtube.channels().list(part='contentDetails', id=cid, maxResults=1); ch_res = ch_req.execute()
-                    items = ch_res.get('items', []);
-                    if items: playlist_id = items[0]['contentDetails']['relatedPlaylists'].get('uploads')
-                    if playlist_id: self.uploads_cache[cid] = playlist_id
-                    else: logger.warning(f"Canal {cid} sem playlist 'uploads'."); continue
-                except HttpError as e: logger.error(f"Erro obter uploads playlist {cid}: {e}"); continue
-            page_token = None; page_count = 0; stopped_early = False
-            while True:
-                page_count += 1
-                try:
-                    kwargs = {'part': 'snippet', 'playlistId': playlist_id, 'maxResults': 50}
-                    if page_token: kwargs['pageToken'] = page_token
-                    res = self.youtube.playlistItems().list(**kwargs).execute(); items = res.get('items', [])
-                    stop_pagination = False
-                    for it in items:
-                        snip = it.get('snippet', {}); resource = snip.get('resourceId', {}); vid = resource.get('videoId'); publishedAt = snip.get('publishedAt')
-                        if published_after_dt and publishedAt:
-                            try:
-                                pa_dt = datetime.fromisoformat(publishedAt.replace('Z', '+00:00'))
-                                if pa_dt <= published_after_dt:
-                                    stop_pagination = True; stopped_early = True
-                                    logger.debug(f"Playlist {playlist_id} (Canal {cid}): Stop pagination at video {vid} (published: {pa_dt})")
-                                    break
-                            except Exception as e: logger.warning(f"Erro ao parsear publishedAt '{publishedAt}' para video {vid}: {e}"); pass
-                        if vid: ids.add(vid)
-                    if stop_pagination: break
-                    page_token = res.get('nextPageToken')
-                    if not page_token: break
-                    if page_count > 40: logger.warning(f"Atingido limite páginas playlistItems {playlist_id}."); break
-                except HttpError as e: logger.error(f"Erro [playlistItems] playlist {playlist_id} (pág {page_count}): {e}"); break
-            logger.debug(f"Playlist {playlist_id} (Canal {cid}): Paginação {'interrompida' if stopped_early else 'completa'} ({page_count} pág).")
+        uploads = self.resolve_uploads_playlists(list(channels_dict.keys()), state)
+        for channel_ids in self._executor.map(lambda item: self._collect_playlist_video_ids(item[0], item[1], published_after_dt), list(uploads.items())): ids.update(channel_ids)
         logger.info(f"Busca [playlistItems] encontrou {len(ids)} IDs únicos. Buscando detalhes...")
         return self.fetch_streams_by_ids(list(ids), channels_dict)
     def _format_stream_data(self, item: Dict, channels_dict: Dict[str, str]) -> Dict:
@@ -454,6 +1335,13 @@ class APIScraper:
 
 class ContentGenerator:
     # *** MODIFICADO: _get_display_title usa Mapeamento e Inverte Ordem ***
+    def __init__(self, state_manager: Optional['StateManager'] = None):
+        self.state_manager = state_manager # *** NOVO: Com streams=None, os geradores usam os índices do StateManager ***
+    def _candidate_count(self, streams: Optional[List[Dict[str, Any]]]) -> int:
+        return len(streams) if streams is not None else len(self.state_manager.streams)
+    def _content_time(self) -> datetime:
+        # Hora da última mudança do estado (não do render): o conteúdo/sha1 fica igual enquanto os dados não mudam
+        return self.state_manager.version_changed_at if self.state_manager is not None else datetime.now(timezone.utc)
     def _is_live(self, stream: Dict[str, Any]) -> bool:
         start_time = stream.get('actual_start_time_utc'); is_live_status = stream.get('status') == 'live'
         has_started = isinstance(start_time, datetime); has_not_ended = not stream.get('actual_end_time_utc')
@@ -463,9 +1351,10 @@ class ContentGenerator:
         time_val = stream.get('actual_start_time_utc') or stream.get('scheduled_start_time_utc')
         if isinstance(time_val, datetime): return time_val
         return datetime.max.replace(tzinfo=timezone.utc)
-    def _filter_streams(self, streams: List[Dict[str, Any]], mode: str) -> List[Dict[str, Any]]:
-        # (Lógica sem alterações)
+    def _filter_streams(self, streams: Optional[List[Dict[str, Any]]], mode: str) -> List[Dict[str, Any]]:
         now_utc = datetime.now(timezone.utc)
+        # streams=None: usa os índices já ordenados do StateManager (evita copiar e ordenar O(N log N) por render)
+        if streams is None: return self.state_manager.select_streams(mode, now_utc)
         upcoming_count = defaultdict(int); recorded_count = defaultdict(int); filtered = []
         sort_key_func = ContentGenerator._get_sortable_time; reverse_sort = False
         if mode == 'vod':
@@ -525,9 +1414,12 @@ class ContentGenerator:
 
 class M3UGenerator(ContentGenerator):
     # (Com placeholder invisível e prefixo de status no placeholder)
-    def generate_playlist(self, streams: List, db: Dict, mode: str) -> str:
-        logger.info(f"Gerando playlist M3U modo '{mode.upper()}'. Avaliando {len(streams)} streams...")
-        lines = ["#EXTM3U", f"# Atualizado: {datetime.now(local_tz).strftime('%Y-%m-%d %H:%M:%S %Z')} - MODO: {mode.upper()}"]
+    # *** MODIFICADO: iter_playlist gera o M3U em pedaços; generate_playlist apenas junta ***
+    def generate_playlist(self, streams: Optional[List], db: Dict, mode: str) -> str:
+        return "".join(self.iter_playlist(streams, db, mode))
+    def iter_playlist(self, streams: Optional[List], db: Dict, mode: str) -> Iterator[str]:
+        logger.info(f"Gerando playlist M3U modo '{mode.upper()}'. Avaliando {self._candidate_count(streams)} streams...")
+        yield "#EXTM3U"; yield f"\n# Atualizado: {self._content_time().astimezone(local_tz).strftime('%Y-%m-%d %H:%M:%S %Z')} - MODO: {mode.upper()}"
         filtered_streams = self._filter_streams(streams, mode)
         if not filtered_streams and PLACEHOLDER_IMAGE_URL:
             placeholder_id, base_placeholder_title = "", ""; placeholder_prefix = ""
@@ -552,14 +1444,13 @@ class M3UGenerator(ContentGenerator):
             elif mode == 'vod': stream_url = s.get('watch_url', '')
             else: stream_url = s.get("thumbnail_url", "")
             extinf_title = title.replace('\n', ' ').replace('\r', ' ')
-            lines.append(f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{extinf_title}" tvg-logo="{logo_url}" group-title="{cat}",{extinf_title}')
+            yield f'\n#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{extinf_title}" tvg-logo="{logo_url}" group-title="{cat}",{extinf_title}'
             if stream_url:
-                if is_placeholder and USE_INVISIBLE_PLACEHOLDER: lines.append(f"#{stream_url}")
-                else: lines.append(stream_url)
+                if is_placeholder and USE_INVISIBLE_PLACEHOLDER: yield f"\n#{stream_url}"
+                else: yield f"\n{stream_url}"
             else:
                  if not is_placeholder: logger.warning(f"Stream {tvg_id} ('{title}') sem URL na playlist {mode.upper()}.")
         logger.info(f"Playlist M3U '{mode.upper()}' finalizada com {len(filtered_streams)} items.")
-        return "\n".join(lines)
 
 
 class XMLTVGenerator(ContentGenerator):
@@ -590,17 +1481,20 @@ class XMLTVGenerator(ContentGenerator):
              if total_seconds > max_seconds_timedelta: logger.warning(f"Duração ISO '{duration_str}' excede limite. Ignorando."); return None
              return timedelta(hours=hours, minutes=minutes, seconds=seconds)
         except ValueError: return None
-    def generate_xml(self, channels: Dict, streams: List, db: Dict) -> str:
-        logger.info(f"Gerando EPG XMLTV. Avaliando {len(streams)} streams...")
-        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<tv>']; now_utc = datetime.now(timezone.utc); datetime_max_utc = datetime.max.replace(tzinfo=timezone.utc)
+    # *** MODIFICADO: iter_xml gera o EPG em pedaços (um por canal/programa); generate_xml apenas junta ***
+    def generate_xml(self, channels: Dict, streams: Optional[List], db: Dict) -> str:
+        return "".join(self.iter_xml(channels, streams, db))
+    def iter_xml(self, channels: Dict, streams: Optional[List], db: Dict) -> Iterator[str]:
+        logger.info(f"Gerando EPG XMLTV. Avaliando {self._candidate_count(streams)} streams...")
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<tv>'; now_utc = datetime.now(timezone.utc); datetime_max_utc = datetime.max.replace(tzinfo=timezone.utc)
         live_streams = self._filter_streams(streams, 'live'); upcoming_streams = self._filter_streams(streams, 'upcoming'); recorded_streams = self._filter_streams(streams, 'vod') if KEEP_RECORDED_STREAMS else []
-        placeholder_streams = []
+        placeholder_streams = []; placeholder_start = now_utc.replace(minute=0, second=0, microsecond=0) # Hora cheia: o EPG só muda quando a janela avança
         if PLACEHOLDER_IMAGE_URL:
             def create_placeholder(ph_id, base_title, status_prefix_text):
                 final_title = base_title;
                 if PREFIX_TITLE_WITH_STATUS: final_title = status_prefix_text + base_title
                 cleaned_escaped_title = self._clean_text_for_xml(final_title)
-                return { 'video_id': ph_id, 'title_original': cleaned_escaped_title, 'status': 'none', 'category_original': None, 'thumbnail_url': PLACEHOLDER_IMAGE_URL, 'scheduled_start_time_utc': now_utc, '_end_time_override': now_utc + timedelta(hours=1) }
+                return { 'video_id': ph_id, 'title_original': cleaned_escaped_title, 'status': 'none', 'category_original': None, 'thumbnail_url': PLACEHOLDER_IMAGE_URL, 'scheduled_start_time_utc': placeholder_start, '_end_time_override': placeholder_start + timedelta(hours=2) }
             if not live_streams: placeholder_streams.append(create_placeholder(PLACEHOLDER_LIVE_ID, PLACEHOLDER_LIVE_TITLE, "[Ao Vivo] "))
             if not upcoming_streams: placeholder_streams.append(create_placeholder(PLACEHOLDER_UPCOMING_ID, PLACEHOLDER_UPCOMING_TITLE, "[Agendado] "))
             if KEEP_RECORDED_STREAMS and not recorded_streams: placeholder_streams.append(create_placeholder(PLACEHOLDER_VOD_ID, PLACEHOLDER_VOD_TITLE, "[Gravado] "))
@@ -613,7 +1507,7 @@ class XMLTVGenerator(ContentGenerator):
                 is_placeholder = video_id_raw.startswith('PLACEHOLDER_'); channel_title_raw = s['title_original'] if is_placeholder else self._get_display_title(s)
                 # Placeholders já vêm limpos/escapados
                 channel_title_cleaned_escaped = s['title_original'] if is_placeholder else self._clean_text_for_xml(channel_title_raw)
-                lines.append(f'  <channel id="{video_id}"><display-name>{channel_title_cleaned_escaped}</display-name></channel>')
+                yield f'\n  <channel id="{video_id}"><display-name>{channel_title_cleaned_escaped}</display-name></channel>'
                 processed_channel_ids.add(video_id)
         for s in all_streams_for_epg:
             video_id_raw = s.get('video_id', '');
@@ -669,36 +1563,281 @@ class XMLTVGenerator(ContentGenerator):
             programme_lines = [f'  <programme start="{start_str}" stop="{end_str}" channel="{video_id}">', f'    <title lang="pt">{main_title_cleaned_escaped}</title>']
             if sub_title_cleaned_escaped: programme_lines.append(f'    <sub-title lang="pt">{sub_title_cleaned_escaped}</sub-title>')
             programme_lines.extend([f'    <desc lang="pt">{description_cleaned_escaped}</desc>', f'    <icon src="{icon_url}"/>' if icon_url else '', f'    <category lang="pt">{category_cleaned_escaped}</category>', f'    <rating system="BR"><value>{rating}</value></rating>', '  </programme>'])
-            lines.extend(line for line in programme_lines if line)
-        lines.append('</tv>')
+            yield "".join(f"\n{line}" for line in programme_lines if line)
+        yield '\n</tv>'
         logger.info(f"EPG XMLTV finalizado {len(all_streams_for_epg)} programas (reais+placeholders).")
-        return "\n".join(lines)
+
+ATOM_NS = {'atom': 'http://www.w3.org/2005/Atom', 'yt': 'http://www.youtube.com/xml/schemas/2015', 'at': 'http://purl.org/atompub/tombstones/1.0'}
+
+def parse_websub_feed(body: bytes, channel_id: str) -> Tuple[Set[str], Set[str]]:
+    """(vídeos novos/atualizados, vídeos removidos) de uma notificação Atom do YouTube; entradas de outros canais são ignoradas."""
+    root = ElementTree.fromstring(body); updated: Set[str] = set(); deleted: Set[str] = set()
+    for entry in root.iterfind('atom:entry', ATOM_NS):
+        vid = (entry.findtext('yt:videoId', '', ATOM_NS) or '').strip(); entry_channel = (entry.findtext('yt:channelId', '', ATOM_NS) or '').strip()
+        if vid and entry_channel in ('', channel_id): updated.add(vid)
+    for entry in root.iterfind('at:deleted-entry', ATOM_NS):
+        ref = entry.get('ref', ''); uri = entry.findtext('at:by/atom:uri', '', ATOM_NS) or ''
+        if ref.startswith('yt:video:') and (not uri or uri.rstrip('/').endswith(channel_id)): deleted.add(ref[len('yt:video:'):])
+    return updated, deleted
+
+class WebSubManager:
+    # *** NOVO: Inscrições WebSub por canal alvo (leases em meta['websub']) e recebimento das notificações Atom ***
+    MAX_NOTIFICATION_BYTES = 1024 * 1024
+    def __init__(self, state_manager: StateManager, on_videos=None):
+        self.state_manager = state_manager; self.on_videos = on_videos # on_videos(set de video_ids): chamado da thread do Flask
+        self._lock = threading.Lock(); self.stats: Counter = Counter()
+        METRICS.add_collector(self._metrics)
+    @property
+    def subscriptions(self) -> Dict[str, Dict[str, Any]]: return self.state_manager.meta.setdefault('websub', {})
+    def _set(self, channel_id: str, **changes):
+        # Substitui o dict inteiro (a serialização do estado pode estar copiando meta em outra thread)
+        with self._lock: self.subscriptions[channel_id] = dict(self.subscriptions.get(channel_id, {}), **changes)
+        self.state_manager.mark_dirty('state')
+    @staticmethod
+    def callback_url(channel_id: str) -> str: return f"{WEBSUB_CALLBACK_URL}/{urllib.parse.quote(channel_id)}"
+    @staticmethod
+    def topic_url(channel_id: str) -> str: return WEBSUB_TOPIC_URL.format(channel_id=channel_id)
+    def is_active(self, channel_id: str, now: Optional[datetime] = None) -> bool:
+        sub = self.subscriptions.get(channel_id) or {}; expires = sub.get('lease_expires')
+        return sub.get('status') == 'active' and isinstance(expires, datetime) and expires > (now or datetime.now(timezone.utc))
+    def all_active(self, channel_ids) -> bool:
+        now = datetime.now(timezone.utc); return bool(channel_ids) and all(self.is_active(cid, now) for cid in channel_ids)
+    def _request(self, channel_id: str, mode: str) -> bool:
+        params = {'hub.callback': self.callback_url(channel_id), 'hub.mode': mode, 'hub.topic': self.topic_url(channel_id), 'hub.verify': 'async'}
+        if mode == 'subscribe':
+            params['hub.lease_seconds'] = str(WEBSUB_LEASE_SECONDS)
+            if WEBSUB_SECRET: params['hub.secret'] = WEBSUB_SECRET
+        request_obj = urllib.request.Request(WEBSUB_HUB_URL, data=urllib.parse.urlencode(params).encode('utf-8'), method='POST', headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        try:
+            with urllib.request.urlopen(request_obj, timeout=15) as response: status = response.status
+        except urllib.error.HTTPError as e: logger.error(f"[WebSub] Hub recusou {mode} de {channel_id}: HTTP {e.code} {e.read(200)!r}"); return False
+        except (OSError, ValueError) as e: logger.error(f"[WebSub] Falha ao contatar o hub ({mode} {channel_id}): {e}"); return False
+        logger.debug(f"[WebSub] {mode} {channel_id}: hub respondeu {status}")
+        return status in (202, 204)
+    def subscribe(self, channel_id: str) -> bool:
+        self._set(channel_id, status='pending', requested_at=datetime.now(timezone.utc)) # Antes do POST: a verificação pode chegar antes da resposta
+        ok = self._request(channel_id, 'subscribe'); self.stats['subscribe_requests'] += 1
+        if not ok: self._set(channel_id, status='failed')
+        return ok
+    def unsubscribe(self, channel_id: str) -> bool:
+        self._set(channel_id, status='unsubscribing', requested_at=datetime.now(timezone.utc))
+        return self._request(channel_id, 'unsubscribe')
+    def maintain(self, channel_ids) -> Dict[str, int]:
+        """Inscreve canais novos/sem lease, renova leases perto do fim e cancela canais que deixaram de ser alvo."""
+        now = datetime.now(timezone.utc); targets = set(channel_ids); margin = timedelta(hours=WEBSUB_RENEW_MARGIN_HOURS); retry = timedelta(minutes=WEBSUB_RETRY_MINUTES)
+        to_subscribe = []
+        for cid in sorted(targets):
+            sub = self.subscriptions.get(cid) or {}; expires = sub.get('lease_expires'); requested = sub.get('requested_at')
+            if sub.get('status') == 'active' and isinstance(expires, datetime) and expires - now > margin: continue
+            if isinstance(requested, datetime) and now - requested < retry: continue # Pedido recente (aguardando verificação, negado ou hub fora)
+            to_subscribe.append(cid)
+        to_unsubscribe = [cid for cid, sub in list(self.subscriptions.items()) if cid not in targets and sub.get('status') != 'unsubscribing']
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="websub") as pool:
+            subscribed = sum(pool.map(self.subscribe, to_subscribe)); unsubscribed = sum(pool.map(self.unsubscribe, to_unsubscribe))
+        if to_subscribe or to_unsubscribe:
+            logger.info(f"[WebSub] Manutenção: {subscribed}/{len(to_subscribe)} inscrição(ões) enviada(s), {unsubscribed}/{len(to_unsubscribe)} cancelamento(s); ativas: {sum(self.is_active(cid, now) for cid in targets)}/{len(targets)}")
+        return {'subscribe': len(to_subscribe), 'unsubscribe': len(to_unsubscribe)}
+    def verify(self, channel_id: str, args) -> Optional[str]:
+        """Verificação de intenção do hub (GET): devolve o challenge se o pedido confere com o que solicitamos, senão None (404)."""
+        mode = args.get('hub.mode'); topic = args.get('hub.topic'); sub = self.subscriptions.get(channel_id)
+        if mode == 'denied':
+            if sub is not None: self._set(channel_id, status='denied'); logger.warning(f"[WebSub] Hub negou a inscrição de {channel_id}: {args.get('hub.reason', '-')}")
+            return ""
+        if topic != self.topic_url(channel_id) or not args.get('hub.challenge'): return None
+        if mode == 'subscribe':
+            if channel_id not in self.state_manager.get_all_channels() or sub is None or sub.get('status') == 'unsubscribing': return None
+            try: lease = int(args.get('hub.lease_seconds') or WEBSUB_LEASE_SECONDS)
+            except ValueError: lease = WEBSUB_LEASE_SECONDS
+            now = datetime.now(timezone.utc); self._set(channel_id, status='active', verified_at=now, lease_expires=now + timedelta(seconds=lease))
+            logger.info(f"[WebSub] Inscrição de {channel_id} confirmada (lease {lease}s).")
+        elif mode == 'unsubscribe':
+            if channel_id in self.state_manager.get_all_channels(): return None
+            with self._lock: self.subscriptions.pop(channel_id, None)
+            self.state_manager.mark_dirty('state'); logger.info(f"[WebSub] Inscrição de {channel_id} cancelada.")
+        else: return None
+        return args['hub.challenge']
+    def _signature_ok(self, body: bytes, signature: str) -> bool:
+        if not WEBSUB_SECRET: return True
+        algorithm, _, digest = signature.partition('=')
+        if algorithm not in ('sha1', 'sha256', 'sha384', 'sha512') or not digest: return False
+        return hmac.compare_digest(hmac.new(WEBSUB_SECRET.encode('utf-8'), body, algorithm).hexdigest(), digest.strip().lower())
+    def handle_notification(self, channel_id: str, body: bytes, signature: str) -> int:
+        """Notificação (POST): IDs novos/atualizados/removidos vão para o agendador. Devolve quantos IDs foram encaminhados."""
+        if not self._signature_ok(body, signature):
+            self.stats['bad_signature'] += 1; METRICS.inc("websub_notifications_total", result='bad_signature')
+            logger.warning(f"[WebSub] Notificação para {channel_id} com assinatura inválida ignorada."); return 0
+        if channel_id not in self.state_manager.get_all_channels():
+            METRICS.inc("websub_notifications_total", result='unknown_channel'); return 0
+        try: updated, deleted = parse_websub_feed(body, channel_id)
+        except ElementTree.ParseError as e:
+            METRICS.inc("websub_notifications_total", result='invalid'); logger.warning(f"[WebSub] Notificação inválida para {channel_id}: {e}"); return 0
+        video_ids = updated | deleted
+        METRICS.inc("websub_notifications_total", result='accepted'); METRICS.inc("websub_pushed_videos_total", len(video_ids))
+        self.stats['notifications'] += 1; self.stats['videos'] += len(video_ids)
+        if video_ids:
+            logger.info(f"[WebSub] {channel_id}: {len(updated)} vídeo(s) novo(s)/atualizado(s), {len(deleted)} removido(s): {sorted(video_ids)}")
+            if self.on_videos is not None: self.on_videos(video_ids)
+        return len(video_ids)
+    def _metrics(self):
+        now = datetime.now(timezone.utc); subs = list(self.subscriptions.items())
+        for status in ('active', 'pending', 'denied', 'failed', 'unsubscribing'): yield "websub_subscriptions", {'status': status}, sum(1 for _, sub in subs if sub.get('status') == status)
+        yield "websub_active_leases", {}, sum(1 for cid, _ in subs if self.is_active(cid, now))
 
 class WebServer:
-    # (Sem alterações)
+    # *** MODIFICADO: Serve artefatos renderizados uma única vez por versão do estado (ETag/304/gzip) ***
     def __init__(self, state_manager: StateManager):
         self.app = Flask(__name__); self.app.logger.disabled = True; log = logging.getLogger('werkzeug'); log.setLevel(logging.ERROR); log.disabled = True
-        self.state_manager = state_manager; self.m3u_gen, self.xmltv_gen = M3UGenerator(), XMLTVGenerator(); self.categories_db: Dict = {}
+        self.state_manager = state_manager; self.m3u_gen, self.xmltv_gen = M3UGenerator(state_manager), XMLTVGenerator(state_manager); self.categories_db: Dict = {}
+        self._categories_version = 0
+        self._artifact_cache: Dict[str, Dict[str, Any]] = {}
+        self._artifact_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in ('live', 'upcoming', 'vod', 'epg')}
+        METRICS.add_collector(self._state_metrics)
+        self.websub: Optional[WebSubManager] = None # Definido no main quando WEBSUB_ENABLED
         self._setup_routes()
-    def set_categories_db(self, categories: Dict): self.categories_db = categories
+    def set_categories_db(self, categories: Dict): self.categories_db = categories; self._categories_version += 1
+    @staticmethod
+    def artifact_routes() -> List[Tuple[str, str, str]]:
+        return [('live', f"/{PLAYLIST_LIVE_FILENAME}", "application/vnd.apple.mpegurl"), ('upcoming', f"/{PLAYLIST_UPCOMING_FILENAME}", "application/vnd.apple.mpegurl"),
+                ('vod', f"/{PLAYLIST_VOD_FILENAME}", "application/vnd.apple.mpegurl"), ('epg', f"/{XMLTV_FILENAME}", "application/xml")]
+    def _iter_artifact(self, name: str) -> Iterator[bytes]:
+        if name == 'epg': return instrument_render(name, encode_chunks(self.xmltv_gen.iter_xml(self.state_manager.get_all_channels(), None, self.categories_db)))
+        return instrument_render(name, encode_chunks(self.m3u_gen.iter_playlist(None, self.categories_db, name)))
+    def _state_metrics(self):
+        counts = self.state_manager.count_by_status()
+        for status in ('live', 'upcoming', 'none'): yield "state_streams", {'status': status}, counts.get(status, 0)
+        yield "state_channels", {}, len(self.state_manager.get_all_channels()); yield "state_version", {}, self.state_manager.version
+    def _is_artifact_fresh(self, entry: Optional[Dict[str, Any]], key: tuple) -> bool:
+        if not entry or entry['key'] != key: return False
+        return (datetime.now(timezone.utc) - entry['checked_at']) < timedelta(seconds=ARTIFACT_CACHE_MAX_AGE_SECONDS)
+    def _get_artifact(self, name: str) -> Dict[str, Any]:
+        key = (self.state_manager.version, self._categories_version)
+        entry = self._artifact_cache.get(name)
+        if self._is_artifact_fresh(entry, key): return entry
+        with self._artifact_locks[name]:
+            # Outra thread pode ter renderizado enquanto esperávamos o lock
+            entry = self._artifact_cache.get(name)
+            if self._is_artifact_fresh(entry, key): return entry
+            parts: List[bytes] = []; gzip_parts: List[bytes] = []; hasher = hashlib.sha1(); compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in self._iter_artifact(name): parts.append(chunk); hasher.update(chunk); gzip_parts.append(compressor.compress(chunk))
+            gzip_parts.append(compressor.flush()); body = b"".join(parts); digest = hasher.hexdigest()
+            rendered_at = datetime.now(timezone.utc).replace(microsecond=0)
+            if entry is not None and entry['etag'] == digest: rendered_at = entry['rendered_at'] # Expirou mas não mudou: mantém Last-Modified
+            entry = {'key': key, 'rendered_at': rendered_at, 'checked_at': datetime.now(timezone.utc), 'body': body, 'gzip': b"".join(gzip_parts), 'etag': digest, 'etag_gzip': f"{digest}-gz"}
+            self._artifact_cache[name] = entry
+            logger.debug(f"Artefato '{name}' renderizado (versão {key[0]}, {len(body)} bytes, gzip {len(entry['gzip'])} bytes).")
+            return entry
+    def _serve_artifact(self, name: str, mimetype: str) -> Response:
+        if not HTTP_ARTIFACT_CACHE: return Response(stream_with_context(self._iter_artifact(name)), mimetype=mimetype) # Chunked, memória constante
+        entry = self._get_artifact(name)
+        use_gzip = request.accept_encodings['gzip'] > 0 # Honra q=0 ('gzip;q=0', 'identity, gzip;q=0')
+        etag = entry['etag_gzip'] if use_gzip else entry['etag']
+        # If-None-Match usa comparação fraca (RFC 7232): "*" e W/"etag" também casam; If-Modified-Since só vale sem If-None-Match
+        if_none_match = request.if_none_match
+        not_modified = (if_none_match.star_tag or if_none_match.contains_weak(etag)) if if_none_match else (request.if_modified_since is not None and entry['rendered_at'] <= request.if_modified_since)
+        response = Response(status=304) if not_modified else Response(entry['gzip'] if use_gzip else entry['body'], mimetype=mimetype)
+        if use_gzip and not not_modified: response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag); response.last_modified = entry['rendered_at']
+        response.headers['Vary'] = 'Accept-Encoding'; response.headers['Cache-Control'] = 'no-cache'
+        return response
     def _setup_routes(self):
         @self.app.before_request
         def log_request_info():
-            if request.path != '/favicon.ico': logger.info(f"Req: {request.method} {request.path} de {request.remote_addr}")
+            request.environ['get_streams.started'] = time.perf_counter()
+            if request.path not in ('/favicon.ico', '/metrics'): logger.info(f"Req: {request.method} {request.path} de {request.remote_addr}")
+        @self.app.after_request
+        def record_request_metrics(response):
+            # *** NOVO: Contagem/latência por rota (regra do Flask, não o caminho cru, para não explodir as séries) ***
+            started = request.environ.get('get_streams.started'); route = request.url_rule.rule if request.url_rule else 'unmatched'
+            METRICS.inc("http_requests_total", route=route, status=response.status_code)
+            if started is not None: METRICS.observe("http_request_seconds", time.perf_counter() - started, route=route)
+            return response
+        @self.app.route("/websub/<channel_id>", methods=["GET", "POST"])
+        def websub_callback(channel_id):
+            # *** NOVO: Callback WebSub: GET = verificação de intenção (challenge), POST = notificação Atom ***
+            if self.websub is None: return Response("Not Found\n", status=404, mimetype="text/plain")
+            if request.method == 'GET':
+                challenge = self.websub.verify(channel_id, request.args)
+                return Response(challenge, mimetype="text/plain") if challenge is not None else Response("Not Found\n", status=404, mimetype="text/plain")
+            if (request.content_length or 0) > WebSubManager.MAX_NOTIFICATION_BYTES: return Response(status=413)
+            self.websub.handle_notification(channel_id, request.get_data(cache=False), request.headers.get('X-Hub-Signature', ''))
+            return Response(status=204) # 2xx mesmo quando ignorada (o hub não deve reenviar)
+        @self.app.route("/admin/profile", methods=["GET", "POST"])
+        def admin_profile():
+            # *** NOVO: Arma o perfil sob demanda (POST ?cycles=N&mode=cprofile|sample); exige ADMIN_TOKEN ***
+            if not ADMIN_TOKEN: return Response("Not Found\n", status=404, mimetype="text/plain")
+            supplied = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')): return Response("Forbidden\n", status=403, mimetype="text/plain")
+            if request.method == 'GET': return PROFILER.status()
+            try: return PROFILER.arm(int(request.args.get('cycles', PROFILE_SIGNAL_CYCLES)), request.args.get('mode'))
+            except ValueError as e: return {'error': str(e)}, 400
+        @self.app.route("/metrics")
+        def serve_metrics():
+            if not METRICS.enabled: return Response("Métricas desativadas (METRICS_ENABLED=false)\n", status=404, mimetype="text/plain")
+            return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
         @self.app.route(f"/{PLAYLIST_LIVE_FILENAME}")
-        def serve_live_playlist(): content = self.m3u_gen.generate_playlist(self.state_manager.get_all_streams(), self.categories_db, 'live'); return Response(content, mimetype="application/vnd.apple.mpegurl")
+        def serve_live_playlist(): return self._serve_artifact('live', "application/vnd.apple.mpegurl")
         @self.app.route(f"/{PLAYLIST_UPCOMING_FILENAME}")
-        def serve_upcoming_playlist(): content = self.m3u_gen.generate_playlist(self.state_manager.get_all_streams(), self.categories_db, 'upcoming'); return Response(content, mimetype="application/vnd.apple.mpegurl")
+        def serve_upcoming_playlist(): return self._serve_artifact('upcoming', "application/vnd.apple.mpegurl")
         @self.app.route(f"/{PLAYLIST_VOD_FILENAME}")
-        def serve_vod_playlist(): content = self.m3u_gen.generate_playlist(self.state_manager.get_all_streams(), self.categories_db, 'vod'); return Response(content, mimetype="application/vnd.apple.mpegurl")
+        def serve_vod_playlist(): return self._serve_artifact('vod', "application/vnd.apple.mpegurl")
         @self.app.route(f"/{XMLTV_FILENAME}")
-        def serve_epg(): content = self.xmltv_gen.generate_xml(self.state_manager.get_all_channels(), self.state_manager.get_all_streams(), self.categories_db); return Response(content, mimetype="application/xml")
+        def serve_epg(): return self._serve_artifact('epg', "application/xml")
     def run_in_thread(self, host: str, port: int):
         thread = threading.Thread(target=self.app.run, kwargs={"host": host, "port": port, "debug": False, "use_reloader": False}); thread.daemon = True; thread.start()
         logger.info(f"Servidor HTTP (Flask) rodando em http://{host}:{port}")
 
+class ArtifactPublisher:
+    # *** NOVO: Publica os artefatos do WebServer (mesmos bytes/ETags) para o artifact_server.py: arquivos imutáveis + manifest.json atômico ***
+    MANIFEST_FILENAME = "manifest.json"
+    def __init__(self, web_server: WebServer, publish_dir: Path):
+        self.web_server = web_server; self.publish_dir = publish_dir; self._published: Dict[str, str] = {} # nome -> ETag no manifest atual
+        self._previous_files: Set[str] = set()
+    def publish(self, force: bool = False) -> bool:
+        """Renderiza o que mudou (cache por versão do WebServer) e troca o manifest só se algum ETag mudou."""
+        artifacts: Dict[str, Dict[str, Any]] = {}; etags: Dict[str, str] = {}; files: Set[str] = set()
+        for name, route, mimetype in self.web_server.artifact_routes():
+            entry = self.web_server._get_artifact(name); etags[name] = entry['etag']
+            body_name = f"{name}.{entry['etag'][:16]}"; gzip_name = f"{body_name}.gz"; files.update((body_name, gzip_name))
+            for file_name, content in ((body_name, entry['body']), (gzip_name, entry['gzip'])):
+                if not (self.publish_dir / file_name).exists(): atomic_write_chunks(self.publish_dir / file_name, [content])
+            artifacts[route] = {'name': name, 'mimetype': get_content_type(mimetype, 'utf-8'), 'body': body_name, 'gzip': gzip_name, 'etag': entry['etag'], 'etag_gzip': entry['etag_gzip'],
+                                'last_modified': format_http_date(entry['rendered_at']), 'size': len(entry['body']), 'gzip_size': len(entry['gzip'])}
+        manifest_path = self.publish_dir / self.MANIFEST_FILENAME
+        if not force and etags == self._published and manifest_path.exists(): return False
+        manifest = {'format': 1, 'published_at': time.time(), 'state_version': self.state_version_key(), 'artifacts': artifacts}
+        atomic_write_chunks(manifest_path, [json.dumps(manifest, indent=2).encode('utf-8')])
+        # Mantém os arquivos do manifest anterior (workers podem estar recarregando); remove o resto
+        keep = files | self._previous_files | {self.MANIFEST_FILENAME}
+        for path in self.publish_dir.iterdir():
+            if path.name not in keep and not path.name.startswith('.'):
+                try: path.unlink()
+                except OSError: pass
+        changed = [name for name, etag in etags.items() if self._published.get(name) != etag]
+        self._published = etags; self._previous_files = files
+        logger.debug(f"[Publisher] Manifest publicado em {manifest_path} (alterados: {', '.join(changed) or '-'}).")
+        return True
+    def state_version_key(self) -> List[int]: return [self.web_server.state_manager.version, self.web_server._categories_version]
+
+def format_http_date(value: datetime) -> str: return value.astimezone(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+def start_artifact_server() -> subprocess.Popen:
+    """artifact_server.py (gunicorn/waitress/stdlib) em HTTP_PORT, lendo HTTP_PUBLISH_DIRECTORY."""
+    script = SCRIPT_DIR_GET_STREAMS / "artifact_server.py"
+    cmd = [sys.executable, str(script), "--publish-dir", str(publish_directory()), "--bind", f"0.0.0.0:{HTTP_PORT}", "--workers", str(HTTP_WORKERS), "--threads", str(HTTP_THREADS)]
+    if importlib.util.find_spec("gunicorn") is None and importlib.util.find_spec("waitress") is None:
+        logger.warning("[HTTP] Nem gunicorn nem waitress instalados: artifact_server.py roda em um único processo (servidor da biblioteca padrão). "
+                       "Para vários workers: pip install gunicorn (ou apk add py3-gunicorn).")
+    process = subprocess.Popen(cmd, cwd=str(SCRIPT_DIR_GET_STREAMS), stdin=subprocess.DEVNULL)
+    logger.info(f"Servidor HTTP de artefatos (artifact_server.py, PID {process.pid}) em http://0.0.0.0:{HTTP_PORT} ({HTTP_WORKERS} worker(s) x {HTTP_THREADS} thread(s))")
+    return process
+
+def publish_directory() -> Path:
+    path = Path(HTTP_PUBLISH_DIRECTORY)
+    return path if path.is_absolute() else SCRIPT_DIR_GET_STREAMS / path
+
 class Scheduler:
-    # (Sem alterações)
+    # *** MODIFICADO: Chamadas à API rodam fora do event loop (asyncio.to_thread) ***
+    # *** MODIFICADO: Fila de prioridade (heap) com "próxima verificação" por vídeo, em vez de varrer tudo a cada 60s ***
     def __init__(self, api_scraper: APIScraper, state_manager: StateManager):
         self.api_scraper = api_scraper; self.state_manager = state_manager
         datetime_min_utc = datetime.min.replace(tzinfo=timezone.utc)
@@ -708,101 +1847,176 @@ class Scheduler:
         loaded_lmr = state_manager.meta.get('last_main_run')
         self.last_main_run = loaded_lmr if isinstance(loaded_lmr, datetime) else datetime_min_utc
         if self.last_main_run == datetime_min_utc and loaded_lmr is not None: logger.warning(f"[Scheduler Init] last_main_run ('{loaded_lmr}') inválido. Resetado.")
-        self.last_pre_event_run = datetime_min_utc; self.last_post_event_run = datetime_min_utc
-        logger.debug(f"[Scheduler Init] last_main_run={self.last_main_run}, last_full_sync={self.last_full_sync}")
+        self._check_heap: List[Tuple[datetime, str, str]] = [] # (vencimento, video_id, tipo 'priority'|'background')
+        self._next_check: Dict[str, datetime] = {} # Vencimento vigente por vídeo (entradas divergentes no heap são obsoletas)
+        self._last_attempt: Dict[str, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._main_deferred_until: Optional[datetime] = None # Reavaliação da busca principal adiada (fora do horário ativo)
+        self._due_reasons: Counter = Counter() # Composição do último lote: pre_event / post_event / stale / push
+        self._priority_stretch = 1.0 # Alongamento vigente dos intervalos pré/pós-evento (ritmo da quota), atualizado a cada volta do run
+        # *** NOVO: IDs recebidos por WebSub (thread do Flask) aguardando o próximo lote de alta frequência ***
+        self.websub: Optional[WebSubManager] = None; self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pushed_lock = threading.Lock(); self._pushed: Set[str] = set(); self._pushed_due_at: Optional[datetime] = None
+        self.reschedule(list(state_manager.streams.keys()))
+        METRICS.add_collector(self._metrics)
+        logger.debug(f"[Scheduler Init] last_main_run={self.last_main_run}, last_full_sync={self.last_full_sync}, {len(self._next_check)} vídeo(s) agendado(s)")
+    def _metrics(self):
+        yield "scheduler_queue_size", {}, len(self._next_check); yield "youtube_quota_used_today", {}, self.api_scraper.quota.used_today
     def _log_current_state(self, origin_message: str):
-        all_streams = self.state_manager.get_all_streams()
-        live_count = len([s for s in all_streams if ContentGenerator._is_live(None, s)])
-        upcoming_count = len([s for s in all_streams if s.get('status') == 'upcoming'])
-        none_count = len(all_streams) - live_count - upcoming_count
-        logger.info(f"-> Status Pós-{origin_message}: {len(all_streams)} streams | {live_count} Live | {upcoming_count} Upcoming | {none_count} VOD/Ended")
+        counts = self.state_manager.count_by_status() # *** MODIFICADO: Contadores mantidos incrementalmente pelo StateManager ***
+        logger.info(f"-> Status Pós-{origin_message}: {counts['total']} streams | {counts['live']} Live | {counts['upcoming']} Upcoming | {counts['none']} VOD/Ended")
+    def _compute_next_check(self, stream: Dict[str, Any], now_utc: datetime) -> Optional[Tuple[datetime, str]]:
+        status = stream.get('status')
+        if status not in ('live', 'upcoming'): return None
+        last = max((t for t in (stream.get('fetch_time'), self._last_attempt.get(stream.get('video_id'))) if isinstance(t, datetime)), default=now_utc)
+        stale_at = last + timedelta(hours=STALE_HOURS)
+        stretch = self._priority_stretch if self._priority_stretch != float('inf') else QUOTA_MAX_STRETCH_FACTOR # Sem quota: _pop_due adia de qualquer forma
+        if status == 'live': return min(last + timedelta(minutes=SCHEDULER_POST_EVENT_INTERVAL_MINUTES * stretch), stale_at), 'priority'
+        start = stream.get('scheduled_start_time_utc')
+        if not isinstance(start, datetime): return stale_at, 'background'
+        pre_interval = timedelta(minutes=SCHEDULER_PRE_EVENT_INTERVAL_MINUTES * stretch); window = timedelta(hours=SCHEDULER_PRE_EVENT_WINDOW_HOURS)
+        if start > now_utc:
+            # Fora da janela: acorda quando a janela abrir; dentro: a cada intervalo, mas nunca depois do horário de início
+            if start - window > now_utc: return min(start - window, stale_at), ('background' if stale_at < start - window else 'priority')
+            return min(last + pre_interval, start), 'priority'
+        # Início já passou e ainda 'upcoming' (atraso): continua no ritmo pré-evento por uma janela, depois só stale
+        if now_utc - start <= window: return max(last + pre_interval, start), 'priority'
+        return stale_at, 'background'
+    def reschedule(self, video_ids, now_utc: Optional[datetime] = None):
+        now_utc = now_utc or datetime.now(timezone.utc)
+        for vid in video_ids:
+            stream = self.state_manager.streams.get(vid); entry = self._compute_next_check(stream, now_utc) if stream else None
+            if entry is None: self._next_check.pop(vid, None); self._last_attempt.pop(vid, None); continue
+            due, kind = entry
+            if self._next_check.get(vid) == due: continue
+            self._next_check[vid] = due; heapq.heappush(self._check_heap, (due, vid, kind))
+        if self._wakeup is not None: self._wakeup.set()
+    def _pop_due(self, now_utc: datetime, priority_allowed: bool, background_allowed: bool) -> Set[str]:
+        due_ids: Set[str] = set(); deferred = []; horizon = now_utc; self._due_reasons = Counter()
+        while self._check_heap and self._check_heap[0][0] <= horizon:
+            due, vid, kind = heapq.heappop(self._check_heap)
+            if self._next_check.get(vid) != due: continue # Entrada obsoleta
+            if vid not in self.state_manager.streams: self._next_check.pop(vid, None); self._last_attempt.pop(vid, None); continue
+            if (kind == 'priority' and not priority_allowed) or (kind == 'background' and not background_allowed): deferred.append((due, vid, kind)); continue
+            due_ids.add(vid); METRICS.observe("scheduler_check_lag_seconds", max((now_utc - due).total_seconds(), 0.0))
+            self._due_reasons['stale' if kind == 'background' else ('post_event' if self.state_manager.streams[vid].get('status') == 'live' else 'pre_event')] += 1
+            # Agrupa itens que vencem logo em seguida no mesmo lote (até completar lotes de 50)
+            if horizon == now_utc: horizon = now_utc + timedelta(seconds=SCHEDULER_COALESCE_SECONDS)
+            elif len(due_ids) % 50 == 0 and self._check_heap and self._check_heap[0][0] > now_utc: break
+        retry_at = now_utc + timedelta(minutes=max(SCHEDULER_PRE_EVENT_INTERVAL_MINUTES, 1))
+        for _, vid, kind in deferred: self._next_check[vid] = retry_at; heapq.heappush(self._check_heap, (retry_at, vid, kind))
+        return due_ids
+    def enqueue_pushed(self, video_ids: Iterable[str]):
+        """Thread-safe: IDs notificados por push entram no próximo lote (após WEBSUB_BATCH_SECONDS, agrupando rajadas)."""
+        with self._pushed_lock:
+            new_ids = set(video_ids) - self._pushed
+            if not new_ids: return
+            if not self._pushed: self._pushed_due_at = datetime.now(timezone.utc) + timedelta(seconds=WEBSUB_BATCH_SECONDS)
+            self._pushed |= new_ids
+        if self._loop is not None and self._wakeup is not None: self._loop.call_soon_threadsafe(self._wakeup.set)
+    def _take_pushed(self, now_utc: datetime) -> Set[str]:
+        with self._pushed_lock:
+            if not self._pushed or (self._pushed_due_at and now_utc < self._pushed_due_at): return set()
+            pushed, self._pushed, self._pushed_due_at = self._pushed, set(), None
+            return pushed
+    def main_interval_hours(self) -> float:
+        # Com todas as inscrições WebSub ativas a busca principal só reconcilia o que o push não trouxe
+        if self.websub is not None and self.websub.all_active(self.state_manager.get_all_channels()): return max(SCHEDULER_MAIN_INTERVAL_HOURS, WEBSUB_RECONCILE_INTERVAL_HOURS)
+        return SCHEDULER_MAIN_INTERVAL_HOURS
+    def _next_wakeup(self, main_interval: Optional[timedelta], priority_allowed: bool = True) -> Optional[datetime]:
+        while self._check_heap and self._next_check.get(self._check_heap[0][1]) != self._check_heap[0][0]: heapq.heappop(self._check_heap)
+        candidates = [self._check_heap[0][0]] if self._check_heap else []
+        if self._pushed_due_at is not None:
+            # Sem quota de prioridade os IDs do push ficam retidos: acorda na virada da quota, não a cada segundo pelo lote vencido
+            candidates.append(self._pushed_due_at if priority_allowed else max(self._pushed_due_at, self.api_scraper.quota.next_reset()))
+        if main_interval is not None: candidates.append(max(self.last_main_run + main_interval, self._main_deferred_until or self.last_main_run))
+        return min(candidates) if candidates else None
+    async def _run_main_check(self, now_utc: datetime, main_interval: Optional[timedelta], background_stretch: float):
+        datetime_min_utc = datetime.min.replace(tzinfo=timezone.utc); quota = self.api_scraper.quota
+        is_active_time = True
+        if ENABLE_SCHEDULER_ACTIVE_HOURS:
+            local_hour = datetime.now(local_tz).hour
+            if not (SCHEDULER_ACTIVE_START_HOUR <= local_hour < SCHEDULER_ACTIVE_END_HOUR): is_active_time = False
+        time_for_full_sync = (now_utc - self.last_full_sync) >= timedelta(hours=FULL_SYNC_INTERVAL_HOURS)
+        if not is_active_time:
+            logger.info(f"--- [Scheduler] Verificação principal pulada (fora do horário ativo {SCHEDULER_ACTIVE_START_HOUR}-{SCHEDULER_ACTIVE_END_HOUR} {local_tz}). ---"); return False
+        phases = PhaseTimer('main'); started = time.perf_counter()
+        with PROFILER.cycle('main'):
+            all_target_channels = self.state_manager.get_all_channels()
+            logger.info(f"--- [Scheduler] Iniciando verificação principal (Intervalo: {self.main_interval_hours():g}h x{background_stretch:.2f} | Canais: {len(all_target_channels)} | Full Sync?: {time_for_full_sync}) ---")
+            quota.begin_cycle()
+            published_after = None
+            if not time_for_full_sync and self.last_main_run != datetime_min_utc:
+                published_after = self.last_main_run.isoformat(); logger.info(f"[Scheduler] Busca incremental (publishedAfter={published_after})")
+            else:
+                reason = "time_for_full_sync=True" if time_for_full_sync else "last_main_run=min"; logger.info(f"[Scheduler] Full Sync (publishedAfter=None). Reason: {reason}")
+            if all_target_channels:
+                try:
+                    fetch_method = self.api_scraper.fetch_all_streams_for_channels_using_playlists if USE_PLAYLIST_ITEMS else self.api_scraper.fetch_all_streams_for_channels
+                    with phases.span('main_fetch'): new_streams_data = await asyncio.to_thread(PROFILER.wrap(fetch_method), all_target_channels, published_after=published_after, state=self.state_manager)
+                    with phases.span('update_streams'): self.state_manager.update_streams(new_streams_data, phases)
+                    with phases.span('reschedule'): self.reschedule([s['video_id'] for s in new_streams_data if s.get('video_id')])
+                except Exception as e: logger.error(f"Erro busca principal: {e}", exc_info=True)
+            else: logger.warning("[Scheduler] Nenhum canal alvo para buscar streams.")
+            self.last_main_run = now_utc; self.state_manager.meta['last_main_run'] = self.last_main_run
+            if published_after is None: self.last_full_sync = now_utc; self.state_manager.meta['last_full_sync'] = self.last_full_sync
+            self.state_manager.mark_dirty('state')
+            quota.end_cycle("Verificação Principal"); logger.info(f"[API Cache] {self.api_scraper.response_cache.summary()}"); self._log_current_state("Verificação Principal")
+        METRICS.observe("scheduler_cycle_seconds", time.perf_counter() - started, kind='main'); phases.log()
+        return True
+    async def _run_due_checks(self, ids_to_check: Set[str]):
+        logger.info(f"--- [Scheduler] Verificação alta freq. para {len(ids_to_check)} evento(s) ---")
+        quota = self.api_scraper.quota; quota.begin_cycle(); now_utc = datetime.now(timezone.utc); started = time.perf_counter()
+        # Pré/pós-evento e stale vão no mesmo lote de videos.list (separar custaria quota); as fases registram a composição
+        phases = PhaseTimer('due'); phases.notes = [f"{reason}={count}" for reason, count in sorted(self._due_reasons.items())]
+        for reason, count in self._due_reasons.items(): METRICS.inc("scheduler_due_checks_total", count, reason=reason)
+        for vid in ids_to_check: self._last_attempt[vid] = now_utc
+        with PROFILER.cycle('due'):
+            try:
+                requested_ids_list = sorted(ids_to_check); current_channels_dict = self.state_manager.get_all_channels()
+                with phases.span('due_fetch'): updated_streams_data = await asyncio.to_thread(PROFILER.wrap(self.api_scraper.fetch_streams_by_ids), requested_ids_list, current_channels_dict)
+                if updated_streams_data:
+                    with phases.span('update_streams'): self.state_manager.update_streams(updated_streams_data, phases)
+                returned_ids = {s['video_id'] for s in updated_streams_data if 'video_id' in s}; missing_ids = ids_to_check - returned_ids
+                ids_to_mark_missing = {mid for mid in missing_ids if self.state_manager.streams.get(mid, {}).get('status') in ('live', 'upcoming')}
+                if ids_to_mark_missing:
+                    logger.warning(f"{len(ids_to_mark_missing)} IDs ativos não retornados API: {ids_to_mark_missing}. Marcando 'none'.")
+                    missing_data = [{'video_id': vid, 'status': 'none'} for vid in ids_to_mark_missing]
+                    with phases.span('mark_missing'): self.state_manager.update_streams(missing_data, phases)
+            except Exception as e: logger.error(f"Erro verificação alta freq.: {e}", exc_info=True)
+            with phases.span('reschedule'): self.reschedule(ids_to_check)
+        quota.end_cycle("Verificação Alta Frequência"); logger.debug(f"[API Cache] {self.api_scraper.response_cache.summary()}"); self._log_current_state("Verificação Alta Frequência")
+        METRICS.observe("scheduler_cycle_seconds", time.perf_counter() - started, kind='due'); phases.log()
     async def run(self, initial_run_delay: bool):
         if initial_run_delay: logger.info("[Scheduler] Aplicando delay inicial."); self.last_main_run = datetime.now(timezone.utc)
+        self._wakeup = asyncio.Event(); self._loop = asyncio.get_running_loop()
         while True:
-            now_utc = datetime.now(timezone.utc); datetime_min_utc = datetime.min.replace(tzinfo=timezone.utc)
-            time_for_main_run = (now_utc - self.last_main_run) >= timedelta(hours=SCHEDULER_MAIN_INTERVAL_HOURS)
-            is_active_time = True
-            if ENABLE_SCHEDULER_ACTIVE_HOURS:
-                local_hour = datetime.now(local_tz).hour
-                if not (SCHEDULER_ACTIVE_START_HOUR <= local_hour < SCHEDULER_ACTIVE_END_HOUR): is_active_time = False
-            time_for_full_sync = (now_utc - self.last_full_sync) >= timedelta(hours=FULL_SYNC_INTERVAL_HOURS)
-            if time_for_main_run:
-                if is_active_time:
-                    all_target_channels = self.state_manager.get_all_channels()
-                    logger.info(f"--- [Scheduler] Iniciando verificação principal (Intervalo: {SCHEDULER_MAIN_INTERVAL_HOURS}h | Canais: {len(all_target_channels)} | Full Sync?: {time_for_full_sync}) ---")
-                    published_after = None
-                    if not time_for_full_sync and self.last_main_run != datetime_min_utc:
-                        published_after = self.last_main_run.isoformat(); logger.info(f"[Scheduler] Busca incremental (publishedAfter={published_after})")
-                    else:
-                        reason = "time_for_full_sync=True" if time_for_full_sync else "last_main_run=min"; logger.info(f"[Scheduler] Full Sync (publishedAfter=None). Reason: {reason}")
-                    if all_target_channels:
-                        try:
-                            fetch_method = self.api_scraper.fetch_all_streams_for_channels_using_playlists if USE_PLAYLIST_ITEMS else self.api_scraper.fetch_all_streams_for_channels
-                            new_streams_data = fetch_method(all_target_channels, published_after=published_after)
-                            self.state_manager.update_streams(new_streams_data)
-                        except Exception as e: logger.error(f"Erro busca principal: {e}", exc_info=True)
-                    else: logger.warning("[Scheduler] Nenhum canal alvo para buscar streams.")
-                    self.last_main_run = now_utc; self.state_manager.meta['last_main_run'] = self.last_main_run
-                    if published_after is None: self.last_full_sync = now_utc; self.state_manager.meta['last_full_sync'] = self.last_full_sync
-                    self._log_current_state("Verificação Principal")
-                else: logger.info(f"--- [Scheduler] Verificação principal pulada (fora do horário ativo {SCHEDULER_ACTIVE_START_HOUR}-{SCHEDULER_ACTIVE_END_HOUR} {local_tz}). ---")
-            else:
-                 next_run_time = self.last_main_run + timedelta(hours=SCHEDULER_MAIN_INTERVAL_HOURS)
-                 logger.debug(f"--- [Scheduler] Próxima verificação principal ~{next_run_time.astimezone(local_tz).strftime('%H:%M:%S %Z')}")
-            ids_to_check: Set[str] = set(); streams_in_memory = self.state_manager.get_all_streams(); pre_event_cutoff = now_utc + timedelta(hours=SCHEDULER_PRE_EVENT_WINDOW_HOURS)
-            if (now_utc - self.last_pre_event_run) > timedelta(minutes=SCHEDULER_PRE_EVENT_INTERVAL_MINUTES):
-                pre_event_ids = {s['video_id'] for s in streams_in_memory if s.get('status') == 'upcoming' and isinstance(s.get('scheduled_start_time_utc'), datetime) and s['scheduled_start_time_utc'] < pre_event_cutoff and s['scheduled_start_time_utc'] > now_utc}
-                if pre_event_ids: logger.info(f"--- [Scheduler] {len(pre_event_ids)} na janela PRÉ-EVENTO ---"); ids_to_check.update(pre_event_ids)
-                self.last_pre_event_run = now_utc
-            if (now_utc - self.last_post_event_run) > timedelta(minutes=SCHEDULER_POST_EVENT_INTERVAL_MINUTES):
-                post_event_ids = {s['video_id'] for s in streams_in_memory if ContentGenerator._is_live(None, s)}
-                if post_event_ids: logger.info(f"--- [Scheduler] Verificando {len(post_event_ids)} 'live' (PÓS-EVENTO) ---"); ids_to_check.update(post_event_ids)
-                self.last_post_event_run = now_utc
-            stale_cutoff = now_utc - timedelta(hours=STALE_HOURS)
-            stale_ids = {s['video_id'] for s in streams_in_memory if s.get('status') in ('live', 'upcoming') and isinstance(s.get('fetch_time'), datetime) and s['fetch_time'] < stale_cutoff}
-            if stale_ids: logger.debug(f"--- [Scheduler] {len(stale_ids)} streams 'stale' precisam de verificação."); ids_to_check.update(stale_ids)
-            if ids_to_check:
-                logger.info(f"--- [Scheduler] Verificação alta freq. para {len(ids_to_check)} evento(s) ---")
-                try:
-                    requested_ids_list = list(ids_to_check); current_channels_dict = self.state_manager.get_all_channels()
-                    updated_streams_data = self.api_scraper.fetch_streams_by_ids(requested_ids_list, current_channels_dict)
-                    if updated_streams_data: self.state_manager.update_streams(updated_streams_data)
-                    returned_ids = {s['video_id'] for s in updated_streams_data if 'video_id' in s}; missing_ids = ids_to_check - returned_ids
-                    ids_to_mark_missing = {mid for mid in missing_ids if self.state_manager.streams.get(mid, {}).get('status') in ('live', 'upcoming')}
-                    if ids_to_mark_missing:
-                        logger.warning(f"{len(ids_to_mark_missing)} IDs ativos não retornados API: {ids_to_mark_missing}. Marcando 'none'.")
-                        missing_data = [{'video_id': vid, 'status': 'none'} for vid in ids_to_mark_missing]
-                        self.state_manager.update_streams(missing_data)
-                except Exception as e: logger.error(f"Erro verificação alta freq.: {e}", exc_info=True)
-                self._log_current_state("Verificação Alta Frequência")
-            elif (now_utc - self.last_pre_event_run).total_seconds() < 70 and (now_utc - self.last_post_event_run).total_seconds() < 70: logger.debug(f"--- [Scheduler] Nenhuma janela ativa. Aguardando...")
-            await asyncio.sleep(60)
-
-def save_files(state_manager: StateManager, categories_db: Dict):
-    # (Sem alterações)
-    logger.info("Iniciando rotina de salvamento de arquivos...")
-    m3u_gen, xmltv_gen = M3UGenerator(), XMLTVGenerator()
-    all_streams = state_manager.get_all_streams()
-    playlist_live = m3u_gen.generate_playlist(all_streams, categories_db, 'live')
-    playlist_upcoming = m3u_gen.generate_playlist(all_streams, categories_db, 'upcoming')
-    playlist_vod = m3u_gen.generate_playlist(all_streams, categories_db, 'vod')
-    epg = xmltv_gen.generate_xml(state_manager.get_all_channels(), all_streams, categories_db)
-    live_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_LIVE_FILENAME
-    upcoming_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_UPCOMING_FILENAME
-    vod_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_VOD_FILENAME
-    xmltv_path = Path(XMLTV_SAVE_DIRECTORY) / XMLTV_FILENAME
-    try:
-        live_path.parent.mkdir(parents=True, exist_ok=True); xmltv_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(live_path, "w", encoding="utf-8") as f: f.write(playlist_live)
-        with open(upcoming_path, "w", encoding="utf-8") as f: f.write(playlist_upcoming)
-        if KEEP_RECORDED_STREAMS and (len(playlist_vod.splitlines()) > 2 or PLACEHOLDER_VOD_ID in playlist_vod):
-             with open(vod_path, "w", encoding="utf-8") as f: f.write(playlist_vod)
-        elif not KEEP_RECORDED_STREAMS and vod_path.exists():
-             try: vod_path.unlink(); logger.info(f"Arquivo VOD {vod_path} removido.")
-             except OSError as e: logger.error(f"Erro ao remover {vod_path}: {e}")
-        with open(xmltv_path, "w", encoding="utf-8") as f: f.write(epg)
-        logger.info(f"Arquivos salvos: {live_path.name}, {upcoming_path.name}{', '+vod_path.name if KEEP_RECORDED_STREAMS else ''}, {xmltv_path.name}")
-    except IOError as e: logger.error(f"Erro ao salvar arquivos: {e}")
+            now_utc = datetime.now(timezone.utc)
+            # *** NOVO: Intervalos alongados conforme o ritmo de consumo da quota diária ***
+            quota = self.api_scraper.quota
+            background_stretch = quota.stretch_factor(priority=False); priority_stretch = quota.stretch_factor(priority=True)
+            main_interval = timedelta(hours=self.main_interval_hours() * background_stretch) if background_stretch != float('inf') else None
+            if main_interval is None: logger.debug(f"[Scheduler] Quota de fundo esgotada ({quota.used_today}/{quota.daily_budget}). Busca principal suspensa.")
+            elif background_stretch > 1: logger.debug(f"[Scheduler] Consumo acima do ritmo: intervalo principal alongado x{background_stretch:.2f} ({main_interval}).")
+            if priority_stretch != self._priority_stretch and priority_stretch != float('inf') and (priority_stretch > 1 or self._priority_stretch > 1):
+                logger.info(f"[Scheduler] Intervalos pré/pós-evento alongados x{priority_stretch:.2f} (ritmo da quota).")
+            self._priority_stretch = priority_stretch
+            if main_interval is not None and (now_utc - self.last_main_run) >= main_interval and (self._main_deferred_until is None or now_utc >= self._main_deferred_until):
+                ran = await self._run_main_check(now_utc, main_interval, background_stretch)
+                self._main_deferred_until = None if ran else now_utc + timedelta(minutes=15) # Fora do horário ativo: reavalia em 15 min
+            priority_allowed = priority_stretch != float('inf')
+            ids_to_check = self._pop_due(datetime.now(timezone.utc), priority_allowed=priority_allowed, background_allowed=main_interval is not None)
+            pushed = self._take_pushed(datetime.now(timezone.utc)) if priority_allowed else set()
+            if pushed: self._due_reasons['push'] += len(pushed - ids_to_check); ids_to_check |= pushed
+            if ids_to_check: await self._run_due_checks(ids_to_check)
+            next_wakeup = self._next_wakeup(main_interval, priority_allowed); now_utc = datetime.now(timezone.utc)
+            sleep_seconds = SCHEDULER_MAX_SLEEP_SECONDS if next_wakeup is None else min(max((next_wakeup - now_utc).total_seconds(), 1), SCHEDULER_MAX_SLEEP_SECONDS)
+            logger.debug(f"--- [Scheduler] {len(self._next_check)} vídeo(s) na fila. Próximo vencimento: {next_wakeup.astimezone(local_tz).strftime('%H:%M:%S %Z') if next_wakeup else '-'} (dormindo {sleep_seconds:.0f}s)")
+            self._wakeup.clear()
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_seconds)
+            except asyncio.TimeoutError: pass
+
+def build_texts_cache(all_streams: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
     texts_cache_data = {}; now_utc_text = datetime.now(timezone.utc); datetime_max_utc = datetime.max.replace(tzinfo=timezone.utc)
     upcoming_streams_text = [s for s in all_streams if s.get('status') == 'upcoming' and not s.get('video_id', '').startswith('PLACEHOLDER_')]
     for s in upcoming_streams_text:
@@ -822,24 +2036,276 @@ def save_files(state_manager: StateManager, categories_db: Dict):
                 text_line2 = f"{start_time_local.day} {meses[start_time_local.month - 1]} às {start_time_local.strftime('%H:%M')}"
                 texts_cache_data[video_id] = {"line1": text_line1, "line2": text_line2}
             except Exception as e: logger.warning(f"Erro ao gerar texto para {video_id}: {e}")
-    texts_cache_path = Path(state_manager.cache_path.parent) / TEXTS_CACHE_FILENAME
+    return texts_cache_data
+
+def _save_artifact(state_manager: StateManager, name: str, path: Path, render, stats: Dict[str, Any], always_render: bool = False, should_write=None, phases: Optional[PhaseTimer] = None):
+    """Renderiza (se sujo/expirado) em pedaços e grava atomicamente apenas quando o conteúdo mudou."""
+    info = state_manager.artifact_info.get(name, {})
+    if not always_render and not state_manager.needs_render(name):
+        stats['skipped_bytes'] += info.get('size', 0); stats['skipped'].append(path.name); return
+    hasher = hashlib.sha1(); size = 0; line_breaks = 0; now = datetime.now(timezone.utc)
+    # Spool: pequeno em memória, grande em arquivo temporário; o destino só é tocado se o conteúdo mudou
+    with tempfile.SpooledTemporaryFile(max_size=SAVE_SPOOL_MAX_BYTES) as spool:
+        with phase_span(phases, f"render:{name}"):
+            for chunk in render(): spool.write(chunk); hasher.update(chunk); size += len(chunk); line_breaks += chunk.count(b"\n")
+        digest = hasher.hexdigest()
+        if should_write is not None and not should_write(line_breaks + 1):
+            state_manager.clear_dirty(name); stats['skipped'].append(path.name); return
+        if digest == info.get('sha1') and path.exists():
+            info['rendered_at'] = now; state_manager.clear_dirty(name)
+            stats['skipped_bytes'] += size; stats['skipped'].append(path.name); return
+        try:
+            spool.seek(0)
+            with phase_span(phases, f"write:{name}"): atomic_write_chunks(path, iter(lambda: spool.read(OUTPUT_CHUNK_SIZE), b""))
+            state_manager.artifact_info[name] = {'sha1': digest, 'size': size, 'rendered_at': now}; state_manager.clear_dirty(name)
+            stats['written_bytes'] += size; stats['written'].append(path.name)
+        except OSError as e: logger.error(f"Erro ao salvar '{path}': {e}"); state_manager.mark_dirty(name)
+
+class ThumbnailCache:
+    # *** NOVO: Cache local endereçado por conteúdo (sha1) das thumbnails de eventos próximos, com remoção LRU ***
+    def __init__(self, cache_dir: Path, max_bytes: int = THUMBNAIL_CACHE_MAX_MB * 1024 * 1024, prescale: bool = THUMBNAIL_PRESCALE):
+        self.cache_dir = cache_dir; self.max_bytes = max_bytes; self.prescale = prescale and shutil.which("ffmpeg") is not None
+        self.index_path = cache_dir / "index.json"; self.entries: Dict[str, Dict[str, Any]] = {} # url -> {'file', 'fetched_at'}
+        self._lock = threading.Lock()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f: self.entries = {url: e for url, e in json.load(f).items() if isinstance(e, dict) and e.get('file')}
+        except (OSError, json.JSONDecodeError): self.entries = {}
+        if prescale and not self.prescale: logger.warning("[Thumbnails] THUMBNAIL_PRESCALE ativo, mas 'ffmpeg' não encontrado. Salvando imagens originais.")
+    def local_path(self, url: str) -> Optional[Path]:
+        entry = self.entries.get(url); path = self.cache_dir / entry['file'] if entry else None
+        return path if path is not None and path.exists() else None
+    def published_rows(self) -> List[Tuple[str, str]]:
+        with self._lock: return sorted((url, str(self.cache_dir / e['file'])) for url, e in self.entries.items() if (self.cache_dir / e['file']).exists())
+    @staticmethod
+    def wanted_urls(all_streams: List[Dict[str, Any]], now_utc: datetime) -> Set[str]:
+        """Thumbnails usadas pelo smart_player em breve: eventos upcoming dentro da janela de pré-evento + imagem do placeholder."""
+        window_end = now_utc + timedelta(hours=SCHEDULER_PRE_EVENT_WINDOW_HOURS); urls = {PLACEHOLDER_IMAGE_URL} if PLACEHOLDER_IMAGE_URL else set()
+        for s in all_streams:
+            start = s.get('scheduled_start_time_utc'); url = s.get('thumbnail_url')
+            if url and s.get('status') == 'upcoming' and isinstance(start, datetime) and start <= window_end: urls.add(url)
+        return urls
+    def _download(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            request_obj = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+            with urllib.request.urlopen(request_obj, timeout=15) as response: data = response.read()
+        except Exception as e: logger.warning(f"[Thumbnails] Falha ao baixar {url}: {e}"); return None
+        if not data: return None
+        digest = hashlib.sha1(data).hexdigest(); filename = f"{digest}_720p.jpg" if self.prescale else f"{digest}.jpg"; path = self.cache_dir / filename
+        if not path.exists():
+            if self.prescale:
+                # Escala uma vez aqui (o player não precisa redimensionar a cada visualização)
+                raw_path = self.cache_dir / f".{digest}.src"; atomic_write_bytes(raw_path, data)
+                try:
+                    tmp_path = self.cache_dir / f".{filename}.tmp.jpg"
+                    result = subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-i", str(raw_path), "-vf", "scale=1280:720", "-q:v", "3", str(tmp_path)], stdin=subprocess.DEVNULL, capture_output=True, timeout=30)
+                    if result.returncode == 0 and tmp_path.exists(): os.replace(tmp_path, path)
+                    else: logger.warning(f"[Thumbnails] Falha ao pré-escalar {url}. Salvando original."); filename = f"{digest}.jpg"; path = self.cache_dir / filename; atomic_write_bytes(path, data)
+                except (OSError, subprocess.TimeoutExpired) as e: logger.warning(f"[Thumbnails] Erro ao pré-escalar {url}: {e}"); filename = f"{digest}.jpg"; path = self.cache_dir / filename; atomic_write_bytes(path, data)
+                finally: raw_path.unlink(missing_ok=True)
+            else: atomic_write_bytes(path, data)
+        return {'file': filename, 'fetched_at': time.time()}
+    def _evict(self):
+        referenced = {e['file'] for e in self.entries.values()}
+        files = [(p, p.stat()) for p in self.cache_dir.glob("*.jpg")]
+        for path, _ in files:
+            if path.name not in referenced: path.unlink(missing_ok=True) # Conteúdo antigo de uma URL que mudou
+        files = sorted(((p, st) for p, st in files if p.name in referenced), key=lambda item: item[1].st_mtime); total = sum(st.st_size for _, st in files)
+        for path, st in files:
+            if total <= self.max_bytes: break
+            path.unlink(missing_ok=True); total -= st.st_size
+            for url in [u for u, e in self.entries.items() if e['file'] == path.name]: del self.entries[url]
+    def sync(self, all_streams: List[Dict[str, Any]]) -> bool:
+        """Baixa thumbnails novas/vencidas dos eventos próximos, marca as em uso (mtime) e aplica o limite de tamanho. True = mudou."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True); now = time.time(); refresh = THUMBNAIL_CACHE_REFRESH_HOURS * 3600
+        wanted = self.wanted_urls(all_streams, datetime.now(timezone.utc))
+        to_fetch = [url for url in sorted(wanted) if not self.local_path(url) or now - self.entries[url].get('fetched_at', 0) > refresh]
+        with ThreadPoolExecutor(max_workers=4) as pool: fetched = dict(zip(to_fetch, pool.map(self._download, to_fetch)))
+        with self._lock:
+            before = {url: e['file'] for url, e in self.entries.items()}
+            for url, entry in fetched.items():
+                if entry: self.entries[url] = entry
+            for url in wanted:
+                path = self.local_path(url)
+                if path:
+                    try: os.utime(path) # LRU: mtime = último ciclo em que a thumbnail foi necessária
+                    except OSError: pass
+            self._evict(); changed = before != {url: e['file'] for url, e in self.entries.items()}
+            if changed or fetched: atomic_write_bytes(self.index_path, json.dumps(self.entries, indent=2).encode('utf-8'))
+        if to_fetch: logger.info(f"[Thumbnails] {sum(1 for e in fetched.values() if e)}/{len(to_fetch)} baixada(s); {len(self.entries)} em cache.")
+        return changed
+
+class StreamURLResolver:
+    # *** NOVO: Mantém URLs diretas (HLS/mídia) já resolvidas para lives e eventos iminentes, com expiração por entrada ***
+    EXPIRE_PATTERN = re.compile(r'(?:[/?&]expire[/=])(\d{9,11})')
+    def __init__(self, db_path: Path):
+        self.db_path = db_path; self.tool = 'streamlink' if shutil.which("streamlink") else ('yt-dlp' if shutil.which("yt-dlp") else None)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS resolved_urls (video_id TEXT PRIMARY KEY, url TEXT NOT NULL, tool TEXT, resolved_at REAL NOT NULL, expires_at REAL NOT NULL)")
+        self._failed_until: Dict[str, float] = {}
+    def close(self): self._conn.close()
+    def _resolve_cmd(self, watch_url: str) -> List[str]:
+        if self.tool == 'streamlink': return ["streamlink", "--stream-url", "--config", "/dev/null", "--no-plugin-sideloading", watch_url, "best"]
+        return ["yt-dlp", "-g", "-f", "best", "--no-warnings", watch_url]
+    def resolve(self, watch_url: str) -> Optional[Tuple[str, float]]:
+        """Retorna (url_direta, expira_em_epoch) ou None."""
+        try: result = subprocess.run(self._resolve_cmd(watch_url), stdin=subprocess.DEVNULL, capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e: logger.debug(f"[StreamURL] Erro ao resolver {watch_url}: {e}"); return None
+        lines = [line.strip() for line in result.stdout.decode('utf-8', errors='ignore').splitlines() if line.strip().startswith("http")]
+        if result.returncode != 0 or not lines: return None
+        url = lines[0]; now = time.time(); match = self.EXPIRE_PATTERN.search(url)
+        expires_at = float(match.group(1)) if match else now + STREAM_URL_DEFAULT_TTL_MINUTES * 60
+        return url, min(expires_at, now + 6 * 3600)
+    def candidates(self, state_manager: StateManager) -> Dict[str, str]:
+        """video_id -> watch_url das lives e dos upcoming dentro da janela de pré-evento."""
+        now_utc = datetime.now(timezone.utc); streams = state_manager.select_streams('live', now_utc) + state_manager.upcoming_until(now_utc + timedelta(hours=SCHEDULER_PRE_EVENT_WINDOW_HOURS))
+        return {s['video_id']: s.get('watch_url') or f"https://www.youtube.com/watch?v={s['video_id']}" for s in streams if s.get('video_id')}
+    def refresh(self, candidates: Dict[str, str]) -> Dict[str, int]:
+        """Resolve entradas ausentes/perto de expirar, remove as que não são mais candidatas. Executado fora do loop de eventos."""
+        now = time.time(); margin = STREAM_URL_REFRESH_MARGIN_MINUTES * 60
+        current = {vid: expires_at for vid, expires_at in self._conn.execute("SELECT video_id, expires_at FROM resolved_urls")}
+        stale = [vid for vid in current if vid not in candidates]
+        due = [vid for vid in sorted(candidates) if current.get(vid, 0) - now < margin and self._failed_until.get(vid, 0) <= now]
+        with ThreadPoolExecutor(max_workers=4) as pool: results = dict(zip(due, pool.map(lambda vid: self.resolve(candidates[vid]), due)))
+        rows = [(vid, res[0], self.tool, now, res[1]) for vid, res in results.items() if res]
+        for vid, res in results.items():
+            if not res: self._failed_until[vid] = now + STREAM_URL_RETRY_MINUTES * 60
+            else: self._failed_until.pop(vid, None)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if rows: self._conn.executemany("INSERT OR REPLACE INTO resolved_urls VALUES (?, ?, ?, ?, ?)", rows)
+            if stale: self._conn.executemany("DELETE FROM resolved_urls WHERE video_id = ?", [(vid,) for vid in stale])
+            self._conn.execute("DELETE FROM resolved_urls WHERE expires_at < ?", (now,)); self._conn.execute("COMMIT")
+        except sqlite3.Error: self._conn.execute("ROLLBACK"); raise
+        for vid in list(self._failed_until):
+            if vid not in candidates: del self._failed_until[vid]
+        stats = {'resolved': len(rows), 'failed': len(due) - len(rows), 'removed': len(stale)}
+        if due or stale: logger.info(f"[StreamURL] Resolvidas: {stats['resolved']}, falhas: {stats['failed']}, removidas: {stats['removed']} ({len(candidates)} candidata(s)).")
+        return stats
+
+def build_player_index_rows(all_streams: List[Dict[str, Any]], texts_data: Dict[str, Dict[str, str]]) -> List[Tuple]:
+    rows = []
+    for s in all_streams:
+        vid = s.get('video_id')
+        if not vid or vid.startswith('PLACEHOLDER_'): continue
+        texts = texts_data.get(vid, {}); start = s.get('actual_start_time_utc'); end = s.get('actual_end_time_utc')
+        rows.append((vid, s.get('status'), start.isoformat() if isinstance(start, datetime) else None, end.isoformat() if isinstance(end, datetime) else None,
+                     s.get('thumbnail_url'), texts.get('line1', ''), texts.get('line2', '')))
+    rows.sort(); return rows
+
+def _save_player_index(state_manager: StateManager, path: Path, texts_data: Dict[str, Dict[str, str]], stats: Dict[str, Any], thumbnail_cache: Optional[ThumbnailCache] = None):
+    """Publica o índice do player só quando as linhas (status/tempos/thumb/textos/thumbnails locais) mudaram."""
+    rows = build_player_index_rows(state_manager.get_all_streams(), texts_data); info = state_manager.artifact_info.get('player_index', {})
+    thumbnail_rows = thumbnail_cache.published_rows() if thumbnail_cache else []
+    digest = hashlib.sha1(json.dumps([rows, thumbnail_rows], ensure_ascii=False).encode('utf-8')).hexdigest(); now = datetime.now(timezone.utc)
+    if digest == info.get('sha1') and path.exists():
+        info['rendered_at'] = now; state_manager.clear_dirty('player_index'); stats['skipped_bytes'] += info.get('size', 0); stats['skipped'].append(path.name); return
     try:
-        with open(texts_cache_path, "w", encoding="utf-8") as f: json.dump(texts_cache_data, f, indent=2)
-        logger.info(f"Cache de textos salvo em '{texts_cache_path}'.")
-    except IOError as e: logger.error(f"Erro ao salvar cache de textos: {e}")
-    state_manager.save_to_disk()
+        size = write_player_index(path, rows, thumbnail_rows)
+        state_manager.artifact_info['player_index'] = {'sha1': digest, 'size': size, 'rendered_at': now}; state_manager.clear_dirty('player_index')
+        stats['written_bytes'] += size; stats['written'].append(path.name)
+    except (OSError, sqlite3.Error) as e: logger.error(f"Erro ao salvar '{path}': {e}"); state_manager.mark_dirty('player_index')
 
-async def run_main_loops(state_manager, scheduler, categories_db, cache_loaded_initially):
-    # (Sem alterações)
+def save_files(state_manager: StateManager, categories_db: Dict, thumbnail_cache: Optional[ThumbnailCache] = None) -> Dict[str, Any]:
+    # *** MODIFICADO: Fases (render/gravação por artefato) cronometradas; perfil sob demanda via PROFILER ***
+    logger.info("Iniciando rotina de salvamento de arquivos..."); started = time.perf_counter(); phases = PhaseTimer('save')
+    with PROFILER.cycle('save'): stats = _save_all_files(state_manager, categories_db, thumbnail_cache, phases)
+    METRICS.observe("save_files_seconds", time.perf_counter() - started); METRICS.inc("save_files_written_bytes_total", stats['written_bytes']); METRICS.set("save_files_last_written_bytes", stats['written_bytes'])
+    phases.log()
+    return stats
+
+def _save_all_files(state_manager: StateManager, categories_db: Dict, thumbnail_cache: Optional[ThumbnailCache], phases: PhaseTimer) -> Dict[str, Any]:
+    # *** MODIFICADO: Só renderiza/grava artefatos sujos, com substituição atômica e estatística de bytes ***
+    m3u_gen, xmltv_gen = M3UGenerator(state_manager), XMLTVGenerator(state_manager)
+    stats: Dict[str, Any] = {'written': [], 'skipped': [], 'written_bytes': 0, 'skipped_bytes': 0}
+    live_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_LIVE_FILENAME
+    upcoming_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_UPCOMING_FILENAME
+    vod_path = Path(PLAYLIST_SAVE_DIRECTORY) / PLAYLIST_VOD_FILENAME
+    xmltv_path = Path(XMLTV_SAVE_DIRECTORY) / XMLTV_FILENAME
+    _save_artifact(state_manager, 'live', live_path, lambda: instrument_render('live', encode_chunks(m3u_gen.iter_playlist(None, categories_db, 'live'))), stats, phases=phases)
+    _save_artifact(state_manager, 'upcoming', upcoming_path, lambda: instrument_render('upcoming', encode_chunks(m3u_gen.iter_playlist(None, categories_db, 'upcoming'))), stats, phases=phases)
+    if KEEP_RECORDED_STREAMS:
+        # Só grava se houver itens além do cabeçalho (o placeholder, quando existe, já é uma linha extra)
+        _save_artifact(state_manager, 'vod', vod_path, lambda: instrument_render('vod', encode_chunks(m3u_gen.iter_playlist(None, categories_db, 'vod'))), stats, should_write=lambda line_count: line_count > 2, phases=phases)
+    elif vod_path.exists():
+         try: vod_path.unlink(); logger.info(f"Arquivo VOD {vod_path} removido.")
+         except OSError as e: logger.error(f"Erro ao remover {vod_path}: {e}")
+    _save_artifact(state_manager, 'epg', xmltv_path, lambda: instrument_render('epg', encode_chunks(xmltv_gen.iter_xml(state_manager.get_all_channels(), None, categories_db))), stats, phases=phases)
+    # Textos de contagem regressiva dependem do relógio: sempre renderiza, mas só grava se mudou
+    texts_cache_path = Path(state_manager.cache_path.parent) / TEXTS_CACHE_FILENAME
+    with phases.span('render:texts_data'): texts_data = build_texts_cache(state_manager.get_all_streams())
+    _save_artifact(state_manager, 'texts', texts_cache_path, lambda: [json.dumps(texts_data, indent=2).encode('utf-8')], stats, always_render=True, phases=phases)
+    if PLAYER_INDEX_FILENAME:
+        with phases.span('player_index'): _save_player_index(state_manager, Path(state_manager.cache_path.parent) / PLAYER_INDEX_FILENAME, texts_data, stats, thumbnail_cache)
+    if not state_manager.backend.incremental: _save_artifact(state_manager, 'state', state_manager.cache_path, state_manager.iter_serialized, stats, phases=phases)
+    elif state_manager.needs_render('state'):
+        # *** NOVO: Backend incremental grava só os streams alterados/removidos desde o último ciclo ***
+        with phases.span('write:state'): written = state_manager.save_to_disk()
+        stats['written_bytes'] += written; stats['written'].append(state_manager.backend.path.name)
+        state_manager.artifact_info['state'] = {'size': written, 'rendered_at': datetime.now(timezone.utc)}; state_manager.clear_dirty('state')
+    if stats['written']: logger.info(f"Arquivos salvos: {', '.join(stats['written'])}")
+    logger.info(f"Salvamento: {len(stats['written'])} arquivo(s) gravado(s) ({stats['written_bytes']} bytes), {len(stats['skipped'])} sem alteração ({stats['skipped_bytes']} bytes não regravados).")
+    return stats
+
+async def run_main_loops(state_manager, scheduler, categories_db, cache_loaded_initially, web_server: Optional[WebServer] = None):
+    thumbnail_cache = ThumbnailCache(Path(state_manager.cache_path.parent) / THUMBNAIL_CACHE_DIRNAME) if THUMBNAIL_CACHE_ENABLED and PLAYER_INDEX_FILENAME else None
     async def save_loop():
         while True:
-            save_files(state_manager, categories_db)
+            save_files(state_manager, categories_db, thumbnail_cache)
             sleep_interval = min(SCHEDULER_PRE_EVENT_INTERVAL_MINUTES, SCHEDULER_POST_EVENT_INTERVAL_MINUTES)
             await asyncio.sleep(max(sleep_interval, 1) * 60)
     apply_initial_delay = cache_loaded_initially and not isinstance(state_manager.meta.get('last_main_run'), datetime)
     scheduler_task = asyncio.create_task(scheduler.run(initial_run_delay=apply_initial_delay))
     save_task = asyncio.create_task(save_loop())
-    await asyncio.gather(scheduler_task, save_task)
+    async def thumbnail_loop():
+        # *** NOVO: Pré-download das thumbnails fora do loop de eventos; o índice do player é republicado quando muda ***
+        while True:
+            try:
+                if await asyncio.to_thread(thumbnail_cache.sync, state_manager.get_all_streams()): state_manager.mark_dirty('player_index')
+            except Exception as e: logger.error(f"[Thumbnails] Erro no pré-download: {e}", exc_info=True)
+            await asyncio.sleep(max(THUMBNAIL_PREFETCH_INTERVAL_MINUTES, 1) * 60)
+    stream_url_resolver = None
+    if STREAM_URL_CACHE_ENABLED:
+        stream_url_resolver = StreamURLResolver(Path(state_manager.cache_path.parent) / STREAM_URL_CACHE_FILENAME)
+        if not stream_url_resolver.tool: logger.warning("[StreamURL] 'streamlink'/'yt-dlp' não encontrados. Cache de URLs desativado."); stream_url_resolver.close(); stream_url_resolver = None
+    async def stream_url_loop():
+        # *** NOVO: Mantém URLs diretas frescas para lives/eventos iminentes (smart_player evita a resolução completa) ***
+        while True:
+            try: await asyncio.to_thread(stream_url_resolver.refresh, stream_url_resolver.candidates(state_manager))
+            except Exception as e: logger.error(f"[StreamURL] Erro ao atualizar cache de URLs: {e}", exc_info=True)
+            await asyncio.sleep(max(STREAM_URL_RESOLVE_INTERVAL_SECONDS, 10))
+    artifact_server: Optional[subprocess.Popen] = None
+    async def http_publish_loop():
+        # *** NOVO: Modo workers: publica a cada mudança de versão (checagem barata) e mantém o artifact_server.py no ar ***
+        nonlocal artifact_server
+        publisher = ArtifactPublisher(web_server, publish_directory()); started_at = 0.0
+        while True:
+            try: await asyncio.to_thread(publisher.publish)
+            except Exception as e: logger.error(f"[Publisher] Erro ao publicar artefatos: {e}", exc_info=True)
+            if artifact_server is None or (artifact_server.poll() is not None and time.monotonic() - started_at >= 5):
+                if artifact_server is not None: logger.error(f"[Publisher] artifact_server.py terminou (código {artifact_server.returncode}). Reiniciando...")
+                try: artifact_server = start_artifact_server(); started_at = time.monotonic()
+                except OSError as e: logger.error(f"[Publisher] Falha ao iniciar artifact_server.py: {e}")
+            await asyncio.sleep(max(HTTP_PUBLISH_INTERVAL_SECONDS, 0.5))
+    async def websub_loop():
+        # *** NOVO: Mantém as inscrições WebSub (novos canais, renovação de leases, cancelamentos) ***
+        while True:
+            try: await asyncio.to_thread(scheduler.websub.maintain, list(state_manager.get_all_channels().keys()))
+            except Exception as e: logger.error(f"[WebSub] Erro na manutenção das inscrições: {e}", exc_info=True)
+            await asyncio.sleep(max(WEBSUB_MAINTENANCE_INTERVAL_SECONDS, 30))
+    if hasattr(signal, 'SIGUSR1'):
+        # *** NOVO: kill -USR1 <pid> arma o perfil dos próximos PROFILE_SIGNAL_CYCLES ciclos ***
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: PROFILER.arm(PROFILE_SIGNAL_CYCLES))
+    tasks = [scheduler_task, save_task] + ([asyncio.create_task(thumbnail_loop())] if thumbnail_cache else []) + ([asyncio.create_task(stream_url_loop())] if stream_url_resolver else [])
+    if HTTP_SERVER_MODE == 'workers' and web_server is not None: tasks.append(asyncio.create_task(http_publish_loop()))
+    if scheduler.websub is not None: tasks.append(asyncio.create_task(websub_loop()))
+    try: await asyncio.gather(*tasks)
+    finally:
+        if stream_url_resolver: stream_url_resolver.close()
+        if artifact_server is not None and artifact_server.poll() is None:
+            artifact_server.terminate()
+            try: artifact_server.wait(timeout=10)
+            except subprocess.TimeoutExpired: artifact_server.kill()
 
 def log_initial_configuration():
     # *** MODIFICADO: Loga novas variáveis ***
@@ -860,8 +2326,17 @@ def log_initial_configuration():
     if ENABLE_SCHEDULER_ACTIVE_HOURS: logger.info(f"Horário de Atividade da Busca Principal: {SCHEDULER_ACTIVE_START_HOUR}:00 - {SCHEDULER_ACTIVE_END_HOUR}:00 ({local_tz})")
     else: logger.info(f"Horário de Atividade da Busca Principal: Desativado (rodando 24/7)")
     logger.info(f"Estratégia de Busca: {'playlistItems (Baixo Custo)' if USE_PLAYLIST_ITEMS else 'search (Alto Custo)'}")
-    logger.info(f"STALE_HOURS: {STALE_HOURS}h | FULL_SYNC_INTERVAL_HOURS: {FULL_SYNC_INTERVAL_HOURS}h | RESOLVE_HANDLES_TTL_HOURS: {RESOLVE_HANDLES_TTL_HOURS}h")
+    logger.info(f"STALE_HOURS: {STALE_HOURS}h | FULL_SYNC_INTERVAL_HOURS: {FULL_SYNC_INTERVAL_HOURS}h | RESOLVE_HANDLES_TTL_HOURS: {RESOLVE_HANDLES_TTL_HOURS}h | UPLOADS_PLAYLIST_TTL_HOURS: {UPLOADS_PLAYLIST_TTL_HOURS}h")
     logger.info(f"Limite de Busca Inicial: {INITIAL_SYNC_DAYS} dias (0 = ilimitado)")
+    logger.info(f"Orçamento de Quota: {YOUTUBE_DAILY_QUOTA_BUDGET} unidades/dia ({QUOTA_PRIORITY_RESERVE_PERCENT}% reservado p/ lives e eventos iminentes, alongamento máx. x{QUOTA_MAX_STRETCH_FACTOR})")
+    if HTTP_SERVER_MODE == 'workers': logger.info(f"Servidor HTTP: workers (artifact_server.py na porta {HTTP_PORT}, {HTTP_WORKERS}x{HTTP_THREADS}, publicação em {publish_directory()}) | Flask admin em {HTTP_ADMIN_HOST}:{HTTP_ADMIN_PORT}")
+    else: logger.info(f"Servidor HTTP: Flask embutido na porta {HTTP_PORT}")
+    if WEBSUB_ENABLED: logger.info(f"WebSub (push): Ativo | hub {WEBSUB_HUB_URL} | callback {WEBSUB_CALLBACK_URL or 'NÃO DEFINIDO'}/<canal> | lease {WEBSUB_LEASE_SECONDS}s (renova {WEBSUB_RENEW_MARGIN_HOURS}h antes) | reconciliação a cada {max(SCHEDULER_MAIN_INTERVAL_HOURS, WEBSUB_RECONCILE_INTERVAL_HOURS)}h com todos os canais inscritos")
+    else: logger.info("WebSub (push): Inativo (busca principal por polling)")
+    logger.info(f"Perfil sob Demanda: modo {PROFILE_MODE}, {PROFILE_SIGNAL_CYCLES} ciclo(s) por SIGUSR1, saída em {CycleProfiler.output_dir()} | /admin/profile: {'Ativo' if ADMIN_TOKEN else 'Inativo (ADMIN_TOKEN vazio)'}")
+    if YOUTUBE_API_BASE_URL: logger.warning(f"YouTube Data API redirecionada para {YOUTUBE_API_BASE_URL} (YOUTUBE_API_BASE_URL).")
+    logger.info(f"Backend do Estado: {STATE_BACKEND} ({STATE_SQLITE_FILENAME if STATE_BACKEND == 'sqlite' else STATE_CACHE_FILENAME})")
+    logger.info(f"Cache de URLs Pré-resolvidas: {'Ativo' if STREAM_URL_CACHE_ENABLED else 'Inativo'} ({STREAM_URL_CACHE_FILENAME}, a cada {STREAM_URL_RESOLVE_INTERVAL_SECONDS}s, renovação {STREAM_URL_REFRESH_MARGIN_MINUTES} min antes de expirar)")
     if FILTER_BY_CATEGORY: logger.info(f"Filtro de Categoria: ATIVADO (Permitidos: {ALLOWED_CATEGORY_IDS_STR})")
     else: logger.info("Filtro de Categoria: DESATIVADO")
     logger.info(f"URL do Placeholder: {'Definida' if PLACEHOLDER_IMAGE_URL else 'NÃO DEFINIDA'}")
@@ -873,9 +2348,11 @@ def log_initial_configuration():
 if __name__ == "__main__":
     # (Sem alterações)
     script_dir = Path(__file__).resolve().parent; cache_path = script_dir / STATE_CACHE_FILENAME
-    state, scraper = StateManager(cache_path), APIScraper(API_KEY)
+    state = StateManager(cache_path, backend=create_state_backend(script_dir)); scraper = APIScraper(API_KEY, quota=QuotaTracker(state))
     web_server = WebServer(state)
-    server_thread = threading.Thread(target=web_server.run_in_thread, args=("0.0.0.0", HTTP_PORT)); server_thread.daemon = True
+    # Modo workers: a porta pública é do artifact_server.py; o Flask (métricas/admin/depuração) vai para HTTP_ADMIN_HOST:HTTP_ADMIN_PORT
+    server_address = (HTTP_ADMIN_HOST, HTTP_ADMIN_PORT) if HTTP_SERVER_MODE == 'workers' else ("0.0.0.0", HTTP_PORT)
+    server_thread = threading.Thread(target=web_server.run_in_thread, args=server_address); server_thread.daemon = True
     categories = {}
     cache_loaded_initially = False
     try:
@@ -891,20 +2368,22 @@ if __name__ == "__main__":
         logger.info(f"Total de canais únicos a serem processados: {len(final_channels_to_process_dict)}")
 
         scheduler = Scheduler(scraper, state)
+        if WEBSUB_ENABLED:
+            if WEBSUB_CALLBACK_URL: scheduler.websub = web_server.websub = WebSubManager(state, on_videos=scheduler.enqueue_pushed)
+            else: logger.error("[WebSub] WEBSUB_ENABLED=true sem WEBSUB_CALLBACK_URL. Notificações push desativadas.")
 
         if cache_loaded_initially:
-            total_streams = len(state.get_all_streams()); upcoming_count = len([s for s in state.get_all_streams() if s.get('status') == 'upcoming'])
-            live_count = len([s for s in state.get_all_streams() if ContentGenerator._is_live(None, s)]); none_count = total_streams - upcoming_count - live_count
-            logger.info(f"[StateManager] Cache '{STATE_CACHE_FILENAME}' carregado com sucesso.")
+            counts = state.count_by_status(); total_streams, upcoming_count, live_count, none_count = counts['total'], counts['upcoming'], counts['live'], counts['none']
+            logger.info(f"[StateManager] Cache ({state.backend.describe()}) carregado com sucesso.")
             logger.info(f"-> Estado inicial: {len(state.get_all_channels())} canais | {total_streams} streams ({live_count} live, {upcoming_count} upcoming, {none_count} vod/ended)")
             logger.info(f"  -> Meta (do cache): last_main_run={state.meta.get('last_main_run')}, last_full_sync={state.meta.get('last_full_sync')}")
-        else: logger.warning(f"[StateManager] Cache '{STATE_CACHE_FILENAME}' não encontrado ou inválido.")
+        else: logger.warning(f"[StateManager] Cache ({state.backend.describe()}) não encontrado ou inválido.")
 
         log_initial_configuration() # Loga a configuração
 
         logger.info("Buscando categorias do YouTube...");
         try:
-            cats = scraper.youtube.videoCategories().list(part="snippet", regionCode="BR").execute()
+            cats = scraper._execute(scraper.youtube.videoCategories().list(part="snippet", regionCode="BR"))
             categories = {item['id']: item['snippet']['title'] for item in cats.get('items', [])}; web_server.set_categories_db(categories)
             logger.info(f"Categorias do YouTube carregadas ({len(categories)} total).")
         except Exception as e: logger.error(f"Falha ao carregar categorias: {e}")
@@ -921,17 +2400,17 @@ if __name__ == "__main__":
                     logger.info(f"[StateManager] Busca inicial limitada aos últimos {INITIAL_SYNC_DAYS} dias.")
                 else: logger.info("[StateManager] Busca síncrona completa (INITIAL_SYNC_DAYS=0).")
                 fetch_method = scraper.fetch_all_streams_for_channels_using_playlists if USE_PLAYLIST_ITEMS else scraper.fetch_all_streams_for_channels
-                all_streams = fetch_method(final_channels_to_process_dict, published_after=initial_published_after)
-                state.update_streams(all_streams)
+                all_streams = fetch_method(final_channels_to_process_dict, published_after=initial_published_after, state=state)
+                state.update_streams(all_streams); scheduler.reschedule(list(state.streams.keys()))
                 now_after_sync = datetime.now(timezone.utc)
-                state.meta['last_full_sync'] = now_after_sync; state.meta['last_main_run'] = now_after_sync
+                state.meta['last_full_sync'] = now_after_sync; state.meta['last_main_run'] = now_after_sync; state.mark_dirty('state')
                 scheduler.last_full_sync = now_after_sync; scheduler.last_main_run = now_after_sync
                 logger.info("[StateManager] Primeira busca concluída."); scheduler._log_current_state("Busca Inicial")
             else: logger.warning("[StateManager] Nenhum canal alvo definido/encontrado. Busca inicial não executada.")
 
         server_thread.start()
-        asyncio.run(run_main_loops(state_manager=state, scheduler=scheduler, categories_db=categories, cache_loaded_initially=cache_loaded_initially))
+        asyncio.run(run_main_loops(state_manager=state, scheduler=scheduler, categories_db=categories, cache_loaded_initially=cache_loaded_initially, web_server=web_server))
 
     except KeyboardInterrupt: logger.info("Programa interrompido pelo usuário.")
     except Exception as e: logger.error(f"Erro fatal: {e}", exc_info=True)
-    finally: logger.info(f"[StateManager] Salvando estado final no cache '{STATE_CACHE_FILENAME}'..."); state.save_to_disk(); logger.info("Finalizado.")
\ No newline at end of file
+    finally: logger.info(f"[StateManager] Salvando estado final ({state.backend.describe()})..."); state.save_to_disk(); state.backend.close(); logger.info("Finalizado.")
\ No newline at end of file
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+loadtest_scheduler.py — Teste de carga do Scheduler.run + APIScraper contra o fake_youtube_api.py (sem quota real).
+
+Inicia o fake (subprocesso) com N canais, aponta o get_streams.py para ele (YOUTUBE_API_BASE_URL) e executa o
+agendador real por --duration segundos, com intervalos encurtados (--main-interval-seconds/--check-interval-seconds).
+Relata, por ciclo (verificação principal / alta frequência): duração, chamadas à API e unidades de quota;
+no total: chamadas/unidades vistas pelo cliente e pelo servidor, erros, 304s e travamentos do event loop
+(atraso de um timer de --monitor-interval-ms; travamento = atraso acima de --stall-threshold-ms).
+--profile-cycles N perfila os N primeiros ciclos (cprofile ou sample; arquivos em PROFILE_OUTPUT_DIR).
+
+Uso: python loadtest_scheduler.py [--channels 1000] [--videos-per-channel 50] [--latency-ms 80] [--error-rate 0.01]
+                                  [--duration 120] [--concurrency 8] [--with-save] [--json resultado.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+def start_fake_api(args) -> "tuple[subprocess.Popen, str]":
+    cmd = [sys.executable, str(SCRIPT_DIR / "fake_youtube_api.py"), "--port", "0", "--channels", str(args.channels), "--videos-per-channel", str(args.videos_per_channel),
+           "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate), "--page-size", str(args.page_size),
+           "--quota-limit", str(args.quota_limit), "--live-ratio", str(args.live_ratio), "--upcoming-ratio", str(args.upcoming_ratio), "--seed", str(args.seed)]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    banner = process.stdout.readline().strip() # "Fake YouTube API em http://host:porta (...)"
+    if not banner.startswith("Fake YouTube API em "): process.kill(); raise RuntimeError(f"Fake API não iniciou: {banner!r}")
+    print(banner, flush=True)
+    return process, banner.split()[4]
+
+def fetch_server_stats(api_url: str, reset: bool = False) -> dict:
+    with urllib.request.urlopen(f"{api_url}/_stats{'?reset=1' if reset else ''}", timeout=10) as response: return json.loads(response.read())
+
+def summarize(values):
+    if not values: return {"count": 0}
+    ordered = sorted(values)
+    return {"count": len(ordered), "min": ordered[0], "median": statistics.median(ordered), "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], "max": ordered[-1], "total": sum(ordered)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do agendador do get_streams.py contra a API fake")
+    parser.add_argument("--channels", type=int, default=1000); parser.add_argument("--videos-per-channel", type=int, default=50)
+    parser.add_argument("--live-ratio", type=float, default=0.02); parser.add_argument("--upcoming-ratio", type=float, default=0.05)
+    parser.add_argument("--latency-ms", type=float, default=80); parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0); parser.add_argument("--page-size", type=int, default=50); parser.add_argument("--quota-limit", type=int, default=0)
+    parser.add_argument("--api-url", help="Usa um fake_youtube_api.py já em execução em vez de iniciar um")
+    parser.add_argument("--duration", type=float, default=120, help="Segundos de execução do agendador")
+    parser.add_argument("--main-interval-seconds", type=float, default=60, help="Substitui SCHEDULER_MAIN_INTERVAL_HOURS")
+    parser.add_argument("--check-interval-seconds", type=float, default=20, help="Substitui SCHEDULER_PRE/POST_EVENT_INTERVAL_MINUTES")
+    parser.add_argument("--concurrency", type=int, default=8, help="API_CONCURRENCY"); parser.add_argument("--use-search", action="store_true", help="USE_PLAYLIST_ITEMS=false (search.list, 100 unidades)")
+    parser.add_argument("--quota-budget", type=int, default=10**9, help="Orçamento diário do QuotaTracker (alto = sem alongamento de intervalos)")
+    parser.add_argument("--with-save", action="store_true", help="Executa também o loop de save_files (como em produção)"); parser.add_argument("--save-interval-seconds", type=float, default=15)
+    parser.add_argument("--monitor-interval-ms", type=float, default=10); parser.add_argument("--stall-threshold-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=1); parser.add_argument("--json", type=Path, help="Grava o relatório completo em JSON")
+    parser.add_argument("--profile-cycles", type=int, default=0); parser.add_argument("--profile-mode", choices=("cprofile", "sample"), default="cprofile")
+    args = parser.parse_args()
+
+    fake_process = None
+    if args.api_url: api_url = args.api_url.rstrip("/")
+    else: fake_process, api_url = start_fake_api(args)
+    tmp_dir = Path(tempfile.mkdtemp(prefix="loadtest_scheduler_"))
+    # Configuração do get_streams.py antes do import (o módulo lê o ambiente ao carregar)
+    os.environ.update({"YOUTUBE_API_BASE_URL": api_url, "YOUTUBE_API_KEY": "loadtest", "TARGET_CHANNEL_IDS": "UC" + "0" * 22, "TARGET_CHANNEL_HANDLES": "",
+                       "API_CONCURRENCY": str(args.concurrency), "USE_PLAYLIST_ITEMS": "false" if args.use_search else "true", "FILTER_BY_CATEGORY": "false",
+                       "PLAYLIST_SAVE_DIRECTORY": str(tmp_dir), "XMLTV_SAVE_DIRECTORY": str(tmp_dir), "STATE_BACKEND": "json",
+                       "THUMBNAIL_CACHE_ENABLED": "false", "STREAM_URL_CACHE_ENABLED": "false", "ENABLE_SCHEDULER_ACTIVE_HOURS": "false"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, str(SCRIPT_DIR))
+    import get_streams as g
+    g.SCHEDULER_MAIN_INTERVAL_HOURS = args.main_interval_seconds / 3600
+    g.SCHEDULER_PRE_EVENT_INTERVAL_MINUTES = g.SCHEDULER_POST_EVENT_INTERVAL_MINUTES = args.check_interval_seconds / 60
+
+    class CountingQuotaTracker(g.QuotaTracker):
+        def __init__(self, *a, **kw): super().__init__(*a, **kw); self.calls = defaultdict(int)
+        def record(self, endpoint, units=None): self.calls[endpoint] += 1; super().record(endpoint, units)
+
+    cycles = []
+    class InstrumentedScheduler(g.Scheduler):
+        async def _measure(self, kind, coroutine, size):
+            quota = self.api_scraper.quota; calls_before = sum(quota.calls.values()); units_before = quota.used_today; started = time.perf_counter()
+            result = await coroutine
+            if result is False: return result # Verificação principal pulada (fora do horário ativo)
+            cycles.append({"kind": kind, "at": round(time.perf_counter() - run_started, 3), "seconds": time.perf_counter() - started, "size": size,
+                           "calls": sum(quota.calls.values()) - calls_before, "units": quota.used_today - units_before, "streams": len(self.state_manager.streams)})
+            print(f"  [{cycles[-1]['at']:>7.1f}s] {kind:<5} {cycles[-1]['seconds']:>7.2f}s | {cycles[-1]['calls']:>5} chamadas | {cycles[-1]['units']:>6} unidades | {size:>5} itens | {cycles[-1]['streams']} streams", flush=True)
+            return result
+        async def _run_main_check(self, now_utc, main_interval, background_stretch):
+            return await self._measure("main", super()._run_main_check(now_utc, main_interval, background_stretch), len(self.state_manager.get_all_channels()))
+        async def _run_due_checks(self, ids_to_check):
+            return await self._measure("due", super()._run_due_checks(ids_to_check), len(ids_to_check))
+
+    state = g.StateManager(tmp_dir / "state_cache.json"); quota = CountingQuotaTracker(state, daily_budget=args.quota_budget)
+    scraper = g.APIScraper("loadtest", quota)
+    if fake_process is None: fetch_server_stats(api_url, reset=True)
+    started = time.perf_counter()
+    channel_ids = {f"UC{c:022d}" for c in range(args.channels)}; channels = scraper.ensure_channel_titles(channel_ids, state)
+    categories = {item["id"]: item["snippet"]["title"] for item in scraper._execute(scraper.youtube.videoCategories().list(part="snippet", regionCode="BR")).get("items", [])}
+    bootstrap_seconds = time.perf_counter() - started
+    print(f"Bootstrap: {len(channels)} canais com título, {len(categories)} categorias em {bootstrap_seconds:.2f}s. Executando agendador por {args.duration:.0f}s...", flush=True)
+    scheduler = InstrumentedScheduler(scraper, state); lags = []
+    if args.profile_cycles: g.PROFILER.arm(args.profile_cycles, args.profile_mode)
+
+    async def monitor_event_loop():
+        interval = args.monitor_interval_ms / 1000; loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval; await asyncio.sleep(interval); lags.append(max(0.0, loop.time() - expected) * 1000)
+    async def save_loop():
+        while True: g.save_files(state, categories); await asyncio.sleep(args.save_interval_seconds)
+    async def run_for_duration():
+        tasks = [asyncio.create_task(scheduler.run(initial_run_delay=False)), asyncio.create_task(monitor_event_loop())] + ([asyncio.create_task(save_loop())] if args.with_save else [])
+        await asyncio.sleep(args.duration)
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    run_started = time.perf_counter()
+    try: asyncio.run(run_for_duration())
+    finally:
+        scraper._executor.shutdown(wait=True, cancel_futures=True)
+        server_stats = fetch_server_stats(api_url)
+        if fake_process is not None: fake_process.terminate(); fake_process.wait(timeout=10)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    stalls = [lag for lag in lags if lag > args.stall_threshold_ms]
+    report = {"config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()}, "bootstrap_seconds": bootstrap_seconds,
+              "cycles": cycles, "main_cycles": summarize([c["seconds"] for c in cycles if c["kind"] == "main"]), "due_cycles": summarize([c["seconds"] for c in cycles if c["kind"] == "due"]),
+              "client_calls": dict(quota.calls), "client_units": quota.used_today, "server": server_stats,
+              "event_loop": {"samples": len(lags), "lag_ms": summarize(lags), "stalls": len(stalls), "stalled_ms": sum(stalls), "threshold_ms": args.stall_threshold_ms},
+              "final_state": state.count_by_status()}
+
+    print("\n=== Resultado ===")
+    for kind, label in (("main_cycles", "Verificação principal"), ("due_cycles", "Alta frequência")):
+        s = report[kind]
+        if s["count"]: print(f"{label:<24} {s['count']:>4} ciclo(s) | duração mediana {s['median']:.2f}s, p95 {s['p95']:.2f}s, máx {s['max']:.2f}s")
+        else: print(f"{label:<24}    0 ciclo(s)")
+    print(f"Chamadas (cliente): {sum(quota.calls.values())} ({', '.join(f'{k}={v}' for k, v in sorted(quota.calls.items()))}) | Unidades: {quota.used_today}")
+    print(f"Servidor: {server_stats['total_calls']} chamadas, {server_stats['units']} unidades, {server_stats['errors']} erros 5xx, {server_stats['not_modified']} respostas 304, {server_stats['quota_exceeded']} quotaExceeded")
+    lag = report["event_loop"]["lag_ms"]
+    if lag["count"]: print(f"Event loop: atraso mediano {lag['median']:.1f} ms, p95 {lag['p95']:.1f} ms, máx {lag['max']:.1f} ms | {len(stalls)} travamento(s) > {args.stall_threshold_ms:.0f} ms somando {sum(stalls):.0f} ms")
+    final = report["final_state"]; print(f"Estado final: {final['total']} streams ({final['live']} live, {final['upcoming']} upcoming, {final['none']} vod/ended)")
+    if args.json: args.json.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8"); print(f"Relatório salvo em {args.json}")
+
+if __name__ == "__main__":
+    main()
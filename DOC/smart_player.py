@@ -4,15 +4,26 @@ uv pip install python-dotenv
 
 #!/usr/bin/env python3
 import argparse
+import fcntl
+import hashlib
+import queue
+import socket
 import subprocess
 import sys
 import json
 import re
+import selectors
+import signal
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 import os
 import logging
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv # Importa load_dotenv
 
 # --- Constantes e Caminhos ---
@@ -62,6 +73,38 @@ logger.info(f"--- Nova execução. Nível: {SMART_PLAYER_LOG_LEVEL_STR}. Logando
 
 
 PLACEHOLDER_IMAGE_URL = os.getenv("PLACEHOLDER_IMAGE_URL", "") # Lê do .env já carregado
+# *** NOVO: Mesmo backend de estado do get_streams.py (json ou sqlite) ***
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json").strip().lower()
+STATE_SQLITE_PATH = SCRIPT_DIR / os.getenv("STATE_SQLITE_FILENAME", "state_cache.db")
+# *** NOVO: Índice por video_id publicado pelo get_streams.py (consulta pontual em vez de json.load do cache inteiro) ***
+PLAYER_INDEX_FILENAME = os.getenv("PLAYER_INDEX_FILENAME", "player_index.db").strip()
+PLAYER_INDEX_PATH = SCRIPT_DIR / PLAYER_INDEX_FILENAME if PLAYER_INDEX_FILENAME else None
+PLAYER_INDEX_COLUMNS = ('video_id', 'status', 'actual_start_time_utc', 'actual_end_time_utc', 'thumbnail_url', 'line1', 'line2')
+_player_index_lookups: Dict[str, Optional[Dict[str, Any]]] = {}
+_player_index_identity: Optional[Tuple[int, int]] = None
+# *** NOVO: Relay — um único processo upstream por vídeo/placeholder compartilhado entre clientes simultâneos ***
+SMART_PLAYER_RELAY = os.getenv("SMART_PLAYER_RELAY", "false").lower() == "true"
+SMART_PLAYER_RELAY_DIR = os.getenv("SMART_PLAYER_RELAY_DIR", "/tmp/smart_player_relay")
+SMART_PLAYER_RELAY_GRACE_SECONDS = float(os.getenv("SMART_PLAYER_RELAY_GRACE_SECONDS", "15"))
+SMART_PLAYER_RELAY_CLIENT_BUFFER_BYTES = int(os.getenv("SMART_PLAYER_RELAY_CLIENT_BUFFER_BYTES", str(8 * 1024 * 1024)))
+SMART_PLAYER_RELAY_CONNECT_TIMEOUT = float(os.getenv("SMART_PLAYER_RELAY_CONNECT_TIMEOUT", "10"))
+# *** NOVO: Cache de loops MPEG-TS pré-codificados para placeholder/upcoming (imagem + textos) ***
+SMART_PLAYER_PLACEHOLDER_CACHE = os.getenv("SMART_PLAYER_PLACEHOLDER_CACHE", "true").lower() == "true"
+SMART_PLAYER_PLACEHOLDER_CACHE_DIR = Path(os.getenv("SMART_PLAYER_PLACEHOLDER_CACHE_DIR", str(SCRIPT_DIR / "placeholder_cache")))
+SMART_PLAYER_PLACEHOLDER_CACHE_MAX_MB = int(os.getenv("SMART_PLAYER_PLACEHOLDER_CACHE_MAX_MB", "500"))
+SMART_PLAYER_PLACEHOLDER_CACHE_MAX_AGE_HOURS = float(os.getenv("SMART_PLAYER_PLACEHOLDER_CACHE_MAX_AGE_HOURS", "24"))
+SMART_PLAYER_PLACEHOLDER_LOOP_SECONDS = int(os.getenv("SMART_PLAYER_PLACEHOLDER_LOOP_SECONDS", "10"))
+# *** NOVO: Supervisor do upstream (detecção de travamento, reinício rápido e failover streamlink -> yt-dlp -> placeholder) ***
+SMART_PLAYER_STARTUP_TIMEOUT = float(os.getenv("SMART_PLAYER_STARTUP_TIMEOUT", "20")) # Segundos até o primeiro byte
+SMART_PLAYER_STALL_TIMEOUT = float(os.getenv("SMART_PLAYER_STALL_TIMEOUT", "8")) # Segundos sem saída = travado
+SMART_PLAYER_RESTART_DELAY_MS = int(os.getenv("SMART_PLAYER_RESTART_DELAY_MS", "250"))
+SMART_PLAYER_MAX_RESTARTS = int(os.getenv("SMART_PLAYER_MAX_RESTARTS", "2")) # Reinícios do mesmo estágio antes do failover
+SMART_PLAYER_STDERR_RING_LINES = int(os.getenv("SMART_PLAYER_STDERR_RING_LINES", "50"))
+# *** NOVO: URLs diretas pré-resolvidas pelo get_streams.py (lives): remux com ffmpeg em vez da resolução completa ***
+STREAM_URL_CACHE_PATH = SCRIPT_DIR / os.getenv("STREAM_URL_CACHE_FILENAME", "stream_urls.db")
+STREAM_URL_MIN_REMAINING_SECONDS = int(os.getenv("STREAM_URL_MIN_REMAINING_SECONDS", "60"))
+# *** NOVO: Modo daemon (processo persistente atendendo o smart_player_client.py por socket Unix) ***
+SMART_PLAYER_DAEMON_SOCKET = os.getenv("SMART_PLAYER_DAEMON_SOCKET", "/tmp/smart_player.sock")
 DEFAULT_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
 
 # --- Funções Auxiliares ---
@@ -74,18 +117,95 @@ def escape_ffmpeg_text(text: str) -> str:
     text = text.replace(",", r"\,")
     return text
 
+def _parse_stream_times(stream_info: Dict[str, Any]) -> Dict[str, Any]:
+    for key in ('scheduled_start_time_utc', 'actual_start_time_utc', 'actual_end_time_utc', 'fetch_time', 'last_seen'):
+         if key in stream_info and isinstance(stream_info[key], str):
+             try: stream_info[key] = datetime.fromisoformat(stream_info[key].replace('Z', '+00:00'))
+             except (ValueError, TypeError): stream_info[key] = None
+         elif key in stream_info and not isinstance(stream_info[key], datetime): stream_info[key] = None
+    return stream_info
+
+# *** NOVO: Handles reaproveitados entre requisições (modo daemon); reabertos/relidos quando o arquivo é substituído ***
+def _file_identity(path: Path) -> Optional[Tuple[int, int]]:
+    try: st = path.stat(); return st.st_ino, st.st_mtime_ns
+    except OSError: return None
+
+class ReadOnlyDB:
+    """Conexão SQLite somente leitura mantida aberta; reaberta quando o arquivo é trocado (os.replace muda o inode)."""
+    def __init__(self): self.conn: Optional[sqlite3.Connection] = None; self.key: Optional[Tuple[str, int]] = None; self.lock = threading.Lock()
+    def fetchone(self, path: Path, sql: str, params: tuple = ()) -> Optional[tuple]:
+        identity = _file_identity(path)
+        if identity is None: raise sqlite3.OperationalError(f"arquivo não encontrado: {path}")
+        with self.lock:
+            if self.conn is None or self.key != (str(path), identity[0]):
+                if self.conn is not None: self.conn.close()
+                self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5, check_same_thread=False); self.key = (str(path), identity[0])
+            return self.conn.execute(sql, params).fetchone()
+
+_player_index_db = ReadOnlyDB(); _stream_url_db = ReadOnlyDB(); _state_sqlite_db = ReadOnlyDB()
+_json_cache: Dict[str, Tuple[Tuple[int, int], Any]] = {}; _json_cache_lock = threading.Lock()
+
+def load_json_cached(path: Path) -> Any:
+    """json.load memorizado por (inode, mtime): no daemon, o arquivo só é relido quando o get_streams.py o republica."""
+    identity = _file_identity(path)
+    with _json_cache_lock:
+        cached = _json_cache.get(str(path))
+        if cached and cached[0] == identity: return cached[1]
+    with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+    with _json_cache_lock: _json_cache[str(path)] = (identity, data)
+    return data
+
+def lookup_player_index(video_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """Retorna (índice_disponível, entrada). Índice ausente/ilegível => (False, None) e o chamador usa os caches JSON."""
+    global _player_index_identity
+    if not PLAYER_INDEX_PATH: return False, None
+    identity = _file_identity(PLAYER_INDEX_PATH)
+    if identity is None: return False, None
+    if identity != _player_index_identity: _player_index_lookups.clear(); _player_index_identity = identity # Índice republicado
+    if video_id in _player_index_lookups: return True, _player_index_lookups[video_id]
+    try: row = _player_index_db.fetchone(PLAYER_INDEX_PATH, f"SELECT {', '.join(PLAYER_INDEX_COLUMNS)} FROM player_index WHERE video_id = ?", (video_id,))
+    except sqlite3.Error as e: logger.warning(f"Índice do player indisponível ({PLAYER_INDEX_PATH}): {e}. Usando caches JSON."); return False, None
+    entry = dict(zip(PLAYER_INDEX_COLUMNS, row)) if row else None
+    _player_index_lookups[video_id] = entry
+    return True, entry
+
+def local_image_for(image_url: str) -> str:
+    """*** NOVO: Thumbnail pré-baixada pelo get_streams.py (tabela 'thumbnails' do índice); URL remota só em caso de falta. ***"""
+    if not image_url or not PLAYER_INDEX_PATH or not PLAYER_INDEX_PATH.exists(): return image_url
+    try: row = _player_index_db.fetchone(PLAYER_INDEX_PATH, "SELECT path FROM thumbnails WHERE url = ?", (image_url,))
+    except sqlite3.Error as e: logger.debug(f"Tabela de thumbnails indisponível: {e}"); return image_url
+    if row and Path(row[0]).is_file(): logger.info(f"Usando thumbnail local: {row[0]}"); return row[0]
+    logger.debug(f"Thumbnail sem cópia local: {image_url}"); return image_url
+
+def get_resolved_stream_url(video_id: str) -> Optional[str]:
+    """URL direta ainda válida (com folga STREAM_URL_MIN_REMAINING_SECONDS) ou None."""
+    if not STREAM_URL_CACHE_PATH.exists(): return None
+    try: row = _stream_url_db.fetchone(STREAM_URL_CACHE_PATH, "SELECT url, expires_at FROM resolved_urls WHERE video_id = ?", (video_id,))
+    except sqlite3.Error as e: logger.debug(f"Cache de URLs indisponível: {e}"); return None
+    if not row: return None
+    if row[1] - time.time() < STREAM_URL_MIN_REMAINING_SECONDS: logger.info(f"URL pré-resolvida de {video_id} expirada/perto de expirar."); return None
+    return row[0]
+
+def get_stream_status_from_sqlite(video_id: str) -> Optional[Dict[str, Any]]:
+    # *** NOVO: Consulta pontual por video_id no banco SQLite (somente leitura) ***
+    try:
+        row = _state_sqlite_db.fetchone(STATE_SQLITE_PATH, "SELECT data FROM streams WHERE video_id = ?", (video_id,))
+        if row: return _parse_stream_times(json.loads(row[0]))
+        logger.debug(f"Video ID {video_id} não encontrado em {STATE_SQLITE_PATH}.")
+    except (sqlite3.Error, json.JSONDecodeError) as e: logger.error(f"Erro ao ler {STATE_SQLITE_PATH} para {video_id}: {e}")
+    return None
+
 def get_stream_status_from_cache(video_id: str) -> Optional[Dict[str, Any]]:
+    indexed, entry = lookup_player_index(video_id)
+    if indexed:
+        if entry: return _parse_stream_times(entry)
+        logger.debug(f"Video ID {video_id} não encontrado em {PLAYER_INDEX_PATH}."); return None
+    if STATE_BACKEND == 'sqlite' and STATE_SQLITE_PATH.exists(): return get_stream_status_from_sqlite(video_id)
     try:
         if STATE_CACHE_PATH.exists():
-            with open(STATE_CACHE_PATH, "r", encoding="utf-8") as f: cache_data = json.load(f)
+            cache_data = load_json_cached(STATE_CACHE_PATH)
             stream_info = cache_data.get("streams", {}).get(video_id)
-            if stream_info:
-                for key in ('scheduled_start_time_utc', 'actual_start_time_utc', 'actual_end_time_utc', 'fetch_time', 'last_seen'):
-                     if key in stream_info and isinstance(stream_info[key], str):
-                         try: stream_info[key] = datetime.fromisoformat(stream_info[key].replace('Z', '+00:00'))
-                         except (ValueError, TypeError): stream_info[key] = None
-                     elif key in stream_info and not isinstance(stream_info[key], datetime): stream_info[key] = None
-                return stream_info
+            if stream_info: return _parse_stream_times(dict(stream_info))
             else: logger.debug(f"Video ID {video_id} não encontrado no cache.")
         else: logger.warning(f"Arquivo state_cache.json não encontrado em {STATE_CACHE_PATH}")
     except json.JSONDecodeError as e: logger.error(f"Erro ao decodificar JSON de {STATE_CACHE_PATH}: {e}")
@@ -94,9 +214,13 @@ def get_stream_status_from_cache(video_id: str) -> Optional[Dict[str, Any]]:
 
 def get_texts_from_cache(video_id: str) -> Dict[str, str]:
     texts = {"line1": "", "line2": ""}
+    indexed, entry = lookup_player_index(video_id)
+    if indexed:
+        if entry: texts["line1"] = entry.get("line1") or ""; texts["line2"] = entry.get("line2") or ""
+        return texts
     try:
         if TEXTS_CACHE_PATH.exists():
-            with open(TEXTS_CACHE_PATH, "r", encoding="utf-8") as f: all_texts = json.load(f)
+            all_texts = load_json_cached(TEXTS_CACHE_PATH)
             stream_texts = all_texts.get(video_id)
             if stream_texts: texts["line1"] = stream_texts.get("line1", ""); texts["line2"] = stream_texts.get("line2", "")
             else: logger.debug(f"Video ID {video_id} não encontrado em {TEXTS_CACHE_PATH}")
@@ -105,9 +229,8 @@ def get_texts_from_cache(video_id: str) -> Dict[str, str]:
     except Exception as e: logger.warning(f"Não foi possível obter textos de {TEXTS_CACHE_PATH} para {video_id}: {e}")
     return texts
 
-def run_ffmpeg_placeholder(image_url: str, text_line1: str = "", text_line2: str = "", font_path: str = DEFAULT_FONT_PATH, user_agent: str = "Mozilla/5.0"):
-    if not image_url: logger.error("URL da imagem para FFmpeg vazia."); return
-    logger.info(f"Iniciando FFmpeg para placeholder/upcoming: {image_url}")
+# *** MODIFICADO: Comandos separados da execução (build_*_cmd) para permitir relay/compartilhamento ***
+def build_ffmpeg_placeholder_cmd(image_url: str, text_line1: str = "", text_line2: str = "", font_path: str = DEFAULT_FONT_PATH, user_agent: str = "Mozilla/5.0") -> List[str]:
     drawtext_filters = []
     font_file_path = Path(font_path); use_font = font_file_path.is_file()
     if not use_font: logger.warning(f"Arquivo de fonte não encontrado: {font_path}.")
@@ -115,22 +238,27 @@ def run_ffmpeg_placeholder(image_url: str, text_line1: str = "", text_line2: str
         if text_line1: escaped_text1 = escape_ffmpeg_text(text_line1); drawtext_filters.append(f"drawtext=fontfile='{font_path}':text='{escaped_text1}':x=(w-text_w)/2:y=h-100:fontsize=48:fontcolor=white:borderw=2:bordercolor=black@0.8")
         if text_line2: escaped_text2 = escape_ffmpeg_text(text_line2); drawtext_filters.append(f"drawtext=fontfile='{font_path}':text='{escaped_text2}':x=(w-text_w)/2:y=h-50:fontsize=36:fontcolor=white:borderw=2:bordercolor=black@0.8")
     filter_chain = ",".join(drawtext_filters) if drawtext_filters else ""
-    ffmpeg_cmd = ["ffmpeg", "-loglevel", "error", "-re", "-user_agent", user_agent, "-i", image_url, "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo", "-filter_complex", f"[0:v]fps=25,scale=1280:720,loop=-1:1:0{',' if filter_chain else ''}{filter_chain}[v]", "-map", "[v]", "-map", "1:a", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-shortest", "-tune", "stillimage", "-f", "mpegts", "pipe:1"]
-    logger.debug(f"Comando FFmpeg: {' '.join(ffmpeg_cmd)}")
-    try:
-        process = subprocess.Popen(ffmpeg_cmd, stdout=sys.stdout, stderr=subprocess.PIPE)
-        _, stderr_output = process.communicate()
-        if process.returncode != 0:
-            logger.error(f"FFmpeg falhou com código {process.returncode}")
-            if stderr_output: logger.error(f"FFmpeg stderr:\n{stderr_output.decode('utf-8', errors='ignore')}")
-    except FileNotFoundError: logger.error("Erro: Comando 'ffmpeg' não encontrado.")
-    except Exception as e: logger.error(f"Erro ao executar FFmpeg: {e}")
+    input_args = ["-user_agent", user_agent, "-i", image_url] if "://" in image_url else ["-i", image_url] # -user_agent só vale para entrada HTTP
+    return ["ffmpeg", "-loglevel", "error", "-re", *input_args, "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo", "-filter_complex", f"[0:v]fps=25,scale=1280:720,loop=-1:1:0{',' if filter_chain else ''}{filter_chain}[v]", "-map", "[v]", "-map", "1:a", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-shortest", "-tune", "stillimage", "-f", "mpegts", "pipe:1"]
 
-def run_streamlink(watch_url: str, user_agent: str = "Mozilla/5.0"):
-    """Executa o Streamlink para streams ao vivo."""
-    logger.info(f"Iniciando Streamlink para live: {watch_url}")
+def build_placeholder_render_cmd(image_url: str, output_path: str, text_line1: str = "", text_line2: str = "", font_path: str = DEFAULT_FONT_PATH, user_agent: str = "Mozilla/5.0") -> List[str]:
+    """Codifica uma única vez um trecho curto (SMART_PLAYER_PLACEHOLDER_LOOP_SECONDS) da imagem com os textos."""
+    live_cmd = build_ffmpeg_placeholder_cmd(image_url, text_line1, text_line2, font_path, user_agent)
+    filter_complex = live_cmd[live_cmd.index("-filter_complex") + 1]
+    input_args = ["-user_agent", user_agent, "-i", image_url] if "://" in image_url else ["-i", image_url]
+    return ["ffmpeg", "-loglevel", "error", "-y", *input_args, "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo", "-filter_complex", filter_complex, "-map", "[v]", "-map", "1:a", "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage", "-pix_fmt", "yuv420p", "-g", "50", "-c:a", "aac", "-b:a", "128k", "-t", str(SMART_PLAYER_PLACEHOLDER_LOOP_SECONDS), "-f", "mpegts", output_path]
+
+def build_loop_playback_cmd(loop_path: Path) -> List[str]:
+    """Repete o trecho pré-codificado indefinidamente, sem recodificar (-c copy)."""
+    return ["ffmpeg", "-loglevel", "error", "-re", "-stream_loop", "-1", "-i", str(loop_path), "-c", "copy", "-f", "mpegts", "pipe:1"]
+
+def build_remux_cmd(media_url: str, user_agent: str = "Mozilla/5.0") -> List[str]:
+    """Remux (sem recodificar) de uma URL HLS/mídia já resolvida para MPEG-TS."""
+    return ["ffmpeg", "-loglevel", "error", "-user_agent", user_agent, "-i", media_url, "-map", "0", "-c", "copy", "-f", "mpegts", "pipe:1"]
+
+def build_streamlink_cmd(watch_url: str, user_agent: str = "Mozilla/5.0") -> List[str]:
     # *** CORRIGIDO: Adiciona --no-plugin-sideloading ***
-    streamlink_cmd = [
+    return [
         "streamlink",
         "--stdout",
         "--http-header", f"User-Agent={user_agent}",
@@ -139,60 +267,364 @@ def run_streamlink(watch_url: str, user_agent: str = "Mozilla/5.0"):
         watch_url,
         "best"
     ]
-    logger.debug(f"Comando Streamlink: {' '.join(streamlink_cmd)}")
+
+def build_ytdlp_cmd(watch_url: str, user_agent: str = "Mozilla/5.0") -> List[str]:
+    return ["yt-dlp", "-f", "best", "-o", "-", "--user-agent", user_agent, watch_url]
+
+PLACEHOLDER_RENDER_TIMEOUT = 120
+
+def _unlink_placeholder(path: Path):
+    path.unlink(); path.with_suffix(".lock").unlink(missing_ok=True) # O lock da chave vai junto com o loop
+
+def _evict_placeholder_cache():
+    """Remove loops mais antigos que o limite de idade e, depois, os menos usados (mtime) até caber no limite de tamanho."""
+    try: entries = [(p, p.stat()) for p in SMART_PLAYER_PLACEHOLDER_CACHE_DIR.glob("*.ts")]; temps = [(p, p.stat()) for p in SMART_PLAYER_PLACEHOLDER_CACHE_DIR.glob("*.tmp")]
+    except OSError: return
+    now = time.time(); max_age = SMART_PLAYER_PLACEHOLDER_CACHE_MAX_AGE_HOURS * 3600; remaining = []
+    for path, st in temps: # Sobras de renderizações interrompidas (cada processo usa o próprio .tmp)
+        if now - st.st_mtime > 2 * PLACEHOLDER_RENDER_TIMEOUT:
+            try: path.unlink()
+            except OSError: pass
+    for path, st in entries:
+        if now - st.st_mtime > max_age:
+            try: _unlink_placeholder(path); logger.debug(f"[Placeholder Cache] Removido (idade): {path.name}")
+            except OSError: pass
+        else: remaining.append((path, st))
+    total = sum(st.st_size for _, st in remaining); limit = SMART_PLAYER_PLACEHOLDER_CACHE_MAX_MB * 1024 * 1024
+    for path, st in sorted(remaining, key=lambda item: item[1].st_mtime):
+        if total <= limit: break
+        try: _unlink_placeholder(path); total -= st.st_size; logger.debug(f"[Placeholder Cache] Removido (tamanho): {path.name}")
+        except OSError: pass
+
+def _cached_placeholder(loop_path: Path) -> Optional[Path]:
     try:
-        process = subprocess.Popen(streamlink_cmd, stdout=sys.stdout, stderr=subprocess.PIPE)
-        _, stderr_output = process.communicate()
-        # (Restante como antes...)
-        if process.returncode != 0:
-            if process.returncode == 1 and stderr_output and "error: No playable streams found" in stderr_output.decode('utf-8', errors='ignore'):
-                 logger.warning(f"Streamlink: Nenhum stream jogável encontrado para {watch_url}.")
-            else:
-                 logger.error(f"Streamlink falhou com código {process.returncode}")
-                 if stderr_output: logger.error(f"Streamlink stderr:\n{stderr_output.decode('utf-8', errors='ignore')}")
-    except FileNotFoundError: logger.error("Erro: Comando 'streamlink' não encontrado.")
-    except Exception as e: logger.error(f"Erro ao executar Streamlink: {e}")
+        if loop_path.stat().st_size > 0: os.utime(loop_path); logger.info(f"[Placeholder Cache] Reutilizando loop {loop_path.name}"); return loop_path
+    except OSError: pass
+    return None
+
+def get_placeholder_loop(image_url: str, text_line1: str = "", text_line2: str = "", font_path: str = DEFAULT_FONT_PATH, user_agent: str = "Mozilla/5.0") -> Optional[Path]:
+    """Retorna o loop pré-codificado para (imagem, linha1, linha2), renderizando-o se ainda não existir. None = renderizar ao vivo."""
+    key = hashlib.sha1("\x1f".join((image_url, text_line1, text_line2, font_path)).encode("utf-8")).hexdigest()
+    SMART_PLAYER_PLACEHOLDER_CACHE_DIR.mkdir(parents=True, exist_ok=True); loop_path = SMART_PLAYER_PLACEHOLDER_CACHE_DIR / f"{key}.ts"
+    cached = _cached_placeholder(loop_path) # Loop pronto: sem lock, não espera renderizações de outros conteúdos
+    if cached is not None: return cached
+    with open(SMART_PLAYER_PLACEHOLDER_CACHE_DIR / f"{key}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # Lock por chave: só clientes do mesmo conteúdo esperam a mesma renderização
+        cached = _cached_placeholder(loop_path)
+        if cached is not None: return cached
+        _evict_placeholder_cache()
+        tmp_path = SMART_PLAYER_PLACEHOLDER_CACHE_DIR / f"{key}.{os.getpid()}.tmp"; started = time.monotonic()
+        try:
+            result = subprocess.run(build_placeholder_render_cmd(image_url, str(tmp_path), text_line1, text_line2, font_path, user_agent), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=PLACEHOLDER_RENDER_TIMEOUT)
+            if result.returncode != 0 or not tmp_path.exists() or tmp_path.stat().st_size == 0:
+                logger.error(f"[Placeholder Cache] Falha ao renderizar loop (código {result.returncode}): {result.stderr.decode('utf-8', errors='ignore')[-500:]}")
+                tmp_path.unlink(missing_ok=True); return None
+            os.replace(tmp_path, loop_path)
+        except FileNotFoundError: logger.error("Erro: Comando 'ffmpeg' não encontrado."); return None
+        except (subprocess.TimeoutExpired, OSError) as e: logger.error(f"[Placeholder Cache] Erro ao renderizar loop: {e}"); tmp_path.unlink(missing_ok=True); return None
+    logger.info(f"[Placeholder Cache] Loop renderizado em {time.monotonic() - started:.1f}s: {loop_path.name}")
+    return loop_path
+
+@dataclass
+class Pipeline:
+    """Processo upstream a executar. 'key' identifica o conteúdo (vídeo ou imagem+textos) para compartilhamento no relay."""
+    key: str
+    tool: str # 'ffmpeg' | 'streamlink' | 'yt-dlp'
+    cmd: List[str]
+    fallbacks: List['Pipeline'] = field(default_factory=list) # Estágios seguintes em caso de falha/travamento
+    def to_json(self) -> str: return json.dumps([{'tool': p.tool, 'cmd': p.cmd} for p in [self] + self.fallbacks])
+    @classmethod
+    def from_json(cls, key: str, data: str) -> 'Pipeline':
+        stages = [cls(key, stage['tool'], stage['cmd']) for stage in json.loads(data)]
+        stages[0].fallbacks = stages[1:]; return stages[0]
+
+TOOL_LABELS = {'ffmpeg': 'FFmpeg', 'streamlink': 'Streamlink', 'yt-dlp': 'yt-dlp'}
+TS_PACKET_SIZE = 188
+RELAY_CHUNK_SIZE = TS_PACKET_SIZE * 348 # ~64 KiB
+
+def placeholder_pipeline(image_url: str, text_line1: str = "", text_line2: str = "", user_agent: str = "Mozilla/5.0", font_path: str = DEFAULT_FONT_PATH) -> Optional[Pipeline]:
+    if not image_url: logger.error("URL da imagem para FFmpeg vazia."); return None
+    logger.info(f"Iniciando FFmpeg para placeholder/upcoming: {image_url}")
+    image_url = local_image_for(image_url)
+    loop_path = get_placeholder_loop(image_url, text_line1, text_line2, font_path, user_agent) if SMART_PLAYER_PLACEHOLDER_CACHE else None
+    if loop_path: return Pipeline(f"image|{image_url}|{text_line1}|{text_line2}", 'ffmpeg', build_loop_playback_cmd(loop_path))
+    return Pipeline(f"image|{image_url}|{text_line1}|{text_line2}", 'ffmpeg', build_ffmpeg_placeholder_cmd(image_url, text_line1, text_line2, font_path, user_agent))
+
+def fallback_placeholder(image_url: str, text_line1: str = "", text_line2: str = "", user_agent: str = "Mozilla/5.0") -> List[Pipeline]:
+    """Último estágio do failover: imagem codificada ao vivo (sem renderizar loop antecipadamente)."""
+    if not image_url: return []
+    image_input = local_image_for(image_url)
+    return [Pipeline(f"image|{image_input}|{text_line1}|{text_line2}", 'ffmpeg', build_ffmpeg_placeholder_cmd(image_input, text_line1, text_line2, user_agent=user_agent))]
+
+class ClientGone(Exception):
+    """O consumidor da saída (stdout do cliente / hub sem clientes) não quer mais dados."""
+
+def _terminate(process: subprocess.Popen):
+    if process.poll() is not None: return
+    process.terminate()
+    try: process.wait(timeout=2)
+    except subprocess.TimeoutExpired: process.kill(); process.wait()
+
+def supervise(pipeline: Pipeline, sink, stop: Optional[threading.Event] = None) -> int:
+    """Executa o pipeline entregando a saída a sink(bytes); stderr vai para um buffer circular.
+    Em travamento (sem saída) ou saída com erro, reinicia o estágio ou passa ao próximo (fallbacks) sem fechar o sink."""
+    stages = [pipeline] + pipeline.fallbacks; stage_index = 0; restarts = 0; total = 0
+    while stage_index < len(stages) and not (stop and stop.is_set()):
+        stage = stages[stage_index]; label = TOOL_LABELS.get(stage.tool, stage.tool)
+        logger.debug(f"Comando {label}: {' '.join(stage.cmd)}")
+        try: process = subprocess.Popen(stage.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        except FileNotFoundError:
+            logger.error(f"Erro: Comando '{stage.cmd[0]}' não encontrado."); stage_index += 1; restarts = 0; continue
+        stderr_ring: deque = deque(maxlen=SMART_PLAYER_STDERR_RING_LINES)
+        def drain_stderr(stream=process.stderr, ring=stderr_ring):
+            for line in iter(stream.readline, b""): ring.append(line.decode('utf-8', errors='ignore').rstrip())
+        threading.Thread(target=drain_stderr, daemon=True).start()
+        selector = selectors.DefaultSelector(); selector.register(process.stdout, selectors.EVENT_READ)
+        fd = process.stdout.fileno(); stage_bytes = 0; stalled = False; started = time.monotonic(); last_data = started
+        try:
+            while not (stop and stop.is_set()):
+                timeout = SMART_PLAYER_STALL_TIMEOUT if stage_bytes else SMART_PLAYER_STARTUP_TIMEOUT
+                if not selector.select(timeout=min(0.5, timeout)):
+                    if time.monotonic() - last_data >= timeout: stalled = True; break
+                    continue
+                chunk = os.read(fd, RELAY_CHUNK_SIZE)
+                if not chunk: break
+                sink(chunk); stage_bytes += len(chunk); total += len(chunk); last_data = time.monotonic()
+        except (ClientGone, BrokenPipeError, ConnectionResetError):
+            logger.info(f"Cliente desconectou ({total} bytes enviados). Encerrando {label}."); _terminate(process); return total
+        finally: selector.close()
+        _terminate(process); returncode = process.returncode; stderr_text = "\n".join(stderr_ring)
+        if stop and stop.is_set(): return total
+        if not stalled and returncode == 0: logger.info(f"{label} terminou normalmente ({stage_bytes} bytes)."); return total
+        if stalled: logger.warning(f"{label} sem saída há {SMART_PLAYER_STALL_TIMEOUT if stage_bytes else SMART_PLAYER_STARTUP_TIMEOUT:.0f}s (travado). Reiniciando/failover.")
+        elif stage.tool == 'streamlink' and returncode == 1 and "error: No playable streams found" in stderr_text:
+            logger.warning(f"Streamlink: Nenhum stream jogável encontrado para {stage.cmd[-2]}.")
+        else: logger.error(f"{label} falhou com código {returncode}")
+        if stderr_text: logger.error(f"{label} stderr (últimas {len(stderr_ring)} linhas):\n{stderr_text}")
+        if stage_bytes % TS_PACKET_SIZE:
+            # Completa o último pacote TS truncado para o próximo estágio começar alinhado
+            try: sink(b"\xff" * (TS_PACKET_SIZE - stage_bytes % TS_PACKET_SIZE))
+            except (ClientGone, BrokenPipeError, ConnectionResetError): return total
+        # Estágio que chegou a produzir saída é reiniciado; se nunca produziu (ou esgotou reinícios), passa ao próximo
+        if stage_bytes and restarts < SMART_PLAYER_MAX_RESTARTS: restarts += 1; logger.info(f"Reiniciando {label} ({restarts}/{SMART_PLAYER_MAX_RESTARTS}).")
+        else:
+            stage_index += 1; restarts = 0
+            if stage_index < len(stages): logger.warning(f"Failover: {label} -> {TOOL_LABELS.get(stages[stage_index].tool, stages[stage_index].tool)}.")
+        time.sleep(SMART_PLAYER_RESTART_DELAY_MS / 1000)
+    if stage_index >= len(stages): logger.error(f"Todos os estágios falharam para '{pipeline.key}'.")
+    return total
+
+def stdout_sink(chunk: bytes):
+    out = sys.stdout.buffer; out.write(chunk); out.flush()
+
+def run_pipeline(pipeline: Optional[Pipeline], sink=stdout_sink, stop: Optional[threading.Event] = None):
+    """Executa o upstream (supervisionado) escrevendo no stdout do cliente (modo sem relay)."""
+    if pipeline is None: return
+    supervise(pipeline, sink, stop)
+
+def run_ffmpeg_placeholder(image_url: str, text_line1: str = "", text_line2: str = "", font_path: str = DEFAULT_FONT_PATH, user_agent: str = "Mozilla/5.0"):
+    run_pipeline(placeholder_pipeline(image_url, text_line1, text_line2, user_agent, font_path))
+
+def run_streamlink(watch_url: str, user_agent: str = "Mozilla/5.0"):
+    """Executa o Streamlink para streams ao vivo."""
+    logger.info(f"Iniciando Streamlink para live: {watch_url}")
+    run_pipeline(Pipeline(f"live|{watch_url}", 'streamlink', build_streamlink_cmd(watch_url, user_agent)))
 
 def run_ytdlp(watch_url: str, user_agent: str = "Mozilla/5.0"):
     logger.info(f"Iniciando yt-dlp para VOD: {watch_url}")
-    ytdlp_cmd = ["yt-dlp", "-f", "best", "-o", "-", "--user-agent", user_agent, watch_url]
-    logger.debug(f"Comando yt-dlp: {' '.join(ytdlp_cmd)}")
+    run_pipeline(Pipeline(f"vod|{watch_url}", 'yt-dlp', build_ytdlp_cmd(watch_url, user_agent)))
+
+# --- Relay: um upstream por vídeo, distribuído para N clientes ---
+# *** NOVO: Hub em processo separado (socket Unix por chave); clientes lentos são descartados ***
+
+def relay_socket_path(key: str) -> Path:
+    return Path(SMART_PLAYER_RELAY_DIR) / f"relay_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.sock"
+
+class RelayClient:
+    """Assinante do hub: fila limitada em bytes (não em pedaços, que variam de tamanho) + thread de escrita no socket."""
+    def __init__(self, conn: socket.socket, max_bytes: int):
+        self.conn = conn; self.queue: "queue.Queue[Optional[bytes]]" = queue.Queue(); self.alive = True; self.synced = False
+        self.max_bytes = max_bytes; self.buffered = 0; self._lock = threading.Lock() # Bytes na fila + o pedaço sendo enviado
+        self.thread = threading.Thread(target=self._writer, daemon=True); self.thread.start()
+    def offer(self, chunk: bytes, stream_offset: int) -> bool:
+        if not self.synced:
+            # Entra no meio do stream: começa no próximo limite de pacote TS
+            skip = (-stream_offset) % TS_PACKET_SIZE; chunk = chunk[skip:]; self.synced = True
+        with self._lock:
+            if self.buffered and self.buffered + len(chunk) > self.max_bytes: return False
+            self.buffered += len(chunk)
+        self.queue.put_nowait(chunk); return True
+    def close(self):
+        self.alive = False; self.queue.put_nowait(None)
+        try: self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+    def _writer(self):
+        try:
+            while self.alive:
+                chunk = self.queue.get()
+                if chunk is None: break
+                self.conn.sendall(chunk)
+                with self._lock: self.buffered -= len(chunk)
+        except OSError: pass
+        finally:
+            self.alive = False
+            try: self.conn.close()
+            except OSError: pass
+
+def run_relay_hub(socket_path: Path, pipeline: Pipeline):
+    """Processo hub: executa o upstream uma vez e distribui o MPEG-TS aos clientes conectados no socket."""
+    label = TOOL_LABELS.get(pipeline.tool, pipeline.tool); clients: List[RelayClient] = []; lock = threading.Lock(); offset = 0
+    stop = threading.Event()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try: socket_path.unlink()
+    except FileNotFoundError: pass
+    server.bind(str(socket_path)); server.listen(16); server.settimeout(0.5)
+    logger.info(f"[Relay] Hub iniciado ({label}) em {socket_path}")
+    def broadcast(chunk: bytes):
+        nonlocal offset
+        with lock: current = list(clients)
+        for client in current:
+            if client.alive and not client.offer(chunk, offset):
+                logger.warning(f"[Relay] Cliente lento (buffer de {SMART_PLAYER_RELAY_CLIENT_BUFFER_BYTES} bytes cheio). Desconectando."); client.close()
+        offset += len(chunk)
+    def accept_loop():
+        while not stop.is_set():
+            try: conn, _ = server.accept()
+            except socket.timeout: continue
+            except OSError: break
+            with lock: clients.append(RelayClient(conn, SMART_PLAYER_RELAY_CLIENT_BUFFER_BYTES)); count = len(clients)
+            logger.info(f"[Relay] Cliente conectado ({count} ativo(s)).")
+    def grace_watchdog():
+        empty_since = time.monotonic()
+        while not stop.wait(0.5):
+            with lock: clients[:] = [c for c in clients if c.alive]; active = len(clients)
+            if active: empty_since = None; continue
+            if empty_since is None: empty_since = time.monotonic(); logger.info(f"[Relay] Sem clientes. Encerrando em {SMART_PLAYER_RELAY_GRACE_SECONDS}s se ninguém voltar.")
+            if time.monotonic() - empty_since >= SMART_PLAYER_RELAY_GRACE_SECONDS:
+                # Remove o socket antes de parar: novos clientes passam a iniciar outro hub
+                socket_path.unlink(missing_ok=True); stop.set()
+    for target in (accept_loop, grace_watchdog): threading.Thread(target=target, daemon=True).start()
+    try: supervise(pipeline, broadcast, stop) # O supervisor encerra o upstream quando 'stop' é sinalizado
+    finally:
+        stop.set(); socket_path.unlink(missing_ok=True); server.close()
+        with lock: current = list(clients); clients.clear()
+        for client in current: client.close()
+        logger.info(f"[Relay] Hub encerrado ({offset} bytes distribuídos).")
+
+def _spawn_relay_hub(socket_path: Path, pipeline: Pipeline):
+    hub_args = [sys.executable, str(Path(__file__).resolve()), "--relay-hub", str(socket_path), "--relay-key", pipeline.key, "--relay-pipeline", pipeline.to_json()]
+    subprocess.Popen(hub_args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def _connect_relay(socket_path: Path) -> Optional[socket.socket]:
     try:
-        process = subprocess.Popen(ytdlp_cmd, stdout=sys.stdout, stderr=subprocess.PIPE)
-        _, stderr_output = process.communicate()
-        if process.returncode != 0:
-            logger.error(f"yt-dlp falhou com código {process.returncode}")
-            if stderr_output: logger.error(f"yt-dlp stderr:\n{stderr_output.decode('utf-8', errors='ignore')}")
-    except FileNotFoundError: logger.error("Erro: Comando 'yt-dlp' não encontrado.")
-    except Exception as e: logger.error(f"Erro ao executar yt-dlp: {e}")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); sock.connect(str(socket_path)); return sock
+    except OSError: return None
+
+def relay_subscribe(pipeline: Pipeline, sink=stdout_sink) -> bool:
+    """Conecta ao hub da chave (iniciando-o se preciso) e copia o stream para o sink (stdout). False = relay indisponível."""
+    Path(SMART_PLAYER_RELAY_DIR).mkdir(parents=True, exist_ok=True); socket_path = relay_socket_path(pipeline.key)
+    for attempt in range(2):
+        sock = _connect_relay(socket_path)
+        if sock is not None: logger.info(f"[Relay] Reutilizando hub existente para '{pipeline.key}'.")
+        else:
+            with open(f"{socket_path}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX) # Só um cliente inicia o hub desta chave
+                sock = _connect_relay(socket_path)
+                if sock is None:
+                    logger.info(f"[Relay] Iniciando hub para '{pipeline.key}'."); _spawn_relay_hub(socket_path, pipeline)
+                    deadline = time.monotonic() + SMART_PLAYER_RELAY_CONNECT_TIMEOUT
+                    while sock is None and time.monotonic() < deadline: time.sleep(0.05); sock = _connect_relay(socket_path)
+        if sock is None: logger.error(f"[Relay] Não foi possível conectar ao hub em {socket_path}."); return False
+        received = 0
+        try:
+            with sock:
+                while True:
+                    data = sock.recv(RELAY_CHUNK_SIZE)
+                    if not data: break
+                    sink(data); received += len(data)
+        except (BrokenPipeError, ConnectionResetError): logger.info("[Relay] Cliente desconectou."); return True
+        if received: logger.info(f"[Relay] Stream encerrado pelo hub ({received} bytes recebidos)."); return True
+        # Hub encerrando bem na hora da conexão (fim do período de graça): tenta de novo com um hub novo
+    logger.warning(f"[Relay] Hub de '{pipeline.key}' não entregou dados em 2 tentativas. Executando o pipeline diretamente.")
+    return False
+
+def serve_pipeline(pipeline: Optional[Pipeline], sink=stdout_sink, stop: Optional[threading.Event] = None):
+    if pipeline is None: return
+    if SMART_PLAYER_RELAY and relay_subscribe(pipeline, sink): return
+    run_pipeline(pipeline, sink, stop)
+
+# --- Modo daemon: interpretador, .env, log e handles de cache carregados uma vez ---
+# *** NOVO: Protocolo: o cliente envia uma linha JSON {"input": url, "user_agent": ua} e recebe o MPEG-TS na mesma conexão ***
+
+def handle_daemon_client(conn: socket.socket, stop: threading.Event):
+    with conn:
+        try:
+            conn.settimeout(5)
+            with conn.makefile("rb") as reader: request = json.loads(reader.readline(65536) or b"null")
+            url = request["input"]; user_agent = request.get("user_agent") or "Mozilla/5.0"
+            conn.settimeout(None)
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e: logger.warning(f"[Daemon] Requisição inválida: {e}"); return
+        logger.info(f"[Daemon] Requisição para URL: {url} (User-Agent: {user_agent})")
+        try: serve_pipeline(resolve_pipeline(url, user_agent), conn.sendall, stop)
+        except NoUpstreamError: logger.warning(f"[Daemon] Requisição sem upstream possível: {url}")
+        except (BrokenPipeError, ConnectionResetError): logger.info("[Daemon] Cliente desconectou.")
+        except Exception as e: logger.error(f"[Daemon] Erro ao atender {url}: {e}", exc_info=True)
+
+def run_daemon(socket_path: Path):
+    """Aceita conexões do smart_player_client.py e atende cada uma em uma thread (pipelines iniciados sob demanda)."""
+    probe = _connect_relay(socket_path)
+    if probe is not None: probe.close(); logger.error(f"[Daemon] Já existe um daemon em {socket_path}."); sys.exit(1)
+    socket_path.parent.mkdir(parents=True, exist_ok=True); socket_path.unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); server.bind(str(socket_path)); server.listen(64)
+    stop = threading.Event(); active: Set[socket.socket] = set(); lock = threading.Lock()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set()); signal.signal(signal.SIGINT, lambda *_: stop.set())
+    def serve(conn: socket.socket):
+        try: handle_daemon_client(conn, stop)
+        finally:
+            with lock: active.discard(conn)
+    logger.info(f"[Daemon] Aguardando clientes em {socket_path}"); server.settimeout(0.5); threads: List[threading.Thread] = []
+    try:
+        while not stop.is_set():
+            try: conn, _ = server.accept()
+            except socket.timeout: continue
+            with lock: active.add(conn)
+            thread = threading.Thread(target=serve, args=(conn,), daemon=True); thread.start()
+            threads = [t for t in threads if t.is_alive()] + [thread]
+    finally:
+        stop.set(); socket_path.unlink(missing_ok=True); server.close()
+        with lock: current = list(active)
+        for conn in current: # Faz os envios pendentes falharem; supervise() encerra os upstreams ao ver 'stop'
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+        for thread in threads: thread.join(timeout=3)
+        logger.info("[Daemon] Encerrado.")
 
 # --- Função Principal ---
-def main():
-    parser = argparse.ArgumentParser(description="Roteador inteligente para streams do YouTube.")
-    parser.add_argument("-i", "--input", dest="input_url", required=True, help="URL (imagem ou vídeo YouTube)")
-    parser.add_argument("-ua", "--user-agent", dest="user_agent", default="Mozilla/5.0", help="User-Agent HTTP opcional")
-    args = parser.parse_args()
-    url = args.input_url; user_agent = args.user_agent
-    logger.info(f"Recebida requisição para URL: {url} (User-Agent: {user_agent})")
+class NoUpstreamError(Exception):
+    """URL de vídeo sem ID e sem PLACEHOLDER_IMAGE_URL: nada a transmitir (o CLI sai com código 1)."""
 
+def resolve_pipeline(url: str, user_agent: str) -> Optional[Pipeline]:
+    """Decide o upstream (placeholder/thumb com ffmpeg, live com streamlink, VOD com yt-dlp) para a URL recebida. None = nada a transmitir."""
     is_image = False; video_id_from_thumb = None
     if PLACEHOLDER_IMAGE_URL and url == PLACEHOLDER_IMAGE_URL:
-        is_image = True; logger.info("URL: placeholder."); run_ffmpeg_placeholder(image_url=url, user_agent=user_agent); return
+        is_image = True; logger.info("URL: placeholder."); return placeholder_pipeline(url, user_agent=user_agent)
     elif "ytimg.com/vi/" in url:
         is_image = True; logger.info("URL: thumbnail YT.")
         match = re.search(r'/vi/([^/]+)/', url)
         if match:
             video_id_from_thumb = match.group(1); logger.info(f"Thumb ID: {video_id_from_thumb}")
-            texts = get_texts_from_cache(video_id_from_thumb); run_ffmpeg_placeholder(image_url=url, text_line1=texts["line1"], text_line2=texts["line2"], user_agent=user_agent)
-        else: logger.warning("Não extraiu ID da thumb. Exibindo sem texto."); run_ffmpeg_placeholder(image_url=url, user_agent=user_agent)
-        return
+            texts = get_texts_from_cache(video_id_from_thumb); return placeholder_pipeline(url, texts["line1"], texts["line2"], user_agent=user_agent)
+        logger.warning("Não extraiu ID da thumb. Exibindo sem texto."); return placeholder_pipeline(url, user_agent=user_agent)
 
     if not is_image and ("youtube.com/watch?v=" in url or "youtu.be/" in url):
         logger.info("URL: vídeo YT.")
         video_id = None; match_v = re.search(r'v=([a-zA-Z0-9_-]+)', url); match_be = re.search(r'youtu.be/([a-zA-Z0-9_-]+)', url)
         if match_v: video_id = match_v.group(1)
         elif match_be: video_id = match_be.group(1)
-        if not video_id: logger.error("Não extraiu ID do vídeo YT."); run_ffmpeg_placeholder(PLACEHOLDER_IMAGE_URL, user_agent=user_agent) if PLACEHOLDER_IMAGE_URL else sys.exit(1); return
+        if not video_id:
+            logger.error("Não extraiu ID do vídeo YT.")
+            if PLACEHOLDER_IMAGE_URL: return placeholder_pipeline(PLACEHOLDER_IMAGE_URL, user_agent=user_agent)
+            raise NoUpstreamError(url)
 
         logger.info(f"Video ID: {video_id}")
         stream_info = get_stream_status_from_cache(video_id); status = None; thumbnail_url = None
@@ -208,27 +640,55 @@ def main():
             start = stream_dict.get('actual_start_time_utc'); end = stream_dict.get('actual_end_time_utc')
             return stream_dict.get('status') == 'live' and isinstance(start, datetime) and not isinstance(end, datetime)
 
-        if status == 'live' and is_genuinely_live(stream_info): run_streamlink(url, user_agent=user_agent)
+        if status == 'live' and is_genuinely_live(stream_info):
+            fallbacks = [Pipeline(f"live|{video_id}", 'yt-dlp', build_ytdlp_cmd(url, user_agent))] + fallback_placeholder(thumbnail_url or PLACEHOLDER_IMAGE_URL, user_agent=user_agent)
+            resolved_url = get_resolved_stream_url(video_id)
+            if resolved_url:
+                # *** NOVO: Remux direto da URL já resolvida pelo get_streams.py; resolução completa (streamlink) só como fallback ***
+                logger.info(f"Usando URL pré-resolvida para live {video_id} (remux FFmpeg).")
+                return Pipeline(f"live|{video_id}", 'ffmpeg', build_remux_cmd(resolved_url, user_agent), [Pipeline(f"live|{video_id}", 'streamlink', build_streamlink_cmd(url, user_agent))] + fallbacks)
+            logger.info(f"Iniciando Streamlink para live: {url}")
+            return Pipeline(f"live|{video_id}", 'streamlink', build_streamlink_cmd(url, user_agent), fallbacks)
         elif status == 'none' or (status == 'live' and not is_genuinely_live(stream_info)):
             if status == 'live': logger.warning(f"Status '{status}' mas não parece live. Tratando como VOD.")
-            run_ytdlp(url, user_agent=user_agent)
+            logger.info(f"Iniciando yt-dlp para VOD: {url}")
+            return Pipeline(f"vod|{video_id}", 'yt-dlp', build_ytdlp_cmd(url, user_agent), fallback_placeholder(thumbnail_url or PLACEHOLDER_IMAGE_URL, user_agent=user_agent))
         elif status == 'upcoming':
             logger.warning(f"Vídeo {video_id} ('upcoming'). Exibindo thumbnail."); texts = get_texts_from_cache(video_id)
             thumb_to_use = thumbnail_url or PLACEHOLDER_IMAGE_URL
-            if thumb_to_use: run_ffmpeg_placeholder(thumb_to_use, texts["line1"], texts["line2"], user_agent=user_agent)
-            else: logger.error("Não há thumb/placeholder para vídeo upcoming.")
+            if thumb_to_use: return placeholder_pipeline(thumb_to_use, texts["line1"], texts["line2"], user_agent=user_agent)
+            logger.error("Não há thumb/placeholder para vídeo upcoming.")
         else:
             logger.warning(f"Status '{status}' ou vídeo não encontrado/inválido. Fallback para thumb/placeholder.")
             thumb_to_use = thumbnail_url or PLACEHOLDER_IMAGE_URL
-            if thumb_to_use: run_ffmpeg_placeholder(thumb_to_use, user_agent=user_agent)
-            else: logger.error("Não há thumb/placeholder para fallback.")
-    else:
-        logger.error(f"URL não reconhecida: {url}")
-        if PLACEHOLDER_IMAGE_URL: run_ffmpeg_placeholder(PLACEHOLDER_IMAGE_URL, user_agent=user_agent)
+            if thumb_to_use: return placeholder_pipeline(thumb_to_use, user_agent=user_agent)
+            logger.error("Não há thumb/placeholder para fallback.")
+        return None
+    logger.error(f"URL não reconhecida: {url}")
+    return placeholder_pipeline(PLACEHOLDER_IMAGE_URL, user_agent=user_agent) if PLACEHOLDER_IMAGE_URL else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Roteador inteligente para streams do YouTube.")
+    parser.add_argument("-i", "--input", dest="input_url", help="URL (imagem ou vídeo YouTube)")
+    parser.add_argument("-ua", "--user-agent", dest="user_agent", default="Mozilla/5.0", help="User-Agent HTTP opcional")
+    # Uso interno: processo hub do relay (iniciado pelo primeiro cliente de cada chave)
+    parser.add_argument("--relay-hub", dest="relay_hub", help=argparse.SUPPRESS); parser.add_argument("--relay-key", dest="relay_key", help=argparse.SUPPRESS)
+    parser.add_argument("--relay-pipeline", dest="relay_pipeline", help=argparse.SUPPRESS)
+    parser.add_argument("--daemon", action="store_true", help="Executa como serviço persistente (socket Unix) para o smart_player_client.py")
+    parser.add_argument("--socket", dest="daemon_socket", default=SMART_PLAYER_DAEMON_SOCKET, help="Socket Unix do modo daemon")
+    args = parser.parse_args()
+    if args.relay_hub: run_relay_hub(Path(args.relay_hub), Pipeline.from_json(args.relay_key, args.relay_pipeline)); return
+    if args.daemon: run_daemon(Path(args.daemon_socket)); return
+    if not args.input_url: parser.error("o argumento -i/--input é obrigatório")
+    url = args.input_url; user_agent = args.user_agent
+    logger.info(f"Recebida requisição para URL: {url} (User-Agent: {user_agent})")
+    try: pipeline = resolve_pipeline(url, user_agent)
+    except NoUpstreamError: sys.exit(1)
+    serve_pipeline(pipeline)
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
         logger.error(f"Erro inesperado na função main: {e}", exc_info=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+smart_player_client.py — Cliente leve do smart_player em modo daemon (mesmo contrato de CLI: -i/--input e -ua/--user-agent).
+
+Só usa a biblioteca padrão (sem dotenv/logging/argparse): conecta ao socket do daemon, envia a requisição
+e copia o MPEG-TS recebido para o stdout. Se o daemon não estiver no ar, executa o smart_player.py
+tradicional com os mesmos argumentos, então pode substituir o smart_player.py no ts_proxy sem outras mudanças.
+
+Daemon: python smart_player.py --daemon   (socket em SMART_PLAYER_DAEMON_SOCKET, padrão /tmp/smart_player.sock)
+"""
+import json
+import os
+import socket
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOCKET = "/tmp/smart_player.sock"
+CHUNK_SIZE = 188 * 348
+
+def parse_args(argv):
+    """Aceita as mesmas formas do argparse do smart_player.py: '-i URL', '--input URL', '--input=URL' (idem -ua/--user-agent)."""
+    values = {"input": None, "user_agent": "Mozilla/5.0"}; names = {"-i": "input", "--input": "input", "-ua": "user_agent", "--user-agent": "user_agent"}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]; name, sep, value = arg.partition("=")
+        if name in names and sep: values[names[name]] = value
+        elif arg in names and i + 1 < len(argv): values[names[arg]] = argv[i + 1]; i += 1
+        i += 1
+    return values
+
+def daemon_socket_path():
+    """SMART_PLAYER_DAEMON_SOCKET do ambiente ou do .env (leitura direta da linha, sem python-dotenv)."""
+    if os.environ.get("SMART_PLAYER_DAEMON_SOCKET"): return os.environ["SMART_PLAYER_DAEMON_SOCKET"]
+    try:
+        with open(os.path.join(SCRIPT_DIR, ".env"), "r", encoding="utf-8") as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep and key.strip() == "SMART_PLAYER_DAEMON_SOCKET": return value.split(" #")[0].strip().strip('"').strip("'") or DEFAULT_SOCKET
+    except OSError: pass
+    return DEFAULT_SOCKET
+
+def fallback_to_smart_player():
+    # Daemon indisponível: processo completo, como antes (substitui este processo; stdout/stderr herdados)
+    script = os.path.join(SCRIPT_DIR, "smart_player.py")
+    os.execv(sys.executable, [sys.executable, script] + sys.argv[1:])
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if not args["input"]: fallback_to_smart_player() # smart_player.py reporta o erro de uso
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); sock.connect(daemon_socket_path())
+    except OSError: fallback_to_smart_player()
+    out = sys.stdout.fileno()
+    try:
+        with sock:
+            sock.sendall(json.dumps(args).encode("utf-8") + b"\n")
+            while True:
+                data = sock.recv(CHUNK_SIZE)
+                if not data: break
+                view = memoryview(data)
+                while view: view = view[os.write(out, view):]
+    except (BrokenPipeError, ConnectionResetError, KeyboardInterrupt): pass
+
+if __name__ == "__main__":
+    main()